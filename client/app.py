@@ -8,17 +8,21 @@
 
 import platform
 
-from .qt.main import QtGUI
-
 
 class App(object):
 
     NAME = 'Electron Cash'
     VERSION = '0.001'
 
-    def __init__(self):
+    def __init__(self, args, metrics):
+        '''args are the parsed command line arguments; metrics a
+        client.startup.StartupMetrics.'''
+        self.args = args
+        self.metrics = metrics
         # 'Windows', 'Darwin' etc.
         self.system = platform.system()
+        # Qt is imported only when a GUI is wanted
+        from .qt.main import QtGUI
         self.gui = QtGUI(self)
 
     def run(self):
@@ -0,0 +1,393 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Headless daemon: the wallet engine with a local JSON-RPC API.
+
+The daemon keeps watch-only BIP32 accounts synchronized with a server
+and answers queries about them over a Unix socket or a loopback TCP
+port, one JSON-RPC request per line.  Requests are handled
+concurrently.  Key derivation, the one CPU-heavy operation, runs in a
+worker process pool so it never holds up the event loop.
+
+Addresses are cashaddr strings, with or without the prefix.
+'''
+
+import asyncio
+import inspect
+import logging
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import lib.bip32 as bip32
+from lib.account import BIP32Account
+from lib.hash import Base58Error, hash160, hash_to_hex_str, hex_str_to_hash
+from lib.jsonrpc import (JSONRPCSession, RPCError, INVALID_PARAMS,
+                         METHOD_NOT_FOUND, MAX_LINE, connect)
+from lib.keys import (Address, HDPublicKey, CASHADDR_PREFIX,
+                      address_from_string, address_to_string)
+from lib.manager import AccountManager
+from lib.util import LoggedClass
+from lib.utxo import UTXO
+
+
+PROTOCOL_VERSION = '1.4'
+
+
+def _master_pubkey(xpub):
+    '''Return the MasterPubKey of an extended public key string.  Raise
+    ValueError if xpub is not one.'''
+    if not isinstance(xpub, str):
+        raise ValueError('an extended public key must be a string')
+    try:
+        key, _ = bip32.from_extended_key_string(xpub)
+    except Base58Error as e:
+        raise ValueError(str(e)) from None
+    if not isinstance(key, bip32.MasterPubKey):
+        raise ValueError('an extended public key is required')
+    return key
+
+
+# These run in worker processes
+
+def derive_addresses(xpub, chain, start, count, prefix=CASHADDR_PREFIX):
+    '''Return the addresses of keys start to start + count - 1 of a chain
+    of an extended public key.'''
+    key = _master_pubkey(xpub).child(chain)
+    return [address_to_string(Address.from_P2PKH_hash(hash160(pubkey)),
+                              prefix)
+            for pubkey in bip32.child_pubkeys(key, start, start + count)]
+
+
+def _initial_pubkeys(xpub, gap_limits):
+    key = _master_pubkey(xpub)
+    return [bip32.child_pubkeys(key.child(chain), 0, gap_limit)
+            for chain, gap_limit in enumerate(gap_limits)]
+
+
+def worker_pool(max_workers=None):
+    '''Return a process pool suitable for Daemon.'''
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+async def load_account(xpub, executor=None, gap_limit=20,
+                       change_gap_limit=6):
+    '''Return a watch-only BIP32Account of an extended public key, its
+    initial keys derived on executor.  Raises ValueError if xpub is not
+    a valid extended public key.'''
+    master_pubkey = _master_pubkey(xpub)
+    columns = await asyncio.get_event_loop().run_in_executor(
+        executor, _initial_pubkeys, xpub, (gap_limit, change_gap_limit))
+    account = BIP32Account(master_pubkey, gap_limit, change_gap_limit)
+    for keys, pubkeys in zip(account.key_lists(), columns):
+        keys.pubkeys.extend(HDPublicKey(pubkey, n)
+                            for n, pubkey in enumerate(pubkeys))
+    return account
+
+
+class Engine(AccountManager):
+    '''An AccountManager that also keeps each account's UTXO set
+    current, from the server's view of each address that changes.'''
+
+    async def on_status(self, scripthash, status):
+        await super().on_status(scripthash, status)
+        route = self.routes.lookup(scripthash)
+        if route is None:
+            return
+        account_id, chain, n = route
+        account = self.accounts.get(account_id)
+        if account is None:
+            return
+        if status:
+            result = await self.synchronizer.session.send_request(
+                'blockchain.scripthash.listunspent',
+                [hash_to_hex_str(scripthash)])
+        else:
+            result = []
+        if self.accounts.get(account_id) is not account:
+            return
+        addr = account.pubkey(chain, n).address
+        account.utxos.remove_address(addr)
+        account.utxos.update(UTXO(hex_str_to_hash(item['tx_hash']),
+                                  item['tx_pos'], item['value'],
+                                  max(item['height'], 0), addr)
+                             for item in result)
+
+
+class Daemon(LoggedClass):
+    '''Serves the local JSON-RPC API over an Engine.
+
+    session is a server session as for lib.synchronizer.Synchronizer;
+    pass on_notification() as its handler.  CPU-heavy requests run on
+    executor, a process pool from worker_pool(); without one they run
+    on the event loop's default thread pool.  Keyword arguments are
+    passed to the Engine.
+
+    RPC methods are the methods named with an rpc_ prefix.
+    '''
+
+    def __init__(self, session, executor=None, prefix=CASHADDR_PREFIX,
+                 **kwargs):
+        super().__init__()
+        self.session = session
+        self.executor = executor
+        self.prefix = prefix
+        self.engine = Engine(session, executor=executor, **kwargs)
+        self.servers = []
+        self.clients = set()
+
+    async def start(self):
+        '''Subscribe to the chain tip.'''
+        await self.engine.subscribe_headers()
+
+    async def on_notification(self, method, params):
+        '''Handler of messages from the server.'''
+        await self.engine.on_notification(method, params)
+
+    async def serve(self, path=None, port=None):
+        '''Start serving the API on a Unix socket at path, readable by this
+        user only, or on the loopback TCP port.'''
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)
+            umask = os.umask(0o077)
+            try:
+                server = await asyncio.start_unix_server(
+                    self._on_client, path, limit=MAX_LINE)
+            finally:
+                os.umask(umask)
+            self.log_info('serving on %s', path)
+        else:
+            server = await asyncio.start_server(
+                self._on_client, '127.0.0.1', port, limit=MAX_LINE)
+            port = server.sockets[0].getsockname()[1]
+            self.log_info('serving on 127.0.0.1:%d', port)
+        self.servers.append(server)
+        return server
+
+    async def _on_client(self, reader, writer):
+        session = JSONRPCSession(reader, writer, self.handle_request)
+        self.clients.add(session)
+        try:
+            await session.run()
+        finally:
+            self.clients.discard(session)
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers.clear()
+        for session in list(self.clients):
+            session.close()
+        self.engine.synchronizer.scheduler.cancel()
+
+    async def handle_request(self, method, params):
+        '''Dispatch a request to its rpc_ method.'''
+        func = getattr(self, f'rpc_{method}', None)
+        if func is None:
+            raise RPCError(METHOD_NOT_FOUND, f'unknown method {method}')
+        if isinstance(params, dict):
+            args, kwargs = (), params
+        else:
+            args, kwargs = params, {}
+        try:
+            inspect.signature(func).bind(*args, **kwargs)
+        except TypeError as e:
+            raise RPCError(INVALID_PARAMS, str(e)) from None
+        return await func(*args, **kwargs)
+
+    async def _run_in_worker(self, func, *args):
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self.executor,
+                                              partial(func, *args))
+        except (ValueError, bip32.DerivationError) as e:
+            raise RPCError(INVALID_PARAMS, str(e) or 'derivation failed')
+
+    def _account(self, account_id):
+        account = self.engine.accounts.get(account_id)
+        if account is None:
+            raise RPCError(INVALID_PARAMS, f'unknown account {account_id}')
+        return account
+
+    def _address_string(self, addr):
+        return address_to_string(addr, self.prefix)
+
+    # RPC methods
+
+    async def rpc_getinfo(self):
+        synchronizer = self.engine.synchronizer
+        return {
+            'height': self.engine.height,
+            'accounts': len(self.engine.accounts),
+            'subscriptions': len(synchronizer.statuses),
+            'pending': synchronizer.scheduler.queue_depth(),
+        }
+
+    async def rpc_add_account(self, xpub, gap_limit=20, change_gap_limit=6):
+        '''Add a watch-only account for an extended public key.  Its
+        initial keys are derived in a worker.  Return its id.'''
+        for limit in (gap_limit, change_gap_limit):
+            if not isinstance(limit, int) or limit < 1:
+                raise RPCError(INVALID_PARAMS, 'invalid gap limit')
+        try:
+            account = await load_account(xpub, self.executor, gap_limit,
+                                         change_gap_limit)
+        except ValueError as e:
+            raise RPCError(INVALID_PARAMS, f'invalid xpub: {e}') from None
+        except bip32.DerivationError as e:
+            raise RPCError(INVALID_PARAMS,
+                           str(e) or 'derivation failed') from None
+        return self.engine.add_account(account)
+
+    async def rpc_remove_account(self, account_id):
+        self._account(account_id)
+        await self.engine.remove_account(account_id)
+        return True
+
+    async def rpc_derive_addresses(self, xpub, start, count, chain=0):
+        '''Return addresses of an extended public key without adding an
+        account.'''
+        if chain not in (0, 1) or not 0 < count <= 100000 or start < 0:
+            raise RPCError(INVALID_PARAMS, 'invalid derivation range')
+        return await self._run_in_worker(derive_addresses, xpub, chain,
+                                         start, count, self.prefix)
+
+    async def rpc_get_addresses(self, account_id, chain=0):
+        if chain not in (0, 1):
+            raise RPCError(INVALID_PARAMS, f'invalid chain {chain}')
+        keys = self._account(account_id).key_lists()[chain]
+        return [self._address_string(pubkey.address)
+                for pubkey in keys.pubkeys]
+
+    async def rpc_get_balance(self, account_id):
+        '''Return the confirmed and unconfirmed balances in satoshis.'''
+        confirmed, unconfirmed = self._account(account_id).utxos.balance()
+        return {'confirmed': confirmed, 'unconfirmed': unconfirmed}
+
+    async def rpc_get_history(self, account_id):
+        '''Return the account's transactions by address, in height order
+        with unconfirmed ones last.'''
+        history = self._account(account_id).history
+        entries = [{'address': self._address_string(addr),
+                    'tx_hash': hash_to_hex_str(tx_hash),
+                    'height': height, 'fee': fee}
+                   for addr in history
+                   for tx_hash, height, fee in history[addr]]
+        entries.sort(key=lambda entry: (entry['height'] <= 0,
+                                        abs(entry['height'])))
+        return entries
+
+    async def rpc_get_address_history(self, address):
+        try:
+            addr = address_from_string(address, self.prefix)
+        except Exception as e:
+            raise RPCError(INVALID_PARAMS, f'invalid address: {e}') from None
+        for account in self.engine.accounts.values():
+            hist = account.history.get(addr)
+            if hist is not None:
+                return [{'tx_hash': hash_to_hex_str(tx_hash),
+                         'height': height, 'fee': fee}
+                        for tx_hash, height, fee in hist]
+        return []
+
+    async def rpc_list_unspent(self, account_id):
+        '''Return the account's UTXOs, largest first.'''
+        return [{'tx_hash': hash_to_hex_str(utxo.tx_hash),
+                 'tx_pos': utxo.tx_pos, 'value': utxo.value,
+                 'height': utxo.height,
+                 'address': self._address_string(utxo.addr)}
+                for utxo in self._account(account_id).utxos.largest()]
+
+
+def parse_server(server):
+    '''Parse HOST:PORT:PROTOCOL, where protocol is s for SSL or t for
+    TCP, to a (host, port, use_ssl) triple.  The protocol defaults to
+    SSL.'''
+    parts = server.split(':')
+    if len(parts) == 2:
+        parts.append('s')
+    if len(parts) != 3 or parts[2] not in ('s', 't'):
+        raise ValueError(f'invalid server {server}')
+    return parts[0], int(parts[1]), parts[2] == 's'
+
+
+async def open_session(server, handler):
+    '''Connect to server, as for parse_server(), and negotiate the
+    protocol version.  Return the session; handler receives the
+    server's notifications.'''
+    import ssl as ssl_module
+
+    host, port, use_ssl = parse_server(server)
+    context = ssl_module.create_default_context() if use_ssl else None
+    session = await connect(host, port, handler, ssl=context)
+    try:
+        await session.send_request('server.version',
+                                   ['electron', PROTOCOL_VERSION])
+    except Exception:
+        session.close()
+        raise
+    return session
+
+
+async def _run(args, logger):
+    daemon = None
+
+    async def on_notification(method, params):
+        if daemon is not None:
+            await daemon.on_notification(method, params)
+
+    try:
+        session = await open_session(args.server, on_notification)
+    except (OSError, RPCError) as e:
+        logger.error(f'cannot connect to {args.server}: {e}')
+        return 1
+
+    executor = worker_pool(args.workers)
+    try:
+        daemon = Daemon(session, executor)
+        await daemon.start()
+        for xpub in args.xpub or ():
+            await daemon.rpc_add_account(xpub)
+        await daemon.serve(path=args.rpc_socket, port=args.rpc_port)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await asyncio.wait([asyncio.ensure_future(stop.wait()),
+                            session.run_task],
+                           return_when=asyncio.FIRST_COMPLETED)
+        if not stop.is_set():
+            logger.error('server connection lost')
+            return 1
+        return 0
+    except (OSError, RPCError) as e:
+        logger.error(f'daemon failed: {e}')
+        return 1
+    finally:
+        if daemon is not None:
+            await daemon.close()
+        session.close()
+        executor.shutdown()
+
+
+def run(args):
+    '''Run the daemon with the parsed command line args.  Return an exit
+    status.'''
+    if args.server is None:
+        raise SystemExit('--server is required in daemon mode')
+    if args.rpc_socket is None and args.rpc_port is None:
+        raise SystemExit('one of --rpc-socket and --rpc-port is required')
+    try:
+        parse_server(args.server)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(_run(args, logging.getLogger('Daemon')))
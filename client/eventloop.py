@@ -0,0 +1,71 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Running asyncio inside another event loop, such as Qt's.
+
+The GUI thread belongs to Qt's loop, so asyncio cannot run_forever()
+there.  Instead a LoopStepper runs the asyncio loop in short slices
+from a timer of the host loop: each step runs the callbacks that are
+ready and polls for I/O without blocking, then returns.  Coroutines
+therefore run on the GUI thread and can touch GUI objects directly.
+
+CPU-bound work, such as deriving keys, must not run in a step or the
+GUI freezes; it goes to worker_executor().  Pure Python derivation
+holds the GIL, but the interpreter hands it back to the GUI thread
+every switch interval, so the GUI thread is never held up for long.
+The AccountManager only sends its executor plain values, so a process
+pool would do too; a thread starts at once and needs no pickling.
+'''
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Milliseconds between steps; well within a 60Hz frame
+STEP_INTERVAL_MS = 5
+
+
+class LoopStepper(object):
+    '''Runs an asyncio event loop a step at a time.'''
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.new_event_loop()
+        # The loop is current on this thread so code run from the host
+        # loop's callbacks finds it
+        asyncio.set_event_loop(self.loop)
+        self.steps = 0
+        self.max_step = 0.0
+
+    def step(self):
+        '''Run the ready callbacks and poll for I/O without blocking.'''
+        start = time.perf_counter()
+        loop = self.loop
+        # stop() is scheduled after the callbacks already ready, so they
+        # run, and as a callback is ready the I/O poll does not block
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+        self.steps += 1
+        self.max_step = max(self.max_step, time.perf_counter() - start)
+
+    def close(self):
+        '''Cancel outstanding tasks and close the loop.'''
+        loop = self.loop
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            loop.run_until_complete(asyncio.gather(*tasks,
+                                                   return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def worker_executor(max_workers=1):
+    '''Return an executor for CPU-bound work off the GUI thread.'''
+    return ThreadPoolExecutor(max_workers=max_workers,
+                              thread_name_prefix='worker')
@@ -0,0 +1,41 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''asyncio on Qt's event loop, and signals carrying engine events to the
+GUI.'''
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from client.eventloop import LoopStepper, STEP_INTERVAL_MS
+
+
+class AsyncioTimer(QObject):
+    '''Steps an asyncio loop from a Qt timer.'''
+
+    def __init__(self, loop=None, interval=STEP_INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        self.stepper = LoopStepper(loop)
+        self.loop = self.stepper.loop
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.stepper.step)
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.stepper.close()
+
+
+class EngineSignals(QObject):
+    '''Signals of the wallet engine.  Emitting from any thread is safe:
+    connections to GUI objects are queued to the GUI thread.'''
+
+    # Emitted with the account id, chain and index of a key whose
+    # history changes
+    addressChanged = pyqtSignal(int, int, int)
@@ -7,12 +7,20 @@
 
 import os
 import sys
+from functools import partial
 
 from PyQt5.Qt import Qt
 import PyQt5.QtCore as QtCore
 from PyQt5.QtGui import QGuiApplication
 from PyQt5.QtQml import QQmlApplicationEngine
 
+from client.eventloop import worker_executor
+from client.startup import BalanceCache, Startup, XpubError, FIRST_FRAME
+from lib.jsonrpc import RPCError
+from .loop import AsyncioTimer, EngineSignals
+from .models import address_model, history_model
+from .status import WalletStatus
+
 
 class QtGUI(object):
 
@@ -23,12 +31,116 @@ class QtGUI(object):
         #    QtCore.QCoreApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
 
         self.qt_app = QGuiApplication(sys.argv)
+        # Context properties of the QML; models are None until an account
+        # is shown
+        self.models = {'addressModel': None, 'historyModel': None}
+        self.shown_account = None
+        self.shown_account_id = None
+        self.engine = None
+
+        # Coroutines run on the GUI thread, stepped by a Qt timer; key
+        # derivation runs on the worker executor
+        self.async_timer = AsyncioTimer()
+        self.loop = self.async_timer.loop
+        self.executor = worker_executor()
+        self.signals = EngineSignals()
+        self.signals.addressChanged.connect(self.on_address_changed)
+
+        # The window shows the last session's balance; the wallet loads
+        # once it is up
+        self.metrics = app.metrics
+        self.status = WalletStatus()
+        self.startup = self._startup(app.args)
+        if self.startup is not None:
+            self.status.set_balance(self.startup.balance, False)
+
+    def _startup(self, args):
+        if not args.server or not args.xpub:
+            return None
+        from client.daemon import open_session
+
+        os.makedirs(args.data_dir, exist_ok=True)
+        cache = BalanceCache(os.path.join(args.data_dir, 'balances.json'))
+        # The engine derives keys on the worker executor and signals
+        # address changes to the GUI
+        return Startup(args.xpub, partial(open_session, args.server), cache,
+                       self.metrics, executor=self.executor,
+                       on_progress=self.status.set_progress,
+                       on_account=self.on_account,
+                       on_change=self.signals.addressChanged.emit)
+
+    async def load_wallet(self):
+        startup = self.startup
+        try:
+            await startup.run()
+        except (OSError, RPCError) as e:
+            startup.log_error('cannot load wallet: %s', e)
+            self.status.set_progress('offline', 0.0)
+            return
+        except XpubError as e:
+            startup.log_error('cannot load wallet: %s', e)
+            self.status.set_error(f'bad xpub: {e}')
+            return
+        self.status.set_balance(startup.balance, True)
+
+    def on_account(self, account, account_id):
+        # Show the first account
+        if self.shown_account_id is None:
+            self.show_account(account, account_id)
+
+    def show_account(self, account, account_id=None):
+        '''Show an account's addresses and history.  account_id is its id
+        with the account manager, if any, so the views follow changes.'''
+        self.models = {'addressModel': address_model(account),
+                       'historyModel': history_model(account)}
+        self.shown_account = account
+        self.shown_account_id = account_id
+        if self.engine is not None:
+            self._set_models()
+
+    def on_address_changed(self, account_id, chain, n):
+        # The models coalesce changes and update their views once a frame.
+        # A new transaction can land anywhere in the history, so it is
+        # reset rather than patched, and only if the address's history
+        # changed; most changes during a sync are of unused addresses
+        if account_id != self.shown_account_id:
+            return
+        if chain == 0:
+            self.models['addressModel'].row_changed(n)
+        model = self.models['historyModel']
+        addr = self.shown_account.pubkey(chain, n).address
+        if model.rows.source.is_stale(addr):
+            model.refresh()
+
+    def _set_models(self):
+        context = self.engine.rootContext()
+        for name, model in self.models.items():
+            context.setContextProperty(name, model)
 
     def relative_path(self, path):
-        return os.path.join(os.path.dirname(__file__), 'main.qml')
+        return os.path.join(os.path.dirname(__file__), path)
+
+    def on_frame_swapped(self):
+        self.metrics.mark(FIRST_FRAME)
+        self.window.frameSwapped.disconnect(self.on_frame_swapped)
 
     def run(self):
-        engine = QQmlApplicationEngine()
-        engine.load(self.relative_path('main.qml'))
+        self.engine = QQmlApplicationEngine()
+        self.engine.rootContext().setContextProperty('walletStatus',
+                                                     self.status)
+        self._set_models()
+        self.engine.load(self.relative_path('main.qml'))
+        self.window = self.engine.rootObjects()[0]
+        self.window.frameSwapped.connect(self.on_frame_swapped)
 
-        return self.qt_app.exec_()
+        # The wallet loads on the asyncio loop as Qt runs
+        if self.startup is not None:
+            self.loop.create_task(self.load_wallet())
+        self.async_timer.start()
+        try:
+            return self.qt_app.exec_()
+        finally:
+            if self.startup is not None:
+                self.startup.close()
+            self.async_timer.stop()
+            self.executor.shutdown(wait=False)
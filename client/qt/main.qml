@@ -8,6 +8,7 @@
 import QtQuick 2.9
 import QtQuick.Window 2.2
 import QtQuick.Controls 1.4
+import QtQuick.Layouts 1.3
 
 ApplicationWindow {
     title: "Electron Cash"
@@ -27,9 +28,86 @@ ApplicationWindow {
         }
     }
 
-    Button {
-        text: qsTr("Hello World")
-        anchors.horizontalCenter: parent.horizontalCenter
-        anchors.verticalCenter: parent.verticalCenter
+    // The last session's balance is shown until the wallet has loaded
+    statusBar: StatusBar {
+        RowLayout {
+            anchors.fill: parent
+            Label {
+                text: walletStatus.balance === "" ? ""
+                      : walletStatus.fresh ? walletStatus.balance
+                      : qsTr("%1 (last session)").arg(walletStatus.balance)
+                Layout.fillWidth: true
+            }
+            Label {
+                text: walletStatus.stage === "offline" ? qsTr("offline")
+                      : walletStatus.stage === "error"
+                      ? qsTr("error: %1").arg(walletStatus.error)
+                      : qsTr("loading: %1").arg(walletStatus.stage)
+                visible: walletStatus.stage !== ""
+                         && walletStatus.stage !== "ready"
+            }
+            ProgressBar {
+                value: walletStatus.progress
+                visible: walletStatus.stage !== ""
+                         && walletStatus.stage !== "ready"
+                         && walletStatus.stage !== "offline"
+                         && walletStatus.stage !== "error"
+            }
+        }
+    }
+
+    // The models fetch rows a page at a time as the views scroll, and
+    // only repaint the rows a view shows
+    TabView {
+        anchors.fill: parent
+
+        Tab {
+            title: qsTr("Addresses")
+            ListView {
+                model: addressModel
+                clip: true
+                function showVisible() {
+                    if (model)
+                        model.setVisibleRange(indexAt(0, contentY),
+                                              indexAt(0, contentY + height - 1))
+                }
+                onContentYChanged: showVisible()
+                onHeightChanged: showVisible()
+                onCountChanged: showVisible()
+                delegate: Row {
+                    spacing: 12
+                    Text { text: model.index; width: 50 }
+                    Text { text: model.address; font.family: "monospace" }
+                    Text { text: model.balance; width: 120 }
+                    Text { text: model.txCount }
+                }
+            }
+        }
+
+        Tab {
+            title: qsTr("History")
+            ListView {
+                model: historyModel
+                clip: true
+                function showVisible() {
+                    if (model)
+                        model.setVisibleRange(indexAt(0, contentY),
+                                              indexAt(0, contentY + height - 1))
+                }
+                onContentYChanged: showVisible()
+                onHeightChanged: showVisible()
+                onCountChanged: showVisible()
+                delegate: Row {
+                    spacing: 12
+                    Text {
+                        text: model.height > 0 ? model.height
+                                               : qsTr("unconfirmed")
+                        width: 90
+                    }
+                    Text { text: model.txHash; font.family: "monospace" }
+                    Text { text: model.address; font.family: "monospace" }
+                }
+            }
+        }
     }
 }
@@ -0,0 +1,121 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Qt list models of the client.rows sources for the QML views.
+
+Views fetch rows a page at a time through canFetchMore() and
+fetchMore() as they scroll, and the values of a row are only computed
+when it is drawn.  Roles are the source's ROLES, named for QML.
+
+Changes are not passed to the view as they happen: they are collected
+and flushed at most once a frame, as the notifications client.rows'
+RowUpdates reduces them to.
+'''
+
+from PyQt5.QtCore import (QAbstractListModel, QByteArray, QModelIndex, Qt,
+                          QTimer, pyqtSlot)
+
+from client.rows import AddressRows, HistoryRows, PagedRows, RowUpdates
+from lib.keys import CASHADDR_PREFIX
+
+
+# Milliseconds between flushes of changes to a view; a 60Hz frame
+FLUSH_INTERVAL_MS = 16
+
+
+class RowsModel(QAbstractListModel):
+    '''A list model of a PagedRows.'''
+
+    def __init__(self, rows, parent=None):
+        super().__init__(parent)
+        self.rows = rows
+        self.role_names = {Qt.UserRole + 1 + n: name
+                           for n, name in enumerate(rows.source.ROLES)}
+        self.updates = RowUpdates(rows)
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(FLUSH_INTERVAL_MS)
+        self.flush_timer.timeout.connect(self._flush)
+
+    def roleNames(self):
+        return {role: QByteArray(name.encode())
+                for role, name in self.role_names.items()}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.rows.loaded
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < self.rows.loaded:
+            return None
+        if role == Qt.DisplayRole:
+            name = self.rows.source.ROLES[0]
+        else:
+            name = self.role_names.get(role)
+            if name is None:
+                return None
+        return self.rows.data(index.row(), name)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.rows.can_fetch_more()
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        first, last = self.rows.next_page()
+        if last < first:
+            return
+        self.beginInsertRows(QModelIndex(), first, last)
+        self.rows.fetch_more()
+        self.endInsertRows()
+
+    def refresh(self):
+        '''Call when the account changes in ways rows() cannot say, such as
+        rows moving.  Views keep the rows they have loaded.'''
+        self.updates.reset()
+        self._schedule()
+
+    def row_changed(self, n):
+        '''Call when row n changes, or is appended.'''
+        self.updates.changed(n)
+        self._schedule()
+
+    @pyqtSlot(int, int)
+    def setVisibleRange(self, first, last):
+        '''Called by the view with the rows it shows, -1 if none.'''
+        if first < 0:
+            first = 0
+        if last < 0:
+            last = self.rows.loaded - 1
+        self.updates.set_visible(first, last)
+
+    def _schedule(self):
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def _flush(self):
+        updates = self.updates
+        if updates.reset_needed:
+            self.beginResetModel()
+            updates.flush()
+            self.endResetModel()
+            return
+        changes = updates.flush()
+        for first, last in changes.changed:
+            self.dataChanged.emit(self.index(first), self.index(last))
+        if changes.inserted:
+            first, last = changes.inserted
+            self.beginInsertRows(QModelIndex(), first, last)
+            self.rows.fetch_more()
+            self.endInsertRows()
+
+
+def address_model(account, chain=0, prefix=CASHADDR_PREFIX, parent=None):
+    return RowsModel(PagedRows(AddressRows(account, chain, prefix)), parent)
+
+
+def history_model(account, prefix=CASHADDR_PREFIX, parent=None):
+    return RowsModel(PagedRows(HistoryRows(account, prefix)), parent)
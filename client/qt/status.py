@@ -0,0 +1,69 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''The wallet's balance and loading progress, for the QML status bar.'''
+
+from PyQt5.QtCore import QObject, pyqtProperty, pyqtSignal
+
+from client.rows import format_amount
+
+
+class WalletStatus(QObject):
+    '''Shows the last session's balance until the fresh one arrives.'''
+
+    changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._balance = ''
+        self._fresh = False
+        self._stage = ''
+        self._progress = 0.0
+        self._error = ''
+
+    def set_balance(self, balance, fresh):
+        '''balance is a (confirmed, unconfirmed) pair, or None.'''
+        if balance is None:
+            self._balance = ''
+        else:
+            confirmed, unconfirmed = balance
+            self._balance = format_amount(confirmed)
+            if unconfirmed:
+                self._balance += f' ({format_amount(unconfirmed)} unconfirmed)'
+        self._fresh = fresh
+        self.changed.emit()
+
+    def set_progress(self, stage, fraction):
+        self._stage = stage
+        self._progress = fraction
+        self.changed.emit()
+
+    def set_error(self, error):
+        '''Show that the wallet could not load, and why.'''
+        self._stage = 'error'
+        self._error = error
+        self.changed.emit()
+
+    @pyqtProperty(str, notify=changed)
+    def balance(self):
+        return self._balance
+
+    @pyqtProperty(bool, notify=changed)
+    def fresh(self):
+        return self._fresh
+
+    @pyqtProperty(str, notify=changed)
+    def stage(self):
+        return self._stage
+
+    @pyqtProperty(float, notify=changed)
+    def progress(self):
+        return self._progress
+
+    @pyqtProperty(str, notify=changed)
+    def error(self):
+        return self._error
@@ -0,0 +1,78 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Recover one's own damaged BIP39 mnemonic backup.
+
+Give the backup's words with ? for each unknown word, and a ? after
+each doubtful one, and an address of the wallet, by default its first
+receiving address.  Misspelt words are found without marking.  One
+unknown word takes seconds; two take hours on one core, so the search
+runs on a process pool of --workers processes.
+'''
+
+import getpass
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.bip32 import parse_path
+from lib.keys import AddressError, address_from_string
+from lib.mnemonic import MnemonicError
+from lib.recovery import (DEFAULT_PATH, RecoveryError, candidate_rate,
+                          combinations, recover, word_options)
+
+
+# Seconds between progress reports
+REPORT_INTERVAL = 5.0
+
+
+def run(args):
+    '''Run the recovery tool with the parsed command line args.  Return
+    an exit status.'''
+    logger = logging.getLogger('Recovery')
+    if args.address is None:
+        raise SystemExit('--address is required to recover a mnemonic')
+    try:
+        target = address_from_string(args.address).hash160
+        path = parse_path(args.path or DEFAULT_PATH)
+        options = word_options(args.recover.split())
+    except (AddressError, MnemonicError, RecoveryError, ValueError) as e:
+        raise SystemExit(str(e))
+    passphrase = getpass.getpass('BIP39 passphrase: ') if args.passphrase \
+        else ''
+
+    total = combinations(options)
+    # Roughly, as 1 in 2 ** checksum bits combinations has a valid checksum
+    expected = total >> (len(options) // 3)
+    workers = args.workers or os.cpu_count() or 1
+    logger.info(f'searching {total:,d} combinations, about {expected:,d} '
+                f'candidates, on {workers:d} workers')
+
+    last_report = time.monotonic()
+
+    def on_progress(result):
+        nonlocal last_report
+        now = time.monotonic()
+        if now - last_report >= REPORT_INTERVAL:
+            last_report = now
+            rate = candidate_rate(result)
+            remaining = max(expected - result.candidates, 0) / (rate or 1)
+            logger.info(f'{result.combinations / total:.1%} searched, '
+                        f'{result.candidates:,d} candidates at '
+                        f'{rate:,.0f}/s, about {remaining:,.0f}s left')
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        result = recover(options, target, path, passphrase, executor,
+                         workers, on_progress=on_progress)
+    logger.info(f'{result.candidates:,d} candidates in '
+                f'{result.elapsed:.1f}s, {candidate_rate(result):,.0f}/s')
+    if result.mnemonic is None:
+        logger.error('not found')
+        return 1
+    print(result.mnemonic)
+    return 0
@@ -0,0 +1,287 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Rows of the GUI's address and history lists, computed on demand.
+
+A wallet can have 100,000 addresses or transactions, so nothing is
+built up front.  A RowSource computes a row's display values - a dict
+keyed by role name - only when asked for that row, and PagedRows
+exposes a source a page at a time, as the view scrolls, keeping the
+rows most recently rendered in a small cache.  client.qt.models wraps
+PagedRows in a Qt list model; nothing here needs Qt.
+
+During a sync an account can change thousands of times a second.
+RowUpdates collects the changes to a list between frames and reduces
+them to the fewest notifications: ranges of changed rows on screen to
+repaint, and rows appended.  Off-screen rows are only dropped from the
+cache, to be rendered afresh if scrolled to.
+'''
+
+import heapq
+from collections import namedtuple
+from itertools import islice
+
+from lib.hash import hash_to_hex_str
+from lib.keys import CASHADDR_PREFIX, address_to_string
+from lib.util import LRUCache
+
+
+def format_amount(value, decimal_point=8):
+    '''Format an amount in satoshis as coins, without trailing zeros.'''
+    sign = '-' if value < 0 else ''
+    whole, fraction = divmod(abs(value), 10 ** decimal_point)
+    fraction = f'{fraction:0{decimal_point}d}'.rstrip('0')
+    text = f'{sign}{whole:,d}'
+    return f'{text}.{fraction}' if fraction else text
+
+
+class RowSource(object):
+    '''Base class of row sources.  Subclasses define ROLES, __len__() and
+    compute(n), which returns the dict of row n's values by role.'''
+
+    ROLES = ()
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def compute(self, n):
+        raise NotImplementedError
+
+    def refresh(self):
+        '''Called when the underlying data has changed.'''
+
+
+class AddressRows(RowSource):
+    '''The addresses of one chain of an Account, in index order.'''
+
+    ROLES = ('address', 'index', 'balance', 'txCount')
+
+    def __init__(self, account, chain, prefix=CASHADDR_PREFIX):
+        self.account = account
+        self.keys = account.key_lists()[chain]
+        self.prefix = prefix
+        self.balances = None
+
+    def __len__(self):
+        return len(self.keys.pubkeys)
+
+    def _balance(self, addr):
+        # Summing the UTXO set once serves every row until a refresh
+        if self.balances is None:
+            balances = {}
+            for utxo in self.account.utxos:
+                balances[utxo.addr] = balances.get(utxo.addr, 0) + utxo.value
+            self.balances = balances
+        return self.balances.get(addr, 0)
+
+    def compute(self, n):
+        addr = self.keys.pubkeys[n].address
+        hist = self.account.history.get(addr)
+        return {
+            'address': address_to_string(addr, self.prefix),
+            'index': n,
+            'balance': format_amount(self._balance(addr)),
+            'txCount': len(hist) if hist else 0,
+        }
+
+    def refresh(self):
+        self.balances = None
+
+
+def _newest_first_key(item):
+    _, hist, n = item
+    height = hist.heights[n]
+    # Unconfirmed transactions are newest
+    return (height <= 0, height if height > 0 else -height)
+
+
+class HistoryRows(RowSource):
+    '''The transactions of all an Account's addresses, newest first.
+
+    The per-address histories are merged lazily, so only as many
+    entries are ordered as rows have been asked for.
+    '''
+
+    ROLES = ('txHash', 'height', 'address', 'fee')
+
+    def __init__(self, account, prefix=CASHADDR_PREFIX):
+        self.account = account
+        self.prefix = prefix
+        self.refresh()
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def _newest_first(addr, hist):
+        for n in range(len(hist) - 1, -1, -1):
+            yield addr, hist, n
+
+    def refresh(self):
+        history = self.account.history
+        histories = [(addr, history[addr]) for addr in history]
+        histories = [(addr, hist) for addr, hist in histories if len(hist)]
+        self.count = sum(len(hist) for _, hist in histories)
+        # The histories merged, and their lengths, by address
+        self.merged_histories = {addr: (hist, len(hist))
+                                 for addr, hist in histories}
+        # (addr, AddressHistory, index) triples in display order
+        self.entries = []
+        self.merged = heapq.merge(*(self._newest_first(addr, hist)
+                                    for addr, hist in histories),
+                                  key=_newest_first_key, reverse=True)
+
+    def is_stale(self, addr):
+        '''Return True if the history of addr has changed since the last
+        refresh.  The account replaces an address's history when it
+        changes, so this is cheap.'''
+        hist = self.account.history.get(addr)
+        merged = self.merged_histories.get(addr)
+        if not hist:
+            return merged is not None
+        return merged is None or merged != (hist, len(hist))
+
+    def compute(self, n):
+        if n >= len(self.entries):
+            self.entries.extend(islice(self.merged,
+                                       n + 1 - len(self.entries)))
+        addr, hist, index = self.entries[n]
+        return {
+            'txHash': hash_to_hex_str(hist.tx_hash(index)),
+            'height': hist.heights[index],
+            'address': address_to_string(addr, self.prefix),
+            'fee': format_amount(hist.fees[index]),
+        }
+
+
+class PagedRows(object):
+    '''Exposes a RowSource a page of rows at a time, as for Qt's
+    canFetchMore() and fetchMore(), with a cache of rendered rows.
+
+    loaded is the number of rows exposed so far.
+    '''
+
+    PAGE_SIZE = 100
+
+    def __init__(self, source, page_size=PAGE_SIZE, cache_size=500):
+        self.source = source
+        self.page_size = page_size
+        self.loaded = 0
+        self.cache = LRUCache(f'{type(source).__name__} rows',
+                              maxsize=cache_size, register=False)
+
+    def can_fetch_more(self):
+        return self.loaded < len(self.source)
+
+    def next_page(self):
+        '''Return the first and last rows of the next page.  last is less
+        than first if there are no more rows.'''
+        first = self.loaded
+        return first, min(first + self.page_size, len(self.source)) - 1
+
+    def fetch_more(self):
+        '''Expose the next page.'''
+        self.loaded = self.next_page()[1] + 1
+
+    def row(self, n):
+        '''Return the dict of row n's values by role.'''
+        row = self.cache.get(n)
+        if row is None:
+            row = self.source.compute(n)
+            self.cache.put(n, row)
+        return row
+
+    def data(self, n, role):
+        return self.row(n).get(role)
+
+    def refresh(self):
+        '''Recompute after the underlying data changes, keeping the pages
+        loaded.'''
+        self.source.refresh()
+        self.cache.clear()
+        self.loaded = min(self.loaded, len(self.source))
+
+
+# reset is True if the whole view must be reset.  Otherwise changed is
+# a list of (first, last) row ranges to repaint and inserted a (first,
+# last) range of rows to append, or None.
+RowChanges = namedtuple('RowChanges', 'reset changed inserted')
+
+
+class RowUpdates(object):
+    '''Collects changes to the rows of a PagedRows and reduces them to
+    the notifications a view needs, once per frame.
+
+    Call changed(n) when row n changes and reset() when rows may have
+    moved; call flush() at most once a frame while pending is true.
+    set_visible() tells it which rows are on screen; until it is
+    called, every loaded row is taken to be.
+    '''
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.changed_rows = set()
+        self.reset_needed = False
+        self.visible = None
+        # The length of the source when last flushed
+        self.known = len(rows.source)
+
+    @property
+    def pending(self):
+        return (self.reset_needed or bool(self.changed_rows)
+                or len(self.rows.source) != self.known)
+
+    def changed(self, n):
+        self.changed_rows.add(n)
+
+    def reset(self):
+        self.reset_needed = True
+
+    def set_visible(self, first, last):
+        self.visible = (first, last)
+
+    def flush(self):
+        '''Apply the changes since the last flush to the rows and return
+        the RowChanges.  If reset is true the rows have been refreshed
+        and the caller resets the view around the flush.  The caller
+        applies inserted by notifying the view around
+        rows.fetch_more().'''
+        rows = self.rows
+        if self.reset_needed:
+            self.reset_needed = False
+            self.changed_rows.clear()
+            rows.refresh()
+            self.known = len(rows.source)
+            return RowChanges(True, [], None)
+
+        known = self.known
+        changed = sorted(self.changed_rows)
+        self.changed_rows.clear()
+        rows.source.refresh()
+        self.known = len(rows.source)
+        for n in changed:
+            rows.cache.pop(n)
+        if self.visible is None:
+            first, last = 0, rows.loaded - 1
+        else:
+            first, last = self.visible
+            last = min(last, rows.loaded - 1)
+        ranges = []
+        for n in changed:
+            if n < first or n > last:
+                continue
+            if ranges and ranges[-1][1] == n - 1:
+                ranges[-1][1] = n
+            else:
+                ranges.append([n, n])
+
+        # Rows appended to a fully loaded list are shown at once, a page
+        # at most; otherwise they wait for the view to fetch them
+        inserted = None
+        if rows.loaded >= known and rows.can_fetch_more():
+            inserted = rows.next_page()
+        return RowChanges(False, [tuple(r) for r in ranges], inserted)
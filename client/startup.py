@@ -0,0 +1,207 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Staged startup: the window first, then the wallet.
+
+Nothing the window needs waits on the wallet.  It is shown with the
+balances saved at the end of the last session, which are read from a
+small file.  Then Startup loads the wallet on the event loop in
+stages, reporting progress as it goes: it derives the accounts' keys
+on a worker, connects to the server and synchronizes.  When the
+synchronizer is idle the balances are fresh, and are saved for the
+next session.
+
+StartupMetrics records how long after launch the first frame was
+drawn and the balances became fresh.
+'''
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+import lib.instrument as instrument
+from lib.util import LoggedClass
+
+
+# StartupMetrics milestones
+FIRST_FRAME = 'first_frame'
+FRESH_BALANCE = 'fresh_balance'
+
+
+class XpubError(Exception):
+    '''Raised when the wallet's keys cannot be loaded from an xpub.'''
+
+
+class StartupMetrics(object):
+    '''Records the time of each startup milestone after start, in seconds
+    from time.perf_counter().  Only a milestone's first mark counts.
+
+    Milestones are logged, and recorded as instrument timers named
+    startup.<milestone> for --profile.
+    '''
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.marks = {}
+        self.logger = logging.getLogger('Startup')
+
+    def mark(self, name):
+        if name in self.marks:
+            return
+        elapsed = time.perf_counter() - self.start
+        self.marks[name] = elapsed
+        instrument.record(f'startup.{name}', elapsed)
+        self.logger.info(f'{name} after {elapsed * 1000:,.0f}ms')
+
+
+class BalanceCache(LoggedClass):
+    '''The balances of the last session, by xpub, in a JSON file.
+
+    A missing or unreadable file is an empty cache; the balances are
+    only shown until fresh ones arrive.
+    '''
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def load(self):
+        '''Return a dict mapping xpub to a (confirmed, unconfirmed)
+        pair.'''
+        try:
+            with open(self.path) as f:
+                balances = json.load(f)
+            return {xpub: tuple(pair) for xpub, pair in balances.items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            self.log_warning('ignoring balance cache %s: %s', self.path, e)
+            return {}
+
+    def save(self, balances):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({xpub: list(pair) for xpub, pair in balances.items()},
+                      f)
+        os.replace(tmp_path, self.path)
+
+
+def total_balance(balances, xpubs):
+    '''Return the sum of the (confirmed, unconfirmed) balances of the
+    xpubs, or None if any is missing.'''
+    confirmed = unconfirmed = 0
+    for xpub in xpubs:
+        pair = balances.get(xpub)
+        if pair is None:
+            return None
+        confirmed += pair[0]
+        unconfirmed += pair[1]
+    return confirmed, unconfirmed
+
+
+class Startup(LoggedClass):
+    '''Loads the wallet of watch-only accounts of xpubs in stages.
+
+    connect is a coroutine function taking a notification handler and
+    returning a server session.  Keys are derived on executor.
+    on_progress, if given, is called with the stage name and the
+    fraction of the load done; on_account with each account and its
+    id once it is added to the engine.  Keyword arguments are passed
+    to the client.daemon.Engine.
+    '''
+
+    STAGES = ('keys', 'connect', 'sync')
+    # Seconds between progress reports while synchronizing
+    SYNC_POLL = 0.25
+
+    def __init__(self, xpubs, connect, cache, metrics, executor=None,
+                 on_progress=None, on_account=None, **kwargs):
+        super().__init__()
+        self.xpubs = list(xpubs)
+        self.connect = connect
+        self.cache = cache
+        self.metrics = metrics
+        self.executor = executor
+        self.on_progress = on_progress
+        self.on_account = on_account
+        self.engine_kwargs = kwargs
+        self.session = None
+        self.engine = None
+        # The cached balances until fresh, as for total_balance()
+        self.balance = total_balance(cache.load(), self.xpubs)
+        self.fresh = False
+
+    def _progress(self, stage, fraction=0.0):
+        if self.on_progress is not None:
+            if stage in self.STAGES:
+                fraction = (self.STAGES.index(stage) + fraction) / len(
+                    self.STAGES)
+            self.on_progress(stage, fraction)
+
+    def _sync_fraction(self):
+        progress = self.engine.synchronizer.subscribe_progress
+        if progress is None or not progress.total:
+            return 0.0
+        return progress.count / progress.total
+
+    async def on_notification(self, method, params):
+        if self.engine is not None:
+            await self.engine.on_notification(method, params)
+
+    async def run(self):
+        '''Load the wallet.  Return when its balances are fresh.  Raises
+        XpubError if an xpub cannot be used, and OSError or RPCError if
+        the server cannot.'''
+        # The daemon imports key derivation; not needed for the window
+        import lib.bip32 as bip32
+        from client.daemon import Engine, load_account
+
+        self._progress('keys')
+        accounts = []
+        for n, xpub in enumerate(self.xpubs):
+            try:
+                accounts.append(await load_account(xpub, self.executor))
+            except (ValueError, bip32.DerivationError) as e:
+                raise XpubError(str(e) or 'derivation failed') from e
+            self._progress('keys', (n + 1) / len(self.xpubs))
+
+        self._progress('connect')
+        self.session = await self.connect(self.on_notification)
+        engine = Engine(self.session, executor=self.executor,
+                        **self.engine_kwargs)
+        self.engine = engine
+        await engine.subscribe_headers()
+
+        self._progress('sync')
+        for account in accounts:
+            account_id = engine.add_account(account)
+            if self.on_account is not None:
+                self.on_account(account, account_id)
+        idle = asyncio.ensure_future(engine.wait_idle())
+        while not idle.done():
+            await asyncio.wait([idle], timeout=self.SYNC_POLL)
+            self._progress('sync', self._sync_fraction())
+        await idle
+
+        balances = {xpub: account.utxos.balance()
+                    for xpub, account in zip(self.xpubs, accounts)}
+        self.balance = total_balance(balances, self.xpubs)
+        self.fresh = True
+        self.metrics.mark(FRESH_BALANCE)
+        try:
+            self.cache.save(balances)
+        except OSError as e:
+            self.log_warning('cannot save balance cache: %s', e)
+        self._progress('ready', 1.0)
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.synchronizer.scheduler.cancel()
+        if self.session is not None:
+            self.session.close()
@@ -6,13 +6,22 @@
 # and warranty status of this software.
 
 
-import lib.bip32 as bip32
-from lib.keys import HDPublicKey
+import asyncio
 
+from lib.history import HistoryStore
+from lib.keys import HDMultisigKey, HDPublicKey
+from lib.script import OpCodes, push_small_int
+from lib.util import LoggedClass, lazy_import
+from lib.utxo import UTXOSet
 
-class PubKeyList(object):
+# Loaded with ecdsa when keys are first derived
+bip32 = lazy_import('lib.bip32')
+
+
+class PubKeyList(LoggedClass):
 
     def __init__(self):
+        super().__init__()
         self.pubkeys = []
 
     def is_beyond_limit(self, pubkey):
@@ -38,14 +47,40 @@ class HDPubKeyList(PubKeyList):
     def generate_key(self, n):
         self.pubkeys.append(self.child(n))
 
-    def generate_gap(self, max_used):
-        assert isinstance(max_used, int) and max_used >= -1
-        start = self.pubkeys[-1].n + 1 if self.pubkeys else 0
-        end = max_used + self.gap_limit + 1
+    def generate_keys(self, start, end):
+        '''Generate keys start to end - 1.  Subclasses can derive them in
+        batch.'''
         for n in range(start, end):
-            print(f'Generating key index {n}')
             self.generate_key(n)
 
+    def add_columns(self, start, columns):
+        '''Append keys start onwards from columns: for each of
+        master_pubkeys, the compressed pubkeys of its children as
+        returned by bip32.derive_pubkeys().'''
+        raise NotImplementedError
+
+    # Keys are generated in batches of this size so progress can be
+    # reported on long runs
+    BATCH_SIZE = 1000
+
+    def gap_range(self, max_used):
+        '''Return the (start, end) range of keys generate_gap() would
+        generate; empty if there are none.'''
+        assert isinstance(max_used, int) and max_used >= -1
+        start = self.pubkeys[-1].n + 1 if self.pubkeys else 0
+        return start, max_used + self.gap_limit + 1
+
+    def generate_gap(self, max_used):
+        start, end = self.gap_range(max_used)
+        if start >= end:
+            return
+        progress = self.progress('generating keys', end - start)
+        for lo in range(start, end, self.BATCH_SIZE):
+            hi = min(lo + self.BATCH_SIZE, end)
+            self.generate_keys(lo, hi)
+            progress.update(hi - lo)
+        progress.done()
+
     def is_beyond_limit(self, pubkey, max_used):
         assert isinstance(pubkey, BIP32PublicKey)
         assert isinstance(max_used, int) and max_used >= -1
@@ -59,11 +94,68 @@ class BIP32PubKeyList(HDPubKeyList):
         if not isinstance(master_pubkey, bip32.MasterPubKey):
             raise TypeError('pubkey must be a BeIP32 MasterPubKey')
         self.master_pubkey = master_pubkey
+        self.master_pubkeys = [master_pubkey]
 
     def child(self, n):
         pubkey_bytes = self.master_pubkey.child_compressed_pubkey(n)
         return HDPublicKey.from_bytes(pubkey_bytes, n)
 
+    def generate_keys(self, start, end):
+        self.add_columns(start, [bip32.child_pubkeys(self.master_pubkey,
+                                                     start, end)])
+
+    def add_columns(self, start, columns):
+        pubkeys, = columns
+        self.pubkeys.extend(HDPublicKey(pubkey, n) for n, pubkey
+                            in enumerate(pubkeys, start=start))
+
+
+class MultisigPubKeyList(HDPubKeyList):
+    '''The keys of an m-of-n P2SH multisig chain.  There is a BIP32
+    MasterPubKey per cosigner; the redeem script at index n uses their
+    child n public keys sorted, as in BIP67.
+
+    Ranges of keys are derived with bip32.derive_pubkeys(), in parallel
+    if executor, a process pool, is given.
+    '''
+
+    def __init__(self, master_pubkeys, m, gap_limit, executor=None):
+        super().__init__(gap_limit)
+        master_pubkeys = list(master_pubkeys)
+        for master_pubkey in master_pubkeys:
+            if not isinstance(master_pubkey, bip32.MasterPubKey):
+                raise TypeError('pubkeys must be BIP32 MasterPubKeys')
+        if not 1 <= m <= len(master_pubkeys) <= 16:
+            raise ValueError(f'{m:d} of {len(master_pubkeys):d} multisig '
+                             f'not possible')
+        self.master_pubkeys = master_pubkeys
+        self.m = m
+        self.executor = executor
+        # Redeem scripts are the template's prefix, the pushes of the
+        # 33-byte pubkeys, then its suffix
+        self.script_prefix = push_small_int(m)
+        self.script_suffix = (push_small_int(len(master_pubkeys))
+                              + bytes([OpCodes.OP_CHECKMULTISIG]))
+
+    def _key(self, pubkeys, n):
+        pubkeys = sorted(pubkeys)
+        script = b''.join([self.script_prefix,
+                           b''.join(b'\x21' + pubkey for pubkey in pubkeys),
+                           self.script_suffix])
+        return HDMultisigKey(tuple(pubkeys), script, n)
+
+    def child(self, n):
+        return self._key([master_pubkey.child_compressed_pubkey(n)
+                          for master_pubkey in self.master_pubkeys], n)
+
+    def generate_keys(self, start, end):
+        self.add_columns(start, bip32.derive_pubkeys(
+            self.master_pubkeys, start, end, self.executor))
+
+    def add_columns(self, start, columns):
+        self.pubkeys.extend(self._key(pubkeys, n) for n, pubkeys
+                            in enumerate(zip(*columns), start=start))
+
 
 class Account(object):
 
@@ -79,7 +171,16 @@ class Account(object):
     def __init__(self, rec_keys, chg_keys):
         self.rec_keys = rec_keys
         self.chg_keys = chg_keys
-        self.history = {}
+        self.history = HistoryStore()
+        self.utxos = UTXOSet()
+        self.gap_check_event = asyncio.Event()
+
+    def key_lists(self):
+        '''Return the key lists indexed by chain: receiving then change.'''
+        return (self.rec_keys, self.chg_keys)
+
+    def pubkey(self, chain, n):
+        return self.key_lists()[chain].pubkeys[n]
 
     async def sync(self):
         for addr_list in (self.rec_addr_list, self.chg_addr_list):
@@ -87,9 +188,15 @@ class Account(object):
                 self.subscribe(addr)
 
     def set_address_history(self, addr, hist):
-        self.history[addr] = hist
+        '''hist is a list of (tx_hash, height, fee) entries.'''
+        self.history.set_history(addr, hist)
         self.gap_check_event.set()
 
+    def rollback(self, height):
+        '''Roll back history and UTXOs confirmed at or above height after a
+        reorg.  Return the set of addresses affected.'''
+        return self.history.truncate(height) | self.utxos.rollback(height)
+
     async def sync_gap_limit(self):
         while True:
             await self.gap_check_event.wait()
@@ -102,3 +209,16 @@ class BIP32Account(Account):
         rec_keys = BIP32PubKeyList(master_pubkey.child(0), rec_gap_limit)
         chg_keys = BIP32PubKeyList(master_pubkey.child(1), chg_gap_limit)
         super().__init__(rec_keys, chg_keys)
+
+
+class MultisigAccount(Account):
+
+    def __init__(self, master_pubkeys, m, rec_gap_limit, chg_gap_limit,
+                 executor=None):
+        rec_keys = MultisigPubKeyList(
+            [master_pubkey.child(0) for master_pubkey in master_pubkeys],
+            m, rec_gap_limit, executor)
+        chg_keys = MultisigPubKeyList(
+            [master_pubkey.child(1) for master_pubkey in master_pubkeys],
+            m, chg_gap_limit, executor)
+        super().__init__(rec_keys, chg_keys)
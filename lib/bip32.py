@@ -14,9 +14,10 @@ import ecdsa
 import ecdsa.ellipticcurve as EC
 import ecdsa.numbertheory as NT
 
+import lib.instrument as instrument
 from lib.hash import Base58, hmac_sha512, hash160
 from lib.keys import PublicKeyBase
-from lib.util import cachedproperty, bytes_to_int, int_to_bytes
+from lib.util import bytes_to_int, int_to_bytes, lazyproperty
 
 
 class DerivationError(Exception):
@@ -115,7 +116,10 @@ class MasterPubKey(_KeyBase):
         a, b, p = curve.a(), curve.b(), curve.p()
         y2 = pow(x, 3, p) + b
         assert a == 0  # Otherwise y2 += a * pow(x, 2, p)
-        y = NT.square_root_mod_prime(y2 % p, p)
+        try:
+            y = NT.square_root_mod_prime(y2 % p, p)
+        except NT.SquareRootError:
+            raise ValueError('pubkey is not on the curve') from None
         if bool(y & 1) != is_odd:
             y = p - y
         point = EC.Point(curve, x, y)
@@ -130,7 +134,7 @@ class MasterPubKey(_KeyBase):
         padded_bytes = _exponent_to_bytes(point.x())
         return prefix + padded_bytes
 
-    @cachedproperty
+    @lazyproperty
     def pubkey_bytes(self):
         '''Return the compressed public key as 33 bytes.'''
         return self.compressed_pubkey(self.verifying_key)
@@ -138,6 +142,7 @@ class MasterPubKey(_KeyBase):
     def ec_point(self):
         return self.verifying_key.pubkey.point
 
+    @instrument.timed('bip32.child_verkey_R')
     def child_verkey_R(self, n):
         if not 0 <= n < (1 << 31):
             raise ValueError('invalid BIP32 public key child number')
@@ -219,12 +224,12 @@ class MasterPrivKey(_KeyBase):
         privkey, chain_code = hmac[:32], hmac[32:]
         return cls(privkey, chain_code, 0, 0)
 
-    @cachedproperty
+    @lazyproperty
     def privkey_bytes(self):
         '''Return the serialized private key (no leading zero byte).'''
         return _exponent_to_bytes(self.secret_exponent())
 
-    @cachedproperty
+    @lazyproperty
     def public_key(self):
         '''Return the corresponding extended public key.'''
         verifying_key = self.signing_key.get_verifying_key()
@@ -238,6 +243,7 @@ class MasterPrivKey(_KeyBase):
         '''Return the private key as a secret exponent.'''
         return self.signing_key.privkey.secret_multiplier
 
+    @instrument.timed('bip32.MasterPrivKey.child')
     def child(self, n):
         '''Return the derived child extended privkey at index N.'''
         if not 0 <= n < (1 << 32):
@@ -274,6 +280,135 @@ class MasterPrivKey(_KeyBase):
         return self._extended_key(ver_bytes, b'\0' + self.privkey_bytes)
 
 
+def derive_path(key, path, cache=None):
+    '''Return the descendant of key, a MasterPubKey or MasterPrivKey, at
+    path, a sequence of child numbers.
+
+    If cache, a dict, is given, keys derived along the way are stored in
+    it keyed by path prefix tuple, so deriving many keys that share a
+    parent derives the parent once.
+    '''
+    path = tuple(path)
+    if cache is None:
+        for n in path:
+            key = key.child(n)
+        return key
+
+    # Find the longest cached prefix
+    depth = len(path)
+    while depth and path[:depth] not in cache:
+        depth -= 1
+    if depth:
+        key = cache[path[:depth]]
+    for depth in range(depth + 1, len(path) + 1):
+        key = key.child(path[depth - 1])
+        cache[path[:depth]] = key
+    return key
+
+
+def child_pubkeys(key, start, end):
+    '''Return the compressed public keys of children start to end - 1 of
+    a MasterPubKey.  Cheaper than child_compressed_pubkey() per child as
+    no VerifyingKey is constructed.'''
+    if not 0 <= start <= end <= (1 << 31):
+        raise ValueError('invalid BIP32 public key child range')
+    generator = key.CURVE.generator
+    order = key.CURVE.order
+    parent_point = key.ec_point()
+    pubkey_bytes = key.pubkey_bytes
+    pack = struct.Struct('>I').pack
+    result = []
+    for n in range(start, end):
+        L, _ = key._hmac_sha512(pubkey_bytes + pack(n))
+        L = bytes_to_int(L)
+        if L >= order:
+            raise DerivationError
+        point = generator * L + parent_point
+        if point == EC.INFINITY:
+            raise DerivationError
+        result.append(_compressed(point))
+    return result
+
+
+def pubkey_range(pubkey, chain_code, start, end):
+    '''Return child_pubkeys() of the MasterPubKey with the given pubkey
+    bytes and chain code.  Its arguments and result are plain values,
+    cheap to send to and from a worker process.'''
+    return child_pubkeys(MasterPubKey(pubkey, chain_code, 0, 0), start, end)
+
+
+def _child_pubkeys_job(job):
+    return pubkey_range(*job)
+
+
+def derive_pubkeys(keys, start, end, executor=None, chunk_size=250):
+    '''Return a list, per MasterPubKey in keys, of the compressed public
+    keys of its children start to end - 1.
+
+    If executor, a process pool, is given the ranges are derived in
+    chunks of chunk_size in parallel on it.
+    '''
+    if executor is None or (end - start) * len(keys) <= chunk_size:
+        return [child_pubkeys(key, start, end) for key in keys]
+    jobs = [(key.pubkey_bytes, key.chain_code, lo, min(lo + chunk_size, end))
+            for key in keys for lo in range(start, end, chunk_size)]
+    chunks_per_key = len(jobs) // len(keys)
+    results = list(executor.map(_child_pubkeys_job, jobs))
+    return [[pubkey for chunk in results[n: n + chunks_per_key]
+             for pubkey in chunk]
+            for n in range(0, len(results), chunks_per_key)]
+
+
+def parse_path(path):
+    '''Return the tuple of child numbers of a derivation path string such
+    as "m/44'/145'/0'/0/0".  Hardened steps are marked ' or h.'''
+    parts = path.split('/')
+    if parts[0] != 'm':
+        raise ValueError(f'invalid derivation path {path}')
+    result = []
+    for part in parts[1:]:
+        hardened = part[-1:] in ("'", 'h')
+        if hardened:
+            part = part[:-1]
+        if not part.isdigit() or int(part) >= MasterPrivKey.HARDENED:
+            raise ValueError(f'invalid derivation path {path}')
+        result.append(int(part) + (MasterPrivKey.HARDENED if hardened else 0))
+    return tuple(result)
+
+
+def pubkey_from_seed(seed, path):
+    '''Return the compressed public key at path, a sequence of child
+    numbers, below the master key of a seed.
+
+    Cheaper than MasterPrivKey.from_seed() and derive_path(), as no
+    fingerprints are computed and only the steps that are not hardened
+    need a public key.
+    '''
+    curve = MasterPrivKey.CURVE
+    generator, order = curve.generator, curve.order
+    pack = struct.Struct('>I').pack
+    hmac = hmac_sha512(b'Bitcoin seed', seed)
+    exponent, chain_code = bytes_to_int(hmac[:32]), hmac[32:]
+    if not 1 <= exponent < order:
+        raise DerivationError
+    for n in path:
+        if n >= MasterPrivKey.HARDENED:
+            serkey = b'\0' + _exponent_to_bytes(exponent)
+        else:
+            serkey = _compressed(generator * exponent)
+        hmac = hmac_sha512(chain_code, serkey + pack(n))
+        L, chain_code = bytes_to_int(hmac[:32]), hmac[32:]
+        exponent = (L + exponent) % order
+        if exponent == 0 or L >= order:
+            raise DerivationError
+    return _compressed(generator * exponent)
+
+
+def _compressed(point):
+    '''Return the compressed serialization of an EC point.'''
+    return bytes([2 + (point.y() & 1)]) + _exponent_to_bytes(point.x())
+
+
 def _exponent_to_bytes(exponent):
     '''Convert an exponent to 32 big-endian bytes'''
     return (bytes(32) + int_to_bytes(exponent))[-32:]
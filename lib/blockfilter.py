@@ -0,0 +1,180 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Matching of wallet scripts against compact block filters.
+
+A filter is a BIP158 Golomb-coded set: each of its N scripts is hashed
+with SipHash-2-4, keyed by the first 16 bytes of the block hash, into
+the range [0, N * M); the sorted values are delta-encoded with a
+Golomb-Rice code of parameter P.
+
+FilterMatcher hashes each wallet script once per block and sorts the
+results, then walks the filter's values and the wallet's in step, so
+one pass over the filter checks every wallet script.  Decoding works
+on a string of the filter's bits: a quotient is the distance to the
+next '0', found with str.find, and a remainder one int() call.
+'''
+
+from struct import Struct
+
+from lib.serialize import read_varint, Writer
+
+
+# The BIP158 basic filter parameters
+P = 19
+M = 784931
+
+_MASK = 0xffffffffffffffff
+_unpack_keys = Struct('<QQ').unpack_from
+_unpack_words = Struct('<Q').iter_unpack
+
+
+def siphash24(k0, k1, data):
+    '''Return the 64-bit SipHash-2-4 of data with key (k0, k1).'''
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+    length = len(data)
+    tail = length & 7
+    words = [word for word, in _unpack_words(data[:length - tail])]
+    words.append(((length & 0xff) << 56)
+                 | int.from_bytes(data[length - tail:], 'little'))
+    for m in words:
+        v3 ^= m
+        for _ in range(2):
+            v0 = (v0 + v1) & _MASK
+            v1 = ((v1 << 13) | (v1 >> 51)) & _MASK
+            v1 ^= v0
+            v0 = ((v0 << 32) | (v0 >> 32)) & _MASK
+            v2 = (v2 + v3) & _MASK
+            v3 = ((v3 << 16) | (v3 >> 48)) & _MASK
+            v3 ^= v2
+            v0 = (v0 + v3) & _MASK
+            v3 = ((v3 << 21) | (v3 >> 43)) & _MASK
+            v3 ^= v0
+            v2 = (v2 + v1) & _MASK
+            v1 = ((v1 << 17) | (v1 >> 47)) & _MASK
+            v1 ^= v2
+            v2 = ((v2 << 32) | (v2 >> 32)) & _MASK
+        v0 ^= m
+    v2 ^= 0xff
+    for _ in range(4):
+        v0 = (v0 + v1) & _MASK
+        v1 = ((v1 << 13) | (v1 >> 51)) & _MASK
+        v1 ^= v0
+        v0 = ((v0 << 32) | (v0 >> 32)) & _MASK
+        v2 = (v2 + v3) & _MASK
+        v3 = ((v3 << 16) | (v3 >> 48)) & _MASK
+        v3 ^= v2
+        v0 = (v0 + v3) & _MASK
+        v3 = ((v3 << 21) | (v3 >> 43)) & _MASK
+        v3 ^= v0
+        v2 = (v2 + v1) & _MASK
+        v1 = ((v1 << 17) | (v1 >> 47)) & _MASK
+        v1 ^= v2
+        v2 = ((v2 << 32) | (v2 >> 32)) & _MASK
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+def filter_key(block_hash):
+    '''Return the SipHash key of a binary block hash.'''
+    return _unpack_keys(block_hash)
+
+
+def hashed_values(block_hash, n, scripts):
+    '''Return the filter values of scripts for a filter of n items.'''
+    k0, k1 = filter_key(block_hash)
+    F = n * M
+    return [(siphash24(k0, k1, script) * F) >> 64 for script in scripts]
+
+
+def build_filter(block_hash, scripts):
+    '''Return a serialized filter of a block's scripts.'''
+    scripts = set(scripts)
+    # Colliding values are both kept, as a delta of zero
+    values = sorted(hashed_values(block_hash, len(scripts), scripts))
+    writer = Writer()
+    writer.write_varint(len(values))
+    parts = []
+    last = 0
+    remainder_format = f'0{P}b'
+    for value in values:
+        delta = value - last
+        last = value
+        parts.append('1' * (delta >> P))
+        parts.append('0')
+        parts.append(format(delta & ((1 << P) - 1), remainder_format))
+    bits = ''.join(parts)
+    bits += '0' * (-len(bits) % 8)
+    if bits:
+        writer.write(int(bits, 2).to_bytes(len(bits) // 8, 'big'))
+    return writer.getvalue()
+
+
+def filter_count(filter_bytes):
+    '''Return the number of items in a serialized filter.'''
+    return read_varint(filter_bytes)[0]
+
+
+def decode_filter(filter_bytes):
+    '''Yield the sorted values of a serialized filter.'''
+    n, offset = read_varint(filter_bytes)
+    body = filter_bytes[offset:]
+    bits = format(int.from_bytes(body, 'big'), f'0{len(body) * 8}b')
+    find = bits.find
+    pos = 0
+    value = 0
+    for _ in range(n):
+        end = find('0', pos)
+        if end < 0 or end + 1 + P > len(bits):
+            raise ValueError('truncated filter')
+        quotient = end - pos
+        pos = end + 1 + P
+        value += (quotient << P) + int(bits[end + 1: pos], 2)
+        yield value
+
+
+class FilterMatcher(object):
+    '''Matches a wallet's scripts, e.g. from Address.to_script(), against
+    block filters.'''
+
+    def __init__(self, scripts=()):
+        self.scripts = set()
+        self.add_scripts(scripts)
+
+    def add_scripts(self, scripts):
+        self.scripts.update(bytes(script) for script in scripts)
+
+    def match(self, block_hash, filter_bytes):
+        '''Return the set of wallet scripts that match the filter.  As the
+        filter is probabilistic, a script may match when not in the block
+        with probability 1 / M.'''
+        n = filter_count(filter_bytes)
+        if not n or not self.scripts:
+            return set()
+        scripts = list(self.scripts)
+        targets = sorted(zip(hashed_values(block_hash, n, scripts),
+                             range(len(scripts))))
+        matches = set()
+        pos = 0
+        count = len(targets)
+        for value in decode_filter(filter_bytes):
+            while targets[pos][0] < value:
+                pos += 1
+                if pos == count:
+                    return matches
+            while targets[pos][0] == value:
+                matches.add(scripts[targets[pos][1]])
+                pos += 1
+                if pos == count:
+                    return matches
+        return matches
+
+    def match_any(self, block_hash, filter_bytes):
+        '''Return True if any wallet script matches the filter.'''
+        return bool(self.match(block_hash, filter_bytes))
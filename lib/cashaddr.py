@@ -19,6 +19,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import lib.instrument as instrument
+
+
 _CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
 
 def _polymod(values):
@@ -143,6 +146,7 @@ def _decode_payload(addr):
 PUBKEY_TYPE = 0
 SCRIPT_TYPE = 1
 
+@instrument.timed('cashaddr.decode')
 def decode(address):
     '''Given a cashaddr address, return a triple
 
@@ -180,6 +184,7 @@ def decode(address):
     return prefix, kind, addr_hash
 
 
+@instrument.timed('cashaddr.encode')
 def encode(prefix, kind, addr_hash):
     """Encode a cashaddr address without prefix and separator."""
     if not isinstance(prefix, str):
@@ -196,6 +201,7 @@ def encode(prefix, kind, addr_hash):
     return ''.join([_CHARSET[d] for d in (payload + checksum)])
 
 
+@instrument.timed('cashaddr.encode_full')
 def encode_full(prefix, kind, addr_hash):
     """Encode a full cashaddr address, with prefix and separator."""
     return ':'.join([prefix, encode(prefix, kind, addr_hash)])
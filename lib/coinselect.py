@@ -0,0 +1,126 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Coin selection over a UTXOSet.
+
+Branch-and-bound looks for a set of inputs that pays the target
+without needing a change output; it is given a bounded number of
+search steps.  If it fails, inputs are taken largest first and change
+is made.
+
+All amounts are in satoshis.  The target includes the fee for the
+transaction excluding inputs; fee_per_input is the fee to spend one
+input, and cost_of_change the cost of adding (and later spending) a
+change output.
+'''
+
+from collections import namedtuple
+
+
+class SelectionError(Exception):
+    '''Raised when the UTXOs cannot fund the target.'''
+
+
+# utxos is a list of UTXO objects.  change is True if the selection
+# needs a change output.
+Selection = namedtuple('Selection', 'utxos value change')
+
+
+def branch_and_bound(values, target, cost_of_change, max_tries):
+    '''Given values, a list of effective values sorted in descending
+    order, return the list of indices of a subset whose sum lies in
+    [target, target + cost_of_change] with the least excess, or None
+    if none is found within max_tries steps.
+    '''
+    upper = target + cost_of_change
+    available = sum(values)
+    if available < target:
+        return None
+
+    selection = []
+    value = 0
+    best, best_excess = None, cost_of_change + 1
+    index = 0
+    for _ in range(max_tries):
+        if value + available < target or value > upper:
+            backtrack = True
+        elif value >= target:
+            if value - target < best_excess:
+                best, best_excess = list(selection), value - target
+                if best_excess == 0:
+                    break
+            backtrack = True
+        else:
+            backtrack = False
+
+        if backtrack:
+            if not selection:
+                break
+            # Restore the values skipped since the last inclusion, then
+            # explore the branch omitting it
+            index -= 1
+            while index > selection[-1]:
+                available += values[index]
+                index -= 1
+            value -= values[index]
+            selection.pop()
+        else:
+            item = values[index]
+            available -= item
+            # Omitting an equal value just before was already explored
+            if (not selection or index - 1 == selection[-1]
+                    or item != values[index - 1]):
+                selection.append(index)
+                value += item
+        index += 1
+
+    return best
+
+
+def largest_first(utxos, target, fee_per_input, cost_of_change):
+    '''Select from utxos, an iterable in descending value order, until the
+    target and a change output are covered.  Return a Selection.'''
+    selected = []
+    value = 0
+    for utxo in utxos:
+        effective = utxo.value - fee_per_input
+        if effective <= 0:
+            break
+        selected.append(utxo)
+        value += effective
+        if value >= target + cost_of_change:
+            return Selection(selected, value, True)
+    if value >= target:
+        return Selection(selected, value, False)
+    raise SelectionError(f'insufficient funds: {value:,d} available of '
+                         f'{target:,d} required')
+
+
+def select_coins(utxo_set, target, fee_per_input=0, cost_of_change=0,
+                 max_tries=100000, max_candidates=5000):
+    '''Select UTXOs from utxo_set to fund target.  Return a Selection;
+    value is the sum of effective values of the selected UTXOs.
+
+    Branch-and-bound considers at most max_candidates UTXOs; its search
+    budget could not explore more in any case, and this keeps the
+    cost independent of the size of the set.
+    '''
+    if target <= 0:
+        raise ValueError('target must be positive')
+
+    # Only UTXOs that do not by themselves overshoot the upper bound
+    # can take part in a changeless solution
+    hi = target + cost_of_change + fee_per_input
+    candidates = utxo_set.value_range(fee_per_input + 1, hi, max_candidates)
+    values = [utxo.value - fee_per_input for utxo in candidates]
+    indices = branch_and_bound(values, target, cost_of_change, max_tries)
+    if indices is not None:
+        return Selection([candidates[n] for n in indices],
+                         sum(values[n] for n in indices), False)
+
+    return largest_first(utxo_set.largest(), target, fee_per_input,
+                         cost_of_change)
@@ -29,7 +29,8 @@
 import hashlib
 import hmac
 
-from lib.util import bytes_to_int, int_to_bytes, hex_to_bytes
+import lib.instrument as instrument
+from lib.util import bytes_to_int, int_to_bytes, hex_to_bytes, memoize
 
 _sha256 = hashlib.sha256
 _sha512 = hashlib.sha512
@@ -49,6 +50,7 @@ def ripemd160(x):
     return h.digest()
 
 
+@instrument.timed('hash.double_sha256')
 def double_sha256(x):
     '''SHA-256 of SHA-256, as used extensively in bitcoin.'''
     return sha256(sha256(x))
@@ -59,6 +61,7 @@ def hmac_sha512(key, msg):
     return _new_hmac(key, msg, _sha512).digest()
 
 
+@instrument.timed('hash.hash160')
 def hash160(x):
     '''RIPEMD-160 of SHA-256.
 
@@ -100,6 +103,7 @@ class Base58(object):
         return val
 
     @staticmethod
+    @instrument.timed('base58.decode')
     def decode(txt):
         """Decodes txt into a big-endian bytearray."""
         if not isinstance(txt, str):
@@ -126,6 +130,7 @@ class Base58(object):
         return result
 
     @staticmethod
+    @instrument.timed('base58.encode')
     def encode(be_bytes):
         """Converts a big-endian bytearray into a base58 string."""
         value = bytes_to_int(be_bytes)
@@ -142,7 +147,10 @@ class Base58(object):
 
         return txt[::-1]
 
+    # Addresses and extended keys are encoded and decoded repeatedly for
+    # display; the results are small and immutable
     @staticmethod
+    @memoize(maxsize=4096)
     def decode_check(txt):
         '''Decodes a Base58Check-encoded string to a payload.  The version
         prefixes it.'''
@@ -153,6 +161,7 @@ class Base58(object):
         return result
 
     @staticmethod
+    @memoize(maxsize=4096)
     def encode_check(payload):
         """Encodes a payload bytearray (which includes the version byte(s))
         into a Base58Check string."""
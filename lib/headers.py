@@ -0,0 +1,329 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Storage and verification of the block header chain.
+
+Headers are kept in a file of fixed 80-byte records, so the header at
+a height is found by offset.  The file is memory-mapped rather than
+read: opening a store costs nothing however long the chain is, and
+the OS pages in only the headers actually looked at.
+
+connect() verifies a contiguous run of headers in one pass - linkage,
+proof of work and difficulty - before writing any of them.  A run
+from a server is typically a retarget period of 2016 headers.
+Truncating on a reorg is a file truncation.
+
+Difficulty rules implemented are those of Bitcoin Cash: the original
+2016-block retarget, the emergency adjustment (EDA) from the UAHF and
+the 144-block moving-window adjustment (DAA).  Pass a ChainParams
+with check_difficulty=False for networks with other rules.
+'''
+
+import mmap
+import os
+from collections import namedtuple
+from struct import Struct
+
+from lib.hash import double_sha256, hash_to_hex_str
+from lib.util import LoggedClass
+
+
+HEADER_LEN = 80
+ZERO_HASH = bytes(32)
+
+# version, prev_hash, merkle_root, timestamp, bits, nonce
+_header_struct = Struct('<i32s32sIII')
+
+
+class HeaderError(Exception):
+    '''Raised when headers fail verification.'''
+
+
+ChainParams = namedtuple('ChainParams', 'pow_limit retarget_interval '
+                         'target_spacing eda_height daa_height '
+                         'check_difficulty')
+
+BCH_MAINNET = ChainParams(
+    pow_limit=0x00000000ffffffffffffffffffffffffffffffffffffffffffffffffffffffff,
+    retarget_interval=2016,
+    target_spacing=600,
+    eda_height=478559,
+    daa_height=504032,
+    check_difficulty=True,
+)
+
+
+def bits_to_target(bits):
+    '''Expand compact difficulty bits to a target.'''
+    size = bits >> 24
+    word = bits & 0x007fffff
+    if bits & 0x00800000 and word:
+        raise HeaderError(f'negative target in bits {bits:#010x}')
+    if size <= 3:
+        return word >> (8 * (3 - size))
+    return word << (8 * (size - 3))
+
+
+def target_to_bits(target):
+    '''Return the compact bits of a target, losing low-order precision.'''
+    size = (target.bit_length() + 7) // 8
+    if size <= 3:
+        compact = target << (8 * (3 - size))
+    else:
+        compact = target >> (8 * (size - 3))
+    # The high bit of the mantissa is a sign bit
+    if compact & 0x00800000:
+        compact >>= 8
+        size += 1
+    return compact | (size << 24)
+
+
+def header_work(bits):
+    '''Return the expected number of hashes to find a block with bits.'''
+    return (1 << 256) // (bits_to_target(bits) + 1)
+
+
+class _Window(object):
+    '''Timestamps and bits of a contiguous range of heights, with
+    cumulative work, for difficulty calculations.'''
+
+    def __init__(self, base, rows):
+        self.base = base
+        self.times = []
+        self.bits = []
+        self.extend(rows)
+
+    def extend(self, rows):
+        rows = list(rows)
+        self.times.extend(row[3] for row in rows)
+        self.bits.extend(row[4] for row in rows)
+        self._work = None
+
+    def time(self, height):
+        return self.times[height - self.base]
+
+    def bits_at(self, height):
+        return self.bits[height - self.base]
+
+    def median_time_past(self, height):
+        '''Median timestamp of the 11 blocks ending at height.'''
+        start = max(self.base, height - 10)
+        times = sorted(self.times[start - self.base: height - self.base + 1])
+        return times[len(times) // 2]
+
+    def work_between(self, first, last):
+        '''Total work of heights first + 1 to last inclusive.'''
+        if self._work is None:
+            total = 0
+            cumulative = []
+            works = {}
+            for bits in self.bits:
+                work = works.get(bits)
+                if work is None:
+                    work = works[bits] = header_work(bits)
+                total += work
+                cumulative.append(total)
+            self._work = cumulative
+        return self._work[last - self.base] - self._work[first - self.base]
+
+    def suitable(self, height):
+        '''Height of the median-timestamp block of height and its two
+        predecessors.  Ties must be broken exactly as Bitcoin ABC's
+        GetSuitableBlock() does, so this is its sorting network rather
+        than a sort.'''
+        heights = [height - 2, height - 1, height]
+        time = self.time
+        if time(heights[0]) > time(heights[2]):
+            heights[0], heights[2] = heights[2], heights[0]
+        if time(heights[0]) > time(heights[1]):
+            heights[0], heights[1] = heights[1], heights[0]
+        if time(heights[1]) > time(heights[2]):
+            heights[1], heights[2] = heights[2], heights[1]
+        return heights[1]
+
+
+def required_bits(params, height, window):
+    '''Return the bits required of the header at height.  window must
+    cover enough preceding headers.'''
+    pow_limit = params.pow_limit
+    spacing = params.target_spacing
+    if params.daa_height is not None and height >= params.daa_height:
+        last = window.suitable(height - 1)
+        first = window.suitable(height - 145)
+        timespan = window.time(last) - window.time(first)
+        timespan = max(72 * spacing, min(timespan, 288 * spacing))
+        work = window.work_between(first, last) * spacing // timespan
+        target = (1 << 256) // work - 1
+        return target_to_bits(min(target, pow_limit))
+
+    prev_bits = window.bits_at(height - 1)
+    interval = params.retarget_interval
+    if height % interval == 0:
+        period = interval * spacing
+        timespan = window.time(height - 1) - window.time(height - interval)
+        timespan = max(period // 4, min(timespan, period * 4))
+        target = bits_to_target(prev_bits) * timespan // period
+        return target_to_bits(min(target, pow_limit))
+
+    if params.eda_height is not None and height >= params.eda_height:
+        mtp6 = (window.median_time_past(height - 1)
+                - window.median_time_past(height - 7))
+        if mtp6 >= 12 * 3600:
+            target = bits_to_target(prev_bits)
+            target += target >> 2
+            return target_to_bits(min(target, pow_limit))
+
+    return prev_bits
+
+
+class HeaderStore(LoggedClass):
+    '''A chain of block headers stored in a memory-mapped file.'''
+
+    def __init__(self, path, params=BCH_MAINNET):
+        super().__init__()
+        self.path = path
+        self.params = params
+        # Create the file if necessary without truncating it
+        open(path, 'ab').close()
+        self.file = open(path, 'r+b')
+        self.mmap = None
+        size = os.fstat(self.file.fileno()).st_size
+        if size % HEADER_LEN:
+            self.log_warning(f'discarding partial header at end of {path}')
+            self.file.truncate(size - size % HEADER_LEN)
+        self._remap()
+
+    def _remap(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        size = os.fstat(self.file.fileno()).st_size
+        self.count = size // HEADER_LEN
+        if size:
+            self.mmap = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def height(self):
+        '''Height of the chain tip; -1 if empty.'''
+        return self.count - 1
+
+    def raw_headers(self, start, count):
+        '''Return the concatenated headers of up to count heights from
+        start.'''
+        if not 0 <= start <= self.count:
+            raise IndexError(f'no header at height {start:,d}')
+        end = min(start + count, self.count)
+        return self.mmap[start * HEADER_LEN: end * HEADER_LEN] if end else b''
+
+    def raw_header(self, height):
+        '''Return the 80-byte header at height.'''
+        if not 0 <= height < self.count:
+            raise IndexError(f'no header at height {height:,d}')
+        offset = height * HEADER_LEN
+        return self.mmap[offset: offset + HEADER_LEN]
+
+    def header_hash(self, height):
+        '''Return the binary hash of the header at height.'''
+        return double_sha256(self.raw_header(height))
+
+    def _window(self, start):
+        '''Return a _Window of stored headers before start, enough for
+        difficulty calculations.'''
+        base = max(0, start - self.params.retarget_interval)
+        raw = self.raw_headers(base, start - base)
+        return _Window(base, _header_struct.iter_unpack(raw))
+
+    def required_bits(self, height):
+        '''Return the bits required of a header at height connecting to
+        the stored chain.'''
+        if not 0 < height <= self.count:
+            raise IndexError(f'cannot connect at height {height:,d}')
+        return required_bits(self.params, height, self._window(height))
+
+    def verify(self, height, headers):
+        '''Verify headers, a run of concatenated raw headers, would connect
+        to the stored chain at height.  Raise HeaderError if not.'''
+        if len(headers) % HEADER_LEN:
+            raise HeaderError('headers are not a multiple of 80 bytes')
+        if not 0 <= height <= self.count:
+            raise HeaderError(f'cannot connect at height {height:,d}')
+        view = memoryview(headers)
+        rows = list(_header_struct.iter_unpack(view))
+
+        prev_hash = self.header_hash(height - 1) if height else ZERO_HASH
+        pow_limit = self.params.pow_limit
+        targets = {}
+        for n, row in enumerate(rows):
+            if row[1] != prev_hash:
+                raise HeaderError(f'header {height + n:,d} does not connect')
+            prev_hash = double_sha256(view[n * HEADER_LEN:
+                                           (n + 1) * HEADER_LEN])
+            bits = row[4]
+            target = targets.get(bits)
+            if target is None:
+                target = targets[bits] = bits_to_target(bits)
+                if target > pow_limit:
+                    raise HeaderError(f'header {height + n:,d} bits '
+                                      f'{bits:#010x} exceed the limit')
+            if int.from_bytes(prev_hash, 'little') > target:
+                raise HeaderError(f'header {height + n:,d} has insufficient '
+                                  f'proof of work')
+
+        if not self.params.check_difficulty:
+            return
+        window = self._window(height)
+        window.extend(rows)
+        for n, row in enumerate(rows):
+            if height + n == 0:
+                continue
+            bits = required_bits(self.params, height + n, window)
+            if row[4] != bits:
+                raise HeaderError(f'header {height + n:,d} has bits '
+                                  f'{row[4]:#010x} not {bits:#010x}')
+
+    def connect(self, height, headers):
+        '''Verify and store a run of headers starting at height, replacing
+        any stored headers from height on.  Return the new tip height.'''
+        self.verify(height, headers)
+        if height < self.count:
+            self.log_info(f'replacing headers from height {height:,d}')
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file.seek(height * HEADER_LEN)
+        self.file.truncate()
+        self.file.write(headers)
+        self.file.flush()
+        self._remap()
+        return self.height
+
+    def truncate(self, height):
+        '''Remove headers from height on, for a reorg.'''
+        if height >= self.count:
+            return
+        self.log_info(f'truncating headers to height {height - 1:,d}')
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file.truncate(max(height, 0) * HEADER_LEN)
+        self._remap()
+
+    def tip_hash(self):
+        '''Return the tip's hash in display form, or None if empty.'''
+        if not self.count:
+            return None
+        return hash_to_hex_str(self.header_hash(self.height))
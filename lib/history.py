@@ -0,0 +1,194 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Compact columnar storage of address transaction histories.'''
+
+import heapq
+import sys
+from array import array
+
+from lib.hash import hex_str_to_hash
+from lib.util import to_bytes
+
+
+HASH_LEN = 32
+# Unconfirmed transactions have height 0, or -1 if they have an
+# unconfirmed parent.  They sort after all confirmed transactions.
+_MEMPOOL_KEY = 1 << 32
+
+
+def _sort_key(height):
+    return height if height > 0 else _MEMPOOL_KEY - height
+
+
+def parse_history(items):
+    '''Convert a server's JSON history list to (tx_hash, height, fee)
+    entries.  tx_hash is binary; fee is zero if not given.'''
+    return [(hex_str_to_hash(item['tx_hash']), item['height'],
+             item.get('fee', 0)) for item in items]
+
+
+class AddressHistory(object):
+    '''The history of a single address held in three parallel columns.
+
+    tx_hashes is a bytearray of concatenated 32-byte binary hashes;
+    heights and fees are arrays of machine integers.  Entries are kept
+    ordered by height with unconfirmed entries last, which is the
+    order servers return them in.
+    '''
+
+    __slots__ = ('tx_hashes', 'heights', 'fees')
+
+    def __init__(self, entries=()):
+        self.tx_hashes = bytearray()
+        self.heights = array('i')
+        self.fees = array('q')
+        if entries:
+            self.merge(entries)
+
+    def __len__(self):
+        return len(self.heights)
+
+    def __iter__(self):
+        return self.entries()
+
+    def __repr__(self):
+        return f'<AddressHistory {len(self)} entries>'
+
+    def tx_hash(self, n):
+        '''Return the binary hash of entry n.'''
+        start = n * HASH_LEN
+        return bytes(self.tx_hashes[start: start + HASH_LEN])
+
+    def entries(self, start=0):
+        '''Yield (tx_hash, height, fee) tuples from index start onwards.'''
+        tx_hashes, heights, fees = self.tx_hashes, self.heights, self.fees
+        for n in range(start, len(heights)):
+            pos = n * HASH_LEN
+            yield bytes(tx_hashes[pos: pos + HASH_LEN]), heights[n], fees[n]
+
+    def index(self, tx_hash):
+        '''Return the index of the entry with the given binary hash, or -1.'''
+        tx_hashes = self.tx_hashes
+        pos = tx_hashes.find(tx_hash)
+        # A match must be aligned on an entry boundary
+        while pos > 0 and pos % HASH_LEN:
+            pos = tx_hashes.find(tx_hash, pos + 1)
+        return -1 if pos == -1 else pos // HASH_LEN
+
+    def _bisect(self, key):
+        '''Return the index of the first entry whose sort key exceeds key.'''
+        heights = self.heights
+        lo, hi = 0, len(heights)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < _sort_key(heights[mid]):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _delete(self, start, end):
+        del self.tx_hashes[start * HASH_LEN: end * HASH_LEN]
+        del self.heights[start:end]
+        del self.fees[start:end]
+
+    def _append(self, tx_hash, height, fee):
+        self.tx_hashes += tx_hash
+        self.heights.append(height)
+        self.fees.append(fee)
+
+    def merge(self, entries):
+        '''Merge an iterable of (tx_hash, height, fee) entries.
+
+        Entries for transactions already present replace them, e.g. when
+        a mempool transaction confirms.  Only the part of the history
+        at or above the lowest new height is rewritten, so appending
+        new transactions is cheap however long the history.
+        '''
+        entries = {to_bytes(tx_hash): (height, fee)
+                   for tx_hash, height, fee in entries}
+        if not entries:
+            return
+        for tx_hash, (height, fee) in entries.items():
+            if len(tx_hash) != HASH_LEN:
+                raise ValueError(f'invalid tx hash {tx_hash.hex()}')
+            n = self.index(tx_hash)
+            if n != -1:
+                self._delete(n, n + 1)
+
+        def key(entry):
+            return _sort_key(entry[1])
+
+        new = sorted(((tx_hash, height, fee) for tx_hash, (height, fee)
+                      in entries.items()), key=key)
+        start = self._bisect(key(new[0]))
+        tail = list(self.entries(start))
+        self._delete(start, len(self))
+        for entry in heapq.merge(tail, new, key=key):
+            self._append(*entry)
+
+    def truncate(self, height):
+        '''Remove confirmed entries at or above height.  Unconfirmed entries
+        are kept.  Return the number of entries removed.'''
+        start = self._bisect(height - 1)
+        end = self._bisect(_MEMPOOL_KEY - 1)
+        self._delete(start, end)
+        return end - start
+
+    def nbytes(self):
+        '''Approximate memory used, in bytes.'''
+        return (sys.getsizeof(self) + sys.getsizeof(self.tx_hashes)
+                + sys.getsizeof(self.heights) + sys.getsizeof(self.fees))
+
+
+class HistoryStore(object):
+    '''Maps addresses to their AddressHistory objects.'''
+
+    def __init__(self):
+        self.histories = {}
+
+    def __len__(self):
+        return len(self.histories)
+
+    def __contains__(self, addr):
+        return addr in self.histories
+
+    def __iter__(self):
+        return iter(self.histories)
+
+    def __getitem__(self, addr):
+        return self.histories[addr]
+
+    def get(self, addr):
+        return self.histories.get(addr)
+
+    def set_history(self, addr, entries):
+        '''Replace the history of addr with the given entries.'''
+        self.histories[addr] = AddressHistory(entries)
+
+    def merge(self, addr, entries):
+        '''Merge entries into the history of addr and return it.'''
+        hist = self.histories.get(addr)
+        if hist is None:
+            hist = self.histories[addr] = AddressHistory()
+        hist.merge(entries)
+        return hist
+
+    def remove(self, addr):
+        self.histories.pop(addr, None)
+
+    def truncate(self, height):
+        '''Remove confirmed entries at or above height from all histories.
+        Return the set of addresses whose histories changed.'''
+        return {addr for addr, hist in self.histories.items()
+                if hist.truncate(height)}
+
+    def nbytes(self):
+        '''Approximate memory used, in bytes.'''
+        return (sys.getsizeof(self.histories)
+                + sum(hist.nbytes() for hist in self.histories.values()))
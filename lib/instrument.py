@@ -0,0 +1,172 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Counters and timers for hot paths, and a sampling profiler.
+
+Instrumentation is off by default and then costs nothing: timed()
+returns the function it decorates unchanged, and timer() returns a
+shared no-op context manager.  Enable it with enable(), or by setting
+the environment variable ELECTRON_INSTRUMENT, before the modules with
+call sites are imported; the electron script's --profile flag does
+this.
+
+Counts are updated without a lock, so under threads they are close
+but not exact.
+'''
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+
+enabled = bool(os.environ.get('ELECTRON_INSTRUMENT'))
+
+counters = defaultdict(int)
+# name -> [calls, total seconds, max seconds]
+timers = {}
+
+
+def enable():
+    '''Enable instrumentation of call sites imported from now on.'''
+    global enabled
+    enabled = True
+
+
+def reset():
+    counters.clear()
+    timers.clear()
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+
+def _record(name, elapsed):
+    timer = timers.get(name)
+    if timer is None:
+        timers[name] = [1, elapsed, elapsed]
+    else:
+        timer[0] += 1
+        timer[1] += elapsed
+        if elapsed > timer[2]:
+            timer[2] = elapsed
+
+
+def record(name, elapsed):
+    '''Record elapsed seconds under name as for a timer, for durations
+    not spanning a single call such as startup milestones.'''
+    if enabled:
+        _record(name, elapsed)
+
+
+def timed(name):
+    '''Function decorator recording calls and time taken under name.'''
+    def decorator(func):
+        if not enabled:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+
+        return wrapper
+    return decorator
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+@contextmanager
+def _timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def timer(name):
+    '''Return a context manager recording the time taken in its body
+    under name.  It may span awaits, measuring wall time.'''
+    return _timer(name) if enabled else _null_timer
+
+
+def stats():
+    '''Return the counters and timers as a dict.'''
+    return {
+        'counters': dict(counters),
+        'timers': {name: {'calls': calls, 'total': total,
+                          'mean': total / calls, 'max': max_}
+                   for name, (calls, total, max_) in timers.items()},
+    }
+
+
+def dump_json(path):
+    '''Write stats() to path as JSON.'''
+    import json
+
+    with open(path, 'w') as f:
+        json.dump(stats(), f, indent=2, sort_keys=True)
+
+
+class StackSampler(object):
+    '''Samples the stacks of all threads every interval seconds, for
+    flame graphs.  Write the result with write_collapsed() in the
+    collapsed-stack format: one line per distinct stack, frames
+    separated by semicolons, followed by its sample count.'''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='StackSampler')
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f'{code.co_name} '
+                                  f'({os.path.basename(code.co_filename)}'
+                                  f':{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f'{stack} {samples}\n')
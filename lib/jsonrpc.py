@@ -0,0 +1,192 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''JSON-RPC 2.0 over newline-delimited asyncio streams.
+
+This is the framing of the Electrum protocol, and serves both for
+sessions with servers and for the daemon's local API.  A session can
+send requests and receive them on the same connection.  Incoming
+requests are each handled in their own task, so a slow one does not
+hold up those behind it; responses go out as they complete.
+'''
+
+import asyncio
+import json
+
+from lib.util import LoggedClass
+
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# Longest message accepted; server histories can be large
+MAX_LINE = 16 * 1024 * 1024
+
+
+class RPCError(Exception):
+    '''An error response to a request, or one to send.'''
+
+    def __init__(self, code, message):
+        super().__init__(code, message)
+        self.code = code
+        self.message = message
+
+
+class JSONRPCSession(LoggedClass):
+    '''A JSON-RPC session over a StreamReader and StreamWriter pair.
+
+    handler, if given, is a coroutine function called with (method,
+    params) for each incoming request or notification.  It returns a
+    request's result or raises RPCError; the result of a notification
+    is ignored.  Call run() to process incoming messages.
+    '''
+
+    def __init__(self, reader, writer, handler=None):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+        self.handler = handler
+        self.next_id = 0
+        # request id -> future of the response
+        self.pending = {}
+        # Tasks handling incoming requests
+        self.tasks = set()
+        self.drain_lock = asyncio.Lock()
+        self.closed = False
+
+    def _send(self, message):
+        self.writer.write(json.dumps(message).encode() + b'\n')
+
+    async def _drain(self):
+        async with self.drain_lock:
+            await self.writer.drain()
+
+    async def send_request(self, method, params=()):
+        '''Send a request and return its result.  Raise RPCError if the
+        response is an error, and ConnectionError if the connection is
+        lost first.'''
+        if self.closed:
+            raise ConnectionError('session is closed')
+        request_id = self.next_id
+        self.next_id += 1
+        future = asyncio.get_event_loop().create_future()
+        self.pending[request_id] = future
+        self._send({'jsonrpc': '2.0', 'method': method,
+                    'params': list(params), 'id': request_id})
+        try:
+            await self._drain()
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def send_notification(self, method, params=()):
+        if self.closed:
+            raise ConnectionError('session is closed')
+        self._send({'jsonrpc': '2.0', 'method': method,
+                    'params': list(params)})
+        await self._drain()
+
+    async def run(self):
+        '''Process incoming messages until the connection closes.'''
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                self._process(line)
+        except ValueError:
+            self.log_warning('message too long; closing connection')
+        except ConnectionError:
+            pass
+        finally:
+            self.close()
+
+    def _process(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            self._send_error(None, RPCError(PARSE_ERROR, 'invalid JSON'))
+            return
+        if not isinstance(message, dict):
+            self._send_error(None, RPCError(INVALID_REQUEST,
+                                            'message must be an object'))
+        elif 'method' in message:
+            task = asyncio.ensure_future(self._handle(message))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        else:
+            future = self.pending.get(message.get('id'))
+            if future is None or future.done():
+                return
+            error = message.get('error')
+            if error is not None:
+                if not isinstance(error, dict):
+                    error = {}
+                future.set_exception(RPCError(error.get('code'),
+                                              error.get('message')))
+            else:
+                future.set_result(message.get('result'))
+
+    def _send_error(self, request_id, error):
+        self._send({'jsonrpc': '2.0', 'id': request_id,
+                    'error': {'code': error.code, 'message': error.message}})
+
+    async def _handle(self, message):
+        method = message['method']
+        params = message.get('params', [])
+        try:
+            if not isinstance(method, str) or not isinstance(params,
+                                                             (list, dict)):
+                raise RPCError(INVALID_REQUEST, 'invalid request')
+            if self.handler is None:
+                raise RPCError(METHOD_NOT_FOUND, f'unknown method {method}')
+            result = await self.handler(method, params)
+            error = None
+        except RPCError as e:
+            error = e
+        except Exception as e:
+            self.log_error('error handling %s: %r', method, e, throttle=True)
+            error = RPCError(INTERNAL_ERROR, 'internal error')
+
+        # No response to notifications
+        if 'id' not in message or self.closed:
+            return
+        if error is None:
+            self._send({'jsonrpc': '2.0', 'id': message['id'],
+                        'result': result})
+        else:
+            self._send_error(message['id'], error)
+        try:
+            await self._drain()
+        except ConnectionError:
+            pass
+
+    def close(self):
+        '''Close the connection.  Pending requests fail with
+        ConnectionError and incoming requests are abandoned.'''
+        if self.closed:
+            return
+        self.closed = True
+        for task in list(self.tasks):
+            task.cancel()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('connection closed'))
+        self.writer.close()
+
+
+async def connect(host, port, handler=None, ssl=None):
+    '''Open a session with a server and start processing its messages.
+    The session's run_task finishes when the connection closes.'''
+    reader, writer = await asyncio.open_connection(host, port, ssl=ssl,
+                                                   limit=MAX_LINE)
+    session = JSONRPCSession(reader, writer, handler)
+    session.run_task = asyncio.ensure_future(session.run())
+    return session
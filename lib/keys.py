@@ -7,8 +7,9 @@
 
 
 import lib.cashaddr as cashaddr
-from lib.hash import hash160
-from lib.util import to_bytes, hex_to_bytes, cachedproperty
+from lib.hash import Base58, hash160, hash_to_hex_str, sha256
+from lib.script import Script
+from lib.util import to_bytes, hex_to_bytes, lazyproperty
 from collections import namedtuple
 
 
@@ -16,6 +17,10 @@ class KeyError(Exception):
     pass
 
 
+class AddressError(Exception):
+    pass
+
+
 # A namedtuple for easy comparison and unique hashing
 class Address(namedtuple("AddressTuple", "hash160 kind")):
 
@@ -88,9 +93,14 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
         '''Return a script to pay to the address as a hex string.'''
         return self.to_script().hex()
 
+    @lazyproperty
+    def scripthash(self):
+        '''The hash of the script in binary.'''
+        return sha256(self.to_script())
+
     def to_scripthash(self):
         '''Returns the hash of the script in binary.'''
-        return sha256(self.to_script())
+        return self.scripthash
 
     def to_scripthash_hex(self):
         '''Like other bitcoin hashes this is reversed when written in hex.'''
@@ -194,6 +204,31 @@ class BCHAddress(Address):
         return scheme, path
 
 
+# The mainnet prefix
+CASHADDR_PREFIX = 'bitcoincash'
+
+
+def address_to_string(addr, prefix=CASHADDR_PREFIX):
+    '''Return the cashaddr string of an Address, without the prefix.'''
+    kind = (cashaddr.PUBKEY_TYPE if addr.kind == Address.ADDR_P2PKH
+            else cashaddr.SCRIPT_TYPE)
+    return cashaddr.encode(prefix, kind, addr.hash160)
+
+
+def address_from_string(string, prefix=CASHADDR_PREFIX):
+    '''Return the Address of a cashaddr string, with or without the
+    prefix.  Raise AddressError if it has a different prefix, and
+    ValueError if it is invalid.'''
+    if ':' not in string:
+        string = f'{prefix}:{string}'
+    addr_prefix, kind, addr_hash = cashaddr.decode(string)
+    if addr_prefix != prefix:
+        raise AddressError(f'address has unexpected prefix {addr_prefix}')
+    if kind == cashaddr.PUBKEY_TYPE:
+        return Address.from_P2PKH_hash(addr_hash)
+    return Address.from_P2SH_hash(addr_hash)
+
+
 class PublicKeyBase(object):
 
     @classmethod
@@ -212,7 +247,7 @@ class PublicKeyBase(object):
         '''Returns True if the pubkey is compressed.'''
         return len(self.pubkey) == 33
 
-    @cachedproperty
+    @lazyproperty
     def address(self):
         '''Convert to an Address object.'''
         return Address(hash160(self.pubkey), Address.ADDR_P2PKH)
@@ -266,3 +301,17 @@ class HDPublicKey(PublicKeyBase, namedtuple("HDPublicKeyTuple", "pubkey n")):
 
     def __repr__(self):
         return f'<HDPublicKey {self}/{self.n}>'
+
+
+class HDMultisigKey(namedtuple("HDMultisigKeyTuple", "pubkeys script n")):
+    '''The keys of an HD multisig chain at child index n.  pubkeys are
+    the cosigners' public keys in script order and script the redeem
+    script.'''
+
+    @lazyproperty
+    def address(self):
+        '''Convert to a P2SH Address object.'''
+        return Address.from_multisig_script(self.script)
+
+    def __repr__(self):
+        return f'<HDMultisigKey {self.address.hash160.hex()}/{self.n}>'
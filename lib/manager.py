@@ -0,0 +1,279 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Management of many accounts over a single synchronizer.'''
+
+import asyncio
+
+from lib.account import HDPubKeyList
+from lib.hash import double_sha256
+from lib.headers import HEADER_LEN
+from lib.synchronizer import (Synchronizer, PRIORITY_ACTIVE, PRIORITY_RECEIVE,
+                              PRIORITY_CHANGE, PRIORITY_DORMANT)
+from lib.util import LoggedClass, lazy_import
+
+# Loaded with ecdsa when keys are first derived
+bip32 = lazy_import('lib.bip32')
+
+
+class RoutingTable(object):
+    '''Maps scripthashes to (account_id, chain, index) triples.
+
+    Each triple is packed into a single integer so the table holds one
+    bytes key and one int per address.  index is the mapping the table
+    stores into; it defaults to a dict but can be any mutable mapping
+    from bytes to int, such as a more compact or disk-backed index.
+    If prefix_len is less than 32, only that many leading bytes of
+    each scripthash are used as its key.
+    '''
+
+    def __init__(self, index=None, prefix_len=32):
+        if not 8 <= prefix_len <= 32:
+            raise ValueError('prefix length must be from 8 to 32')
+        self.index = {} if index is None else index
+        self.prefix_len = prefix_len
+
+    def __len__(self):
+        return len(self.index)
+
+    @staticmethod
+    def _pack(account_id, chain, n):
+        if not 0 <= n < 1 << 31 or chain not in (0, 1):
+            raise ValueError(f'cannot route chain {chain} index {n}')
+        return (account_id << 32) | (chain << 31) | n
+
+    def add(self, scripthash, account_id, chain, n):
+        self.index[scripthash[:self.prefix_len]] = self._pack(account_id,
+                                                              chain, n)
+
+    def remove(self, scripthash):
+        self.index.pop(scripthash[:self.prefix_len], None)
+
+    def lookup(self, scripthash):
+        '''Return the (account_id, chain, index) triple for scripthash, or
+        None if it is not routed.'''
+        packed = self.index.get(scripthash[:self.prefix_len])
+        if packed is None:
+            return None
+        return packed >> 32, (packed >> 31) & 1, packed & 0x7fffffff
+
+
+class AccountManager(LoggedClass):
+    '''Multiplexes the subscriptions of many accounts over one synchronizer.
+
+    Accounts can be added and removed at any time; only their own
+    scripthashes are subscribed or unsubscribed.  Subscriptions are
+    prioritized: addresses with recent activity first, then unused
+    receiving addresses, then unused change addresses, and finally
+    addresses whose history is older than RECENT_BLOCKS.  Keyword
+    arguments are passed to the synchronizer's scheduler.
+
+    Keys beyond the gap limit are derived when an address is first
+    used.  If executor is given they are derived on it, one key list at
+    a time, so the event loop stays responsive; otherwise it happens on
+    the loop.  Workers only compute the pubkeys, which are added to the
+    key list on the loop, so executor can be a thread or process pool.
+    on_change, if given, is called with the (account_id, chain, index)
+    of each key whose history changes, after any keys it caused to be
+    generated are added.
+
+    The chain tip is tracked from the server's header notifications;
+    pass on_notification() as the session's handler and call
+    subscribe_headers() once connected.  A new tip that does not extend
+    the last one rolls back the accounts to the fork point.
+    '''
+
+    RECENT_BLOCKS = 1008
+    # Hashes of this many blocks below the tip are kept to find forks
+    REORG_LIMIT = 100
+
+    def __init__(self, session, routing_table=None, executor=None,
+                 on_change=None, **kwargs):
+        super().__init__()
+        self.synchronizer = Synchronizer(session, self.on_status, **kwargs)
+        self.executor = executor
+        self.on_change = on_change
+        self.gap_lock = asyncio.Lock()
+        # The chain tip height, or 0 until subscribe_headers()
+        self.height = 0
+        # Map from height to block hash of the blocks near the tip
+        self.header_hashes = {}
+        self.routes = RoutingTable() if routing_table is None else routing_table
+        self.accounts = {}
+        # Per account, the number of keys of each chain routed so far
+        self.routed_counts = {}
+        self.next_account_id = 0
+
+    def add_account(self, account):
+        '''Add an account and queue subscriptions to its addresses.  Return
+        its id.'''
+        account_id = self.next_account_id
+        self.next_account_id += 1
+        self.accounts[account_id] = account
+        self.routed_counts[account_id] = [0, 0]
+        for keys in account.key_lists():
+            if isinstance(keys, HDPubKeyList) and not keys.pubkeys:
+                keys.generate_gap(-1)
+        self.subscribe_new_keys(account_id)
+        return account_id
+
+    async def remove_account(self, account_id):
+        '''Remove an account and unsubscribe from its addresses.'''
+        account = self.accounts.pop(account_id)
+        counts = self.routed_counts.pop(account_id)
+        scripthashes = []
+        for keys, count in zip(account.key_lists(), counts):
+            for pubkey in keys.pubkeys[:count]:
+                scripthash = pubkey.address.to_scripthash()
+                self.routes.remove(scripthash)
+                scripthashes.append(scripthash)
+        await self.synchronizer.unsubscribe(scripthashes)
+
+    async def subscribe_headers(self):
+        '''Subscribe to the chain tip and record its height, and the hashes
+        of the blocks below it that a reorg might replace.'''
+        session = self.synchronizer.session
+        header = await session.send_request('blockchain.headers.subscribe',
+                                            [])
+        height = header['height']
+        if header.get('hex'):
+            start = max(height - self.REORG_LIMIT, 0)
+            result = await session.send_request('blockchain.block.headers',
+                                                [start, height - start])
+            raw = bytes.fromhex(result['hex'])
+            for n in range(result['count']):
+                self.header_hashes[start + n] = double_sha256(
+                    raw[n * HEADER_LEN:(n + 1) * HEADER_LEN])
+        await self.on_header(header)
+
+    async def on_header(self, header):
+        '''Called with each new chain tip.  If it does not extend the last
+        one, the chain reorganized and on_reorg() is called.'''
+        height = header['height']
+        raw = bytes.fromhex(header.get('hex', ''))
+        if raw:
+            fork_height = await self._fork_height(height, raw)
+        else:
+            # Without the header, only a tip no higher than the last
+            # one shows a reorg
+            fork_height = height if 0 < height <= self.height else None
+        self.height = height
+        if fork_height is not None:
+            self.on_reorg(fork_height)
+
+    async def _fork_height(self, height, raw):
+        '''Record the hashes of raw, the header at height, and of the
+        headers below it that it replaced.  Return the lowest height whose
+        block was replaced, or None if there was none.'''
+        hashes = self.header_hashes
+        # Blocks above a lower tip were orphaned
+        orphaned = [h for h in hashes if h > height]
+        for h in orphaned:
+            del hashes[h]
+        fork_height = min(orphaned, default=None)
+        for h in [h for h in hashes if h <= height - self.REORG_LIMIT]:
+            del hashes[h]
+        session = self.synchronizer.session
+        while True:
+            block_hash = double_sha256(raw)
+            old_hash = hashes.get(height)
+            if old_hash == block_hash:
+                break
+            hashes[height] = block_hash
+            if old_hash is not None:
+                fork_height = height
+            prev_hash = hashes.get(height - 1)
+            if prev_hash is None or prev_hash == raw[4:36]:
+                break
+            height -= 1
+            raw = bytes.fromhex(await session.send_request(
+                'blockchain.block.header', [height]))
+        return fork_height
+
+    async def on_notification(self, method, params):
+        '''Handler of messages from the server.'''
+        if method == 'blockchain.scripthash.subscribe':
+            await self.synchronizer.on_notification(*params)
+        elif method == 'blockchain.headers.subscribe':
+            await self.on_header(params[0])
+
+    def priority(self, account, chain, pubkey):
+        '''Return the subscription priority of an account's pubkey.'''
+        hist = account.history.get(pubkey.address)
+        if not hist:
+            return PRIORITY_RECEIVE if chain == 0 else PRIORITY_CHANGE
+        last_height = hist.heights[-1]
+        if (last_height <= 0 or not self.height
+                or last_height > self.height - self.RECENT_BLOCKS):
+            return PRIORITY_ACTIVE
+        return PRIORITY_DORMANT
+
+    def subscribe_new_keys(self, account_id):
+        '''Route and queue subscriptions to keys of the account generated
+        since the last call.'''
+        account = self.accounts[account_id]
+        counts = self.routed_counts[account_id]
+        subscribe = self.synchronizer.subscribe
+        for chain, keys in enumerate(account.key_lists()):
+            for n in range(counts[chain], len(keys.pubkeys)):
+                pubkey = keys.pubkeys[n]
+                scripthash = pubkey.address.to_scripthash()
+                self.routes.add(scripthash, account_id, chain, n)
+                subscribe([scripthash], self.priority(account, chain, pubkey))
+            counts[chain] = len(keys.pubkeys)
+
+    def on_reorg(self, fork_height):
+        '''Handle a chain reorganization where blocks from fork_height
+        onwards were replaced.  Only state above the fork is rolled
+        back, and only the affected addresses are queried again.'''
+        resync = self.synchronizer.resync
+        for account in self.accounts.values():
+            addrs = account.rollback(fork_height)
+            resync([addr.to_scripthash() for addr in addrs])
+        self.log_info(f'reorg: rolled back to height {fork_height:,d}')
+
+    async def wait_idle(self):
+        '''Wait until all queued subscriptions have been made.'''
+        await self.synchronizer.wait_idle()
+
+    async def on_status(self, scripthash, status):
+        '''Called by the synchronizer when a scripthash's status changes.'''
+        route = self.routes.lookup(scripthash)
+        if route is None:
+            return
+        account_id, chain, n = route
+        account = self.accounts.get(account_id)
+        if account is None:
+            return
+        hist = await self.synchronizer.get_history(scripthash) if status else []
+        # The account might have been removed in the meantime
+        if self.accounts.get(account_id) is not account:
+            return
+        account.set_address_history(account.pubkey(chain, n).address, hist)
+        keys = account.key_lists()[chain]
+        if hist and isinstance(keys, HDPubKeyList):
+            await self._generate_gap(keys, n)
+            if self.accounts.get(account_id) is not account:
+                return
+            self.subscribe_new_keys(account_id)
+        if self.on_change is not None:
+            self.on_change(account_id, chain, n)
+
+    async def _generate_gap(self, keys, max_used):
+        if self.executor is None:
+            keys.generate_gap(max_used)
+            return
+        # Serialized, as concurrent generation would derive keys twice
+        async with self.gap_lock:
+            start, end = keys.gap_range(max_used)
+            if start >= end:
+                return
+            loop = asyncio.get_event_loop()
+            columns = await asyncio.gather(*(loop.run_in_executor(
+                self.executor, bip32.pubkey_range, key.pubkey_bytes,
+                key.chain_code, start, end) for key in keys.master_pubkeys))
+            keys.add_columns(start, columns)
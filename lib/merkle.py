@@ -0,0 +1,253 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Verification of transaction Merkle proofs against stored headers.
+
+A proof from blockchain.transaction.get_merkle is the branch of
+sibling hashes from a transaction up to its block's Merkle root.
+Every node on a proven path, and every sibling hashed into it, is
+then known to belong to the block's tree.  MerkleVerifier keeps those
+nodes in a per-block cache, so a later proof for the same block stops
+hashing at the first node it shares with an earlier one; a transaction
+that was itself a sibling in an earlier proof needs no hashing at all.
+
+Verified transactions are recorded in an append-only file of 36-byte
+records and are never checked again unless a reorg unverifies them.
+'''
+
+import asyncio
+import os
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from struct import Struct
+
+from lib.hash import double_sha256, hex_str_to_hash
+from lib.util import LoggedClass
+
+
+_record = Struct('<32sI')
+
+
+class MerkleError(Exception):
+    '''Raised for a proof that cannot be checked.'''
+
+
+def parse_merkle_response(tx_hash, result):
+    '''Convert a hex tx_hash and the result of a get_merkle call to a
+    (tx_hash, height, branch, pos) proof with binary hashes.'''
+    return (hex_str_to_hash(tx_hash), result['block_height'],
+            [hex_str_to_hash(node) for node in result['merkle']],
+            result['pos'])
+
+
+def merkle_root(hashes):
+    '''Return the Merkle root of a non-empty list of binary hashes.'''
+    while len(hashes) > 1:
+        if len(hashes) & 1:
+            hashes = hashes + hashes[-1:]
+        hashes = [double_sha256(hashes[n] + hashes[n + 1])
+                  for n in range(0, len(hashes), 2)]
+    return hashes[0]
+
+
+def merkle_branch(hashes, index):
+    '''Return the branch of hashes proving hashes[index].'''
+    branch = []
+    while len(hashes) > 1:
+        if len(hashes) & 1:
+            hashes = hashes + hashes[-1:]
+        branch.append(hashes[index ^ 1])
+        index >>= 1
+        hashes = [double_sha256(hashes[n] + hashes[n + 1])
+                  for n in range(0, len(hashes), 2)]
+    return branch
+
+
+def verify_branch(root, tx_hash, branch, pos, cache):
+    '''Return True if branch proves tx_hash at pos under root.
+
+    cache maps (level, position) pairs to node hashes already proven for
+    this root; it is consulted to stop early and updated on success.  Its
+    'depth' key holds the branch length of the first proof to reach the
+    root; every leaf is at that depth, so other lengths are rejected.
+    '''
+    if pos >> len(branch):
+        return False
+    depth = cache.get('depth')
+    if depth is not None and len(branch) != depth:
+        return False
+    node = tx_hash
+    proven = []
+    for level, sibling in enumerate(branch):
+        index = pos >> level
+        known = cache.get((level, index))
+        if known is not None:
+            if known != node:
+                return False
+            break
+        proven.append(((level, index), node))
+        proven.append(((level, index ^ 1), sibling))
+        if index & 1:
+            node = double_sha256(sibling + node)
+        else:
+            node = double_sha256(node + sibling)
+    else:
+        if node != root:
+            return False
+        proven.append(((len(branch), 0), node))
+        proven.append(('depth', len(branch)))
+    cache.update(proven)
+    return True
+
+
+def _verify_group(root, proofs):
+    '''Verify (tx_hash, branch, pos) proofs of one block; run in workers.'''
+    cache = {}
+    return [verify_branch(root, tx_hash, branch, pos, cache)
+            for tx_hash, branch, pos in proofs]
+
+
+class MerkleVerifier(LoggedClass):
+    '''Verifies Merkle proofs against a lib.headers.HeaderStore and
+    remembers the transactions verified.'''
+
+    def __init__(self, headers, path=None, max_cached_blocks=100):
+        super().__init__()
+        self.headers = headers
+        self.path = path
+        self.max_cached_blocks = max_cached_blocks
+        # block height -> {(level, position): hash}
+        self.caches = OrderedDict()
+        # tx_hash -> block height
+        self.verified = {}
+        self.file = None
+        if path is not None:
+            self._load(path)
+
+    def _load(self, path):
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            usable = len(data) - len(data) % _record.size
+            self.verified.update(_record.iter_unpack(data[:usable]))
+            if usable != len(data):
+                self.log_warning(f'discarding partial record in {path}')
+                with open(path, 'r+b') as f:
+                    f.truncate(usable)
+        self.file = open(path, 'ab')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def is_verified(self, tx_hash):
+        return tx_hash in self.verified
+
+    def _root(self, height):
+        try:
+            header = self.headers.raw_header(height)
+        except IndexError:
+            raise MerkleError(f'no header at height {height:,d}') from None
+        return bytes(header[36:68])
+
+    def _cache(self, height):
+        cache = self.caches.get(height)
+        if cache is None:
+            cache = self.caches[height] = {}
+            if len(self.caches) > self.max_cached_blocks:
+                self.caches.popitem(last=False)
+        else:
+            self.caches.move_to_end(height)
+        return cache
+
+    def _record(self, pairs):
+        '''Record verified (tx_hash, height) pairs.'''
+        self.verified.update(pairs)
+        if self.file is not None:
+            self.file.write(b''.join(_record.pack(tx_hash, height)
+                                     for tx_hash, height in pairs))
+            self.file.flush()
+
+    def verify(self, tx_hash, height, branch, pos):
+        '''Return True if the proof verifies against the stored header.
+        A verified transaction is recorded.'''
+        if self.verified.get(tx_hash) == height:
+            return True
+        root = self._root(height)
+        if not verify_branch(root, tx_hash, branch, pos, self._cache(height)):
+            return False
+        self._record([(tx_hash, height)])
+        return True
+
+    async def verify_many(self, proofs, executor=None):
+        '''Verify (tx_hash, height, branch, pos) proofs, as for a bulk
+        restore.  Return a list of results in order.
+
+        Proofs are grouped by block.  If executor is given, groups are
+        verified on it off the event loop; a process pool from
+        verifier_pool() suits.
+        '''
+        proofs = list(proofs)
+        results = [True] * len(proofs)
+        groups = defaultdict(list)
+        for n, (tx_hash, height, branch, pos) in enumerate(proofs):
+            if self.verified.get(tx_hash) != height:
+                groups[height].append(n)
+        if not groups:
+            return results
+
+        if executor is None:
+            for height, indices in groups.items():
+                for n in indices:
+                    results[n] = self.verify(*proofs[n])
+            return results
+
+        loop = asyncio.get_event_loop()
+        heights = list(groups)
+        jobs = []
+        for height in heights:
+            group = [(proofs[n][0], proofs[n][2], proofs[n][3])
+                     for n in groups[height]]
+            jobs.append(loop.run_in_executor(executor, _verify_group,
+                                             self._root(height), group))
+        verified = []
+        for height, group_results in zip(heights,
+                                         await asyncio.gather(*jobs)):
+            for n, result in zip(groups[height], group_results):
+                results[n] = result
+                if result:
+                    verified.append((proofs[n][0], height))
+        self._record(verified)
+        return results
+
+    def unverify(self, height):
+        '''Forget verification of transactions in blocks from height on,
+        for a reorg.  Return the set of tx hashes affected.'''
+        for block_height in [h for h in self.caches if h >= height]:
+            del self.caches[block_height]
+        removed = {tx_hash for tx_hash, tx_height in self.verified.items()
+                   if tx_height >= height}
+        if not removed:
+            return removed
+        for tx_hash in removed:
+            del self.verified[tx_hash]
+        if self.file is not None:
+            # Rewrite rather than append tombstones; reorgs are rare
+            self.file.close()
+            with open(self.path + '.tmp', 'wb') as f:
+                f.write(b''.join(_record.pack(tx_hash, tx_height)
+                                 for tx_hash, tx_height
+                                 in self.verified.items()))
+            os.replace(self.path + '.tmp', self.path)
+            self.file = open(self.path, 'ab')
+        return removed
+
+
+def verifier_pool(max_workers=None):
+    '''Return a process pool suitable for MerkleVerifier.verify_many.'''
+    return ProcessPoolExecutor(max_workers=max_workers)
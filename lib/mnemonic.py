@@ -0,0 +1,129 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''BIP39 mnemonic sentences and their seeds.
+
+A mnemonic encodes 128 to 256 bits of entropy and a checksum of its
+SHA256 hash, 11 bits a word, as 12 to 24 words of the English
+wordlist.  Its seed, for lib.bip32.MasterPrivKey.from_seed(), is
+PBKDF2-HMAC-SHA512 of the normalized sentence with an optional
+passphrase; the checksum is not part of it.
+'''
+
+import hashlib
+import os
+import unicodedata
+
+from lib.util import bytes_to_int
+
+
+WORDLIST_PATH = os.path.join(os.path.dirname(__file__), 'wordlist',
+                             'english.txt')
+WORD_COUNTS = (12, 15, 18, 21, 24)
+PBKDF2_ROUNDS = 2048
+
+_wordlist = None
+_word_index = None
+
+
+class MnemonicError(Exception):
+    '''Raised for an invalid mnemonic.'''
+
+
+def wordlist():
+    '''Return the English wordlist, read on first use.'''
+    global _wordlist
+    if _wordlist is None:
+        with open(WORDLIST_PATH) as f:
+            words = f.read().split()
+        assert len(words) == 2048
+        _wordlist = words
+    return _wordlist
+
+
+def word_index():
+    '''Return a dict mapping each word to its index in the wordlist.'''
+    global _word_index
+    if _word_index is None:
+        _word_index = {word: n for n, word in enumerate(wordlist())}
+    return _word_index
+
+
+def normalize(mnemonic):
+    '''Return the mnemonic NFKD-normalized with single spaces.'''
+    return ' '.join(unicodedata.normalize('NFKD', mnemonic).split())
+
+
+def checksum_bits(word_count):
+    '''Return the number of checksum bits of a mnemonic of word_count
+    words.'''
+    if word_count not in WORD_COUNTS:
+        raise MnemonicError(f'a mnemonic cannot have {word_count:d} words')
+    return word_count // 3
+
+
+def indices_entropy(indices):
+    '''Return the entropy encoded by a sequence of word indices, or None
+    if the checksum does not match.'''
+    cs_bits = checksum_bits(len(indices))
+    value = 0
+    for index in indices:
+        value = (value << 11) | index
+    entropy = (value >> cs_bits).to_bytes(len(indices) * 4 // 3, 'big')
+    checksum = hashlib.sha256(entropy).digest()[0] >> (8 - cs_bits)
+    if checksum != value & ((1 << cs_bits) - 1):
+        return None
+    return entropy
+
+
+def entropy_to_mnemonic(entropy):
+    '''Return the mnemonic encoding 16 to 32 bytes of entropy.'''
+    if len(entropy) not in (16, 20, 24, 28, 32):
+        raise MnemonicError(f'invalid entropy length {len(entropy):d}')
+    cs_bits = len(entropy) // 4
+    checksum = hashlib.sha256(entropy).digest()[0] >> (8 - cs_bits)
+    value = (bytes_to_int(entropy) << cs_bits) | checksum
+    words = wordlist()
+    count = len(entropy) * 3 // 4
+    return ' '.join(words[(value >> (11 * (count - 1 - n))) & 2047]
+                    for n in range(count))
+
+
+def mnemonic_to_entropy(mnemonic):
+    '''Return the entropy a mnemonic encodes.  Raise MnemonicError if a
+    word is not in the wordlist, the number of words is wrong or the
+    checksum does not match.'''
+    index = word_index()
+    words = normalize(mnemonic).split()
+    unknown = [word for word in words if word not in index]
+    if unknown:
+        raise MnemonicError(f'not in the wordlist: {", ".join(unknown)}')
+    entropy = indices_entropy([index[word] for word in words])
+    if entropy is None:
+        raise MnemonicError('bad mnemonic checksum')
+    return entropy
+
+
+def is_valid(mnemonic):
+    try:
+        mnemonic_to_entropy(mnemonic)
+        return True
+    except MnemonicError:
+        return False
+
+
+def make_mnemonic(strength=128):
+    '''Return a new random mnemonic of strength bits of entropy.'''
+    return entropy_to_mnemonic(os.urandom(strength // 8))
+
+
+def mnemonic_to_seed(mnemonic, passphrase=''):
+    '''Return the 64-byte seed of a mnemonic.  The mnemonic is not
+    validated; check it with is_valid() first if that matters.'''
+    mnemonic = normalize(mnemonic).encode()
+    salt = unicodedata.normalize('NFKD', 'mnemonic' + passphrase).encode()
+    return hashlib.pbkdf2_hmac('sha512', mnemonic, salt, PBKDF2_ROUNDS)
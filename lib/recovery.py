@@ -0,0 +1,212 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Recovery of a damaged BIP39 mnemonic backup from a known address.
+
+The backup is a list of words in which any may be written ? if it is
+unknown, or end in ? if it is doubtful; words not in the wordlist are
+taken to be misspelt.  Each such position has a list of candidate
+words: the whole wordlist for an unknown word, and the words within a
+small edit distance otherwise.  The product of the positions' lists
+is searched for a mnemonic whose checksum matches and whose key at a
+derivation path has the known address.
+
+Only one combination in 16 to 256 passes the checksum, which is
+cheap; each that does costs a PBKDF2 and a key derivation, about 4ms.
+The search space is split into contiguous ranges of the product that
+are searched in parallel on a process pool, a few at a time so that
+the search stops soon after a match.
+'''
+
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, wait
+from functools import partial
+
+from lib.bip32 import pubkey_from_seed
+from lib.hash import hash160
+from lib.mnemonic import (indices_entropy, mnemonic_to_seed, word_index,
+                          wordlist, checksum_bits)
+
+
+# Electron Cash's default derivation of a BIP39 seed's first address
+DEFAULT_PATH = "m/44'/145'/0'/0/0"
+# Words up to this edit distance from a doubtful word are candidates
+MAX_DISTANCE = 2
+
+
+class RecoveryError(Exception):
+    '''Raised if a backup cannot be searched.'''
+
+
+# mnemonic is the recovered mnemonic, or None.  combinations are the
+# word combinations searched and candidates those of them with a
+# valid checksum, whose keys were derived.
+RecoveryResult = namedtuple('RecoveryResult',
+                            'mnemonic combinations candidates elapsed')
+
+
+def candidate_rate(result):
+    '''Return the candidates derived per second.'''
+    return result.candidates / result.elapsed if result.elapsed else 0.0
+
+
+def edit_distance(a, b, limit):
+    '''Return the edit distance between two words, counting an adjacent
+    transposition as one edit, or limit + 1 if it is more than limit.'''
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        row = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = ca != cb
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if (prev2 is not None and i > 1 and j > 1 and ca == b[j - 2]
+                    and a[i - 2] == cb):
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev2, prev = prev, row
+    return min(prev[-1], limit + 1)
+
+
+def similar_words(word, max_distance=MAX_DISTANCE):
+    '''Return the indices of the words within max_distance of word,
+    nearest first.'''
+    distances = ((edit_distance(word, other, max_distance), n)
+                 for n, other in enumerate(wordlist()))
+    return [n for distance, n in sorted(distances)
+            if distance <= max_distance]
+
+
+def word_options(words, max_distance=MAX_DISTANCE):
+    '''Return the list of candidate word indices of each position of a
+    backup, as described in the module docstring.'''
+    checksum_bits(len(words))
+    index = word_index()
+    options = []
+    for word in words:
+        word = word.lower()
+        if word == '?':
+            options.append(list(range(len(index))))
+        elif word in index:
+            options.append([index[word]])
+        else:
+            similar = similar_words(word.rstrip('?'), max_distance)
+            if not similar:
+                raise RecoveryError(f'no word is like {word}')
+            options.append(similar)
+    return options
+
+
+def combinations(options):
+    '''Return the number of word combinations of options.'''
+    count = 1
+    for opts in options:
+        count *= len(opts)
+    return count
+
+
+def _combination(options, n):
+    '''Return the digits, per position, of the nth combination of
+    options.  The last position varies fastest.'''
+    digits = [0] * len(options)
+    for pos in range(len(options) - 1, -1, -1):
+        n, digits[pos] = divmod(n, len(options[pos]))
+    return digits
+
+
+def search_range(options, start, end, target, path, passphrase=''):
+    '''Search combinations start to end - 1 of options for the mnemonic
+    whose key at path hashes to target, a hash160.  Return a (mnemonic
+    or None, candidates) pair.'''
+    words = wordlist()
+    digits = _combination(options, start)
+    # Positions with a choice, last first, for the odometer
+    free = [pos for pos in range(len(options) - 1, -1, -1)
+            if len(options[pos]) > 1]
+    candidates = 0
+    for _ in range(start, end):
+        indices = [opts[digit] for opts, digit in zip(options, digits)]
+        if indices_entropy(indices) is not None:
+            candidates += 1
+            mnemonic = ' '.join(words[index] for index in indices)
+            seed = mnemonic_to_seed(mnemonic, passphrase)
+            if hash160(pubkey_from_seed(seed, path)) == target:
+                return mnemonic, candidates
+        for pos in free:
+            digits[pos] += 1
+            if digits[pos] < len(options[pos]):
+                break
+            digits[pos] = 0
+    return None, candidates
+
+
+def recover(options, target, path, passphrase='', executor=None,
+            workers=1, chunk_size=None, on_progress=None):
+    '''Search the word options of a backup for the mnemonic whose key at
+    path, a sequence of child numbers, hashes to target.  Return a
+    RecoveryResult.
+
+    If executor, a process pool of workers processes, is given, ranges
+    of chunk_size combinations are searched in parallel on it.
+    on_progress, if given, is called with the RecoveryResult so far as
+    each range is searched.
+    '''
+    total = combinations(options)
+    if chunk_size is None:
+        # Enough ranges to keep the workers busy to the end
+        chunk_size = max(16, min(4096, total // (workers * 8) or 1))
+    search = partial(search_range, options, target=target, path=path,
+                     passphrase=passphrase)
+    ranges = ((start, min(start + chunk_size, total))
+              for start in range(0, total, chunk_size))
+    start_time = time.monotonic()
+    searched = candidates = 0
+
+    def result(mnemonic=None):
+        return RecoveryResult(mnemonic, searched, candidates,
+                              time.monotonic() - start_time)
+
+    if executor is None:
+        for start, end in ranges:
+            mnemonic, count = search(start, end)
+            searched += end - start
+            candidates += count
+            if mnemonic is not None:
+                return result(mnemonic)
+            if on_progress is not None:
+                on_progress(result())
+        return result()
+
+    # Keep a few ranges queued per worker, so after a match little work
+    # is left to cancel
+    pending = {}
+    try:
+        while True:
+            while len(pending) < workers * 2:
+                start, end = next(ranges, (None, None))
+                if start is None:
+                    break
+                pending[executor.submit(search, start, end)] = end - start
+            if not pending:
+                return result()
+            done = wait(pending, return_when=FIRST_COMPLETED).done
+            future = next(iter(done))
+            size = pending.pop(future)
+            mnemonic, count = future.result()
+            searched += size
+            candidates += count
+            if mnemonic is not None:
+                return result(mnemonic)
+            if on_progress is not None:
+                on_progress(result())
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,229 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Bitcoin Cash Schnorr signatures over secp256k1.
+
+A signature is the 32-byte x coordinate of R followed by the 32-byte
+s, where R has a y coordinate that is a quadratic residue.  The
+challenge is SHA-256 of R.x, the compressed public key and the
+32-byte message.  Nonces follow RFC 6979 with the additional data
+"Schnorr+SHA256  ", so signing is deterministic.
+
+batch_verify() checks many signatures at once with a random linear
+combination, evaluated as one multi-scalar multiplication.
+'''
+
+import random
+from hashlib import sha256
+
+import ecdsa
+import ecdsa.ellipticcurve as EC
+from ecdsa import rfc6979
+
+from lib.signing import to_secret_exponent
+from lib.util import bytes_to_int
+
+
+CURVE = ecdsa.SECP256k1
+ORDER = CURVE.order
+P = CURVE.curve.p()
+GENERATOR = CURVE.generator
+NONCE_ALGO16 = b'Schnorr+SHA256  '
+
+
+class SchnorrError(Exception):
+    '''Raised for malformed keys or signatures.'''
+
+
+def _is_square(y):
+    '''Return True if y is a quadratic residue mod P.'''
+    return pow(y, (P - 1) // 2, P) == 1
+
+
+def _lift_x(x):
+    '''Return the affine point with x coordinate x whose y is a quadratic
+    residue, or None if there is none.  Since P = 3 mod 4 the square
+    root computed here is itself a residue.'''
+    if x >= P:
+        return None
+    y_sq = (pow(x, 3, P) + 7) % P
+    y = pow(y_sq, (P + 1) // 4, P)
+    if y * y % P != y_sq:
+        return None
+    return x, y
+
+
+def _point_from_pubkey(pubkey):
+    '''Return the affine point of a 33-byte compressed public key.'''
+    if len(pubkey) != 33 or pubkey[0] not in (2, 3):
+        raise SchnorrError('public key must be 33 bytes compressed')
+    point = _lift_x(bytes_to_int(pubkey[1:]))
+    if point is None:
+        raise SchnorrError('public key is not on the curve')
+    x, y = point
+    if (y & 1) != (pubkey[0] & 1):
+        y = P - y
+    return x, y
+
+
+def _challenge(r_bytes, pubkey, msg):
+    return bytes_to_int(sha256(r_bytes + pubkey + msg).digest()) % ORDER
+
+
+def _compressed(x, y):
+    return bytes([2 + (y & 1)]) + x.to_bytes(32, 'big')
+
+
+def sign(privkey, msg):
+    '''Return a 64-byte signature of the 32-byte msg.  privkey is a
+    MasterPrivKey, 32 raw bytes or a secret exponent.'''
+    if len(msg) != 32:
+        raise SchnorrError('message must be 32 bytes')
+    exponent = to_secret_exponent(privkey)
+    k = rfc6979.generate_k(ORDER, exponent, sha256, msg,
+                           extra_entropy=NONCE_ALGO16)
+    R = GENERATOR * k
+    if not _is_square(R.y()):
+        k = ORDER - k
+    pub = GENERATOR * exponent
+    r_bytes = R.x().to_bytes(32, 'big')
+    e = _challenge(r_bytes, _compressed(pub.x(), pub.y()), msg)
+    s = (k + e * exponent) % ORDER
+    return r_bytes + s.to_bytes(32, 'big')
+
+
+def _parse_sig(sig):
+    if len(sig) != 64:
+        raise SchnorrError('signature must be 64 bytes')
+    return bytes_to_int(sig[:32]), bytes_to_int(sig[32:])
+
+
+def verify(pubkey, msg, sig):
+    '''Return True if sig is a valid signature of msg by the 33-byte
+    compressed pubkey.'''
+    if len(msg) != 32:
+        raise SchnorrError('message must be 32 bytes')
+    r, s = _parse_sig(sig)
+    if r >= P or s >= ORDER:
+        return False
+    x, y = _point_from_pubkey(pubkey)
+    e = _challenge(sig[:32], pubkey, msg)
+    point = EC.PointJacobi(CURVE.curve, x, y, 1, ORDER)
+    # R = sG - eP
+    R = GENERATOR.mul_add(s, point, ORDER - e)
+    if R == EC.INFINITY:
+        return False
+    return R.x() == r and _is_square(R.y())
+
+
+# Jacobian coordinate arithmetic for multi-scalar multiplication.
+# Points are (X, Y, Z) tuples; None is the point at infinity.
+
+def _double(p):
+    if p is None:
+        return None
+    X, Y, Z = p
+    if not Y:
+        return None
+    A = X * X % P
+    B = Y * Y % P
+    C = B * B % P
+    D = 2 * ((X + B) * (X + B) - A - C) % P
+    E = 3 * A % P
+    X3 = (E * E - 2 * D) % P
+    Y3 = (E * (D - X3) - 8 * C) % P
+    Z3 = 2 * Y * Z % P
+    return X3, Y3, Z3
+
+
+def _add(p, q):
+    if p is None:
+        return q
+    if q is None:
+        return p
+    X1, Y1, Z1 = p
+    X2, Y2, Z2 = q
+    Z1Z1 = Z1 * Z1 % P
+    Z2Z2 = Z2 * Z2 % P
+    U1 = X1 * Z2Z2 % P
+    U2 = X2 * Z1Z1 % P
+    S1 = Y1 * Z2 * Z2Z2 % P
+    S2 = Y2 * Z1 * Z1Z1 % P
+    if U1 == U2:
+        return _double(p) if S1 == S2 else None
+    H = U2 - U1
+    R = S2 - S1
+    H2 = H * H % P
+    H3 = H * H2 % P
+    U1H2 = U1 * H2 % P
+    X3 = (R * R - H3 - 2 * U1H2) % P
+    Y3 = (R * (U1H2 - X3) - S1 * H3) % P
+    Z3 = H * Z1 * Z2 % P
+    return X3, Y3, Z3
+
+
+def multi_scalar_mul(pairs):
+    '''Return the sum of scalar * point over pairs of (scalar, (x, y))
+    with affine points, as a Jacobian point or None for infinity.
+
+    Uses Pippenger's bucket method: per window of c bits each point is
+    added into one of 2^c buckets, so the cost grows as n * 256 / c
+    additions plus 256 doublings, against 256 doublings per point for
+    separate multiplications.
+    '''
+    pairs = [(scalar % ORDER, (x, y, 1)) for scalar, (x, y) in pairs]
+    if not pairs:
+        return None
+    c = max(2, len(pairs).bit_length() - 2)
+    mask = (1 << c) - 1
+    result = None
+    for window in reversed(range((256 + c - 1) // c)):
+        for _ in range(c):
+            result = _double(result)
+        shift = window * c
+        buckets = [None] * (mask + 1)
+        for scalar, point in pairs:
+            index = (scalar >> shift) & mask
+            if index:
+                buckets[index] = _add(buckets[index], point)
+        running = total = None
+        for index in range(mask, 0, -1):
+            running = _add(running, buckets[index])
+            total = _add(total, running)
+        result = _add(result, total)
+    return result
+
+
+def batch_verify(items, rng=None):
+    '''Return True if every (pubkey, msg, sig) triple in items verifies.
+
+    Checks that sum(a_i * s_i) * G == sum(a_i * R_i + a_i * e_i * P_i)
+    for random 128-bit a_i, which an invalid signature passes with
+    negligible probability.  rng defaults to a system random source.
+    A False result does not say which signature is bad.
+    '''
+    rng = rng or random.SystemRandom()
+    pairs = []
+    s_sum = 0
+    for n, (pubkey, msg, sig) in enumerate(items):
+        if len(msg) != 32:
+            raise SchnorrError('message must be 32 bytes')
+        r, s = _parse_sig(sig)
+        if s >= ORDER:
+            return False
+        R = _lift_x(r)
+        if R is None:
+            return False
+        a = 1 if n == 0 else rng.getrandbits(128)
+        e = _challenge(sig[:32], pubkey, msg)
+        pairs.append((a, R))
+        pairs.append((a * e, _point_from_pubkey(pubkey)))
+        s_sum += a * s
+    if not pairs:
+        return True
+    pairs.append((-s_sum, (GENERATOR.x(), GENERATOR.y())))
+    return multi_scalar_mul(pairs) is None
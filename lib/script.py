@@ -0,0 +1,76 @@
+# Copyright (c) 2017-2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Construction of standard output scripts.'''
+
+
+class ScriptError(Exception):
+    '''Exception used for script errors.'''
+
+
+class OpCodes(object):
+    OP_0 = 0x00
+    OP_PUSHDATA1 = 0x4c
+    OP_PUSHDATA2 = 0x4d
+    OP_PUSHDATA4 = 0x4e
+    OP_1 = 0x51
+    OP_DUP = 0x76
+    OP_EQUAL = 0x87
+    OP_EQUALVERIFY = 0x88
+    OP_HASH160 = 0xa9
+    OP_CHECKSIG = 0xac
+    OP_CHECKMULTISIG = 0xae
+
+
+def push_data(data):
+    '''Returns the opcodes to push the data on the stack.'''
+    n = len(data)
+    if n < OpCodes.OP_PUSHDATA1:
+        return bytes([n]) + data
+    if n < 256:
+        return bytes([OpCodes.OP_PUSHDATA1, n]) + data
+    if n < 65536:
+        return bytes([OpCodes.OP_PUSHDATA2]) + n.to_bytes(2, 'little') + data
+    return bytes([OpCodes.OP_PUSHDATA4]) + n.to_bytes(4, 'little') + data
+
+
+def push_small_int(n):
+    '''Returns the opcode to push an integer in the range 0 to 16.'''
+    if not 0 <= n <= 16:
+        raise ScriptError(f'cannot push {n} as a small integer')
+    return bytes([OpCodes.OP_0 if n == 0 else OpCodes.OP_1 + n - 1])
+
+
+class Script(object):
+
+    @classmethod
+    def P2PKH_script(cls, hash160):
+        return (bytes([OpCodes.OP_DUP, OpCodes.OP_HASH160])
+                + push_data(hash160)
+                + bytes([OpCodes.OP_EQUALVERIFY, OpCodes.OP_CHECKSIG]))
+
+    @classmethod
+    def P2SH_script(cls, hash160):
+        return (bytes([OpCodes.OP_HASH160])
+                + push_data(hash160)
+                + bytes([OpCodes.OP_EQUAL]))
+
+    @classmethod
+    def P2PK_script(cls, pubkey):
+        return push_data(pubkey) + bytes([OpCodes.OP_CHECKSIG])
+
+    @classmethod
+    def multisig_script(cls, m, pubkeys):
+        '''Returns the script for an m-of-n multisig output.  Pubkeys are
+        used in the order given.'''
+        n = len(pubkeys)
+        if not 1 <= m <= n <= 16:
+            raise ScriptError(f'{m:d} of {n:d} multisig script not possible')
+        return (push_small_int(m)
+                + b''.join(push_data(pubkey) for pubkey in pubkeys)
+                + push_small_int(n)
+                + bytes([OpCodes.OP_CHECKMULTISIG]))
@@ -0,0 +1,170 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Bitcoin serialization of transactions, headers and Merkle branches.
+
+Writer appends to a single growable bytearray, so serializing a large
+transaction is linear in its size rather than building and
+concatenating many small bytes objects.  Fixed-layout records are
+packed with precompiled Structs.  Transaction parsing lives in lib.tx,
+which uses read_varint from here.
+'''
+
+from struct import Struct
+
+from lib.util import (unpack_uint16_from, unpack_uint32_from,
+                      unpack_uint64_from)
+
+
+pack_le_int32 = Struct('<i').pack
+pack_le_int64 = Struct('<q').pack
+pack_le_uint16 = Struct('<H').pack
+pack_le_uint32 = Struct('<I').pack
+pack_le_uint64 = Struct('<Q').pack
+
+# value and a one-byte script length; almost all scripts are short
+pack_output_prefix = Struct('<qB').pack
+# version, prev_hash, merkle_root, timestamp, bits, nonce
+_header_struct = Struct('<i32s32sIII')
+pack_header = _header_struct.pack
+unpack_header_from = _header_struct.unpack_from
+
+
+def varint_len(value):
+    '''Return the serialized length of a varint.'''
+    if value < 253:
+        return 1
+    if value < 65536:
+        return 3
+    if value < 4294967296:
+        return 5
+    return 9
+
+
+def read_varint(buf, offset=0):
+    '''Read a varint from buf at offset.  Return a (value, offset) pair
+    where offset is that of the following byte.'''
+    n = buf[offset]
+    if n < 253:
+        return n, offset + 1
+    if n == 253:
+        return unpack_uint16_from(buf, offset + 1)[0], offset + 3
+    if n == 254:
+        return unpack_uint32_from(buf, offset + 1)[0], offset + 5
+    return unpack_uint64_from(buf, offset + 1)[0], offset + 9
+
+
+def read_merkle_branch(buf, offset=0):
+    '''Read a serialized Merkle branch.  Return a (branch, index, offset)
+    triple; branch is a list of binary hashes.'''
+    count, offset = read_varint(buf, offset)
+    view = memoryview(buf)
+    branch = [bytes(view[pos: pos + 32])
+              for pos in range(offset, offset + count * 32, 32)]
+    offset += count * 32
+    index, = unpack_uint32_from(buf, offset)
+    return branch, index, offset + 4
+
+
+class Writer(object):
+    '''A reusable, growable buffer for serializing to.'''
+
+    __slots__ = ('buf', )
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def __len__(self):
+        return len(self.buf)
+
+    def clear(self):
+        '''Empty the buffer so it can be reused.'''
+        del self.buf[:]
+
+    def getvalue(self):
+        '''Return the serialized bytes.'''
+        return bytes(self.buf)
+
+    def write(self, data):
+        self.buf += data
+
+    def write_varint(self, value):
+        if value < 0:
+            raise ValueError('varint cannot be negative')
+        buf = self.buf
+        if value < 253:
+            buf.append(value)
+        elif value < 65536:
+            buf.append(253)
+            buf += pack_le_uint16(value)
+        elif value < 4294967296:
+            buf.append(254)
+            buf += pack_le_uint32(value)
+        else:
+            buf.append(255)
+            buf += pack_le_uint64(value)
+
+    def write_varbytes(self, data):
+        self.write_varint(len(data))
+        self.buf += data
+
+    def write_le_int32(self, value):
+        self.buf += pack_le_int32(value)
+
+    def write_le_uint32(self, value):
+        self.buf += pack_le_uint32(value)
+
+    def write_le_int64(self, value):
+        self.buf += pack_le_int64(value)
+
+    def write_input(self, prev_hash, prev_idx, script, sequence):
+        # prev_hash may be a memoryview, which Struct does not accept
+        self.buf += prev_hash
+        self.buf += pack_le_uint32(prev_idx)
+        self.write_varbytes(script)
+        self.buf += pack_le_uint32(sequence)
+
+    def write_output(self, value, script):
+        if len(script) < 253:
+            self.buf += pack_output_prefix(value, len(script))
+        else:
+            self.buf += pack_le_int64(value)
+            self.write_varint(len(script))
+        self.buf += script
+
+    def write_tx(self, version, inputs, outputs, locktime):
+        '''Serialize a transaction.  inputs is a sequence of (prev_hash,
+        prev_idx, script, sequence) tuples; outputs a sequence of (value,
+        script) pairs.  lib.tx TxInput and TxOutput objects will do.'''
+        self.buf += pack_le_int32(version)
+        self.write_varint(len(inputs))
+        write_input = self.write_input
+        for txin in inputs:
+            write_input(*txin)
+        self.write_varint(len(outputs))
+        write_output = self.write_output
+        for value, script in outputs:
+            write_output(value, script)
+        self.buf += pack_le_uint32(locktime)
+
+    def write_header(self, version, prev_hash, merkle_root, timestamp, bits,
+                     nonce):
+        self.buf += pack_header(version, prev_hash, merkle_root, timestamp,
+                                bits, nonce)
+
+    def write_merkle_branch(self, branch, index):
+        self.write_varint(len(branch))
+        for hash_ in branch:
+            self.buf += hash_
+        self.buf += pack_le_uint32(index)
+
+
+def serialize_tx(version, inputs, outputs, locktime):
+    '''Return a serialized transaction as bytes.  See Writer.write_tx.'''
+    writer = Writer()
+    writer.write_tx(version, inputs, outputs, locktime)
+    return writer.getvalue()
@@ -0,0 +1,143 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Bitcoin Cash signature hashes (the BIP143 digest with SIGHASH_FORKID).
+
+The digest of each input commits to hashes of all the transaction's
+prevouts, sequences and outputs.  TxSigHasher computes those once per
+transaction and sighash type, so signing n inputs costs O(n) hashing
+rather than O(n^2).
+'''
+
+from lib.bip32 import derive_path
+from lib.hash import double_sha256
+from lib.serialize import Writer
+from lib.signing import sign_batch
+
+
+SIGHASH_ALL = 0x01
+SIGHASH_NONE = 0x02
+SIGHASH_SINGLE = 0x03
+SIGHASH_FORKID = 0x40
+SIGHASH_ANYONECANPAY = 0x80
+
+ZERO_HASH = bytes(32)
+
+
+class SigHashError(Exception):
+    '''Raised for an invalid sighash type or input.'''
+
+
+class TxSigHasher(object):
+    '''Computes signature hashes for the inputs of a transaction.
+
+    inputs is a sequence of (prev_hash, prev_idx, script, sequence)
+    tuples and outputs a sequence of (value, script) pairs, as for
+    lib.serialize.Writer.write_tx.
+    '''
+
+    def __init__(self, version, inputs, outputs, locktime, fork_id=0):
+        self.version = version
+        self.inputs = inputs
+        self.outputs = outputs
+        self.locktime = locktime
+        self.fork_id = fork_id
+        self._hash_prevouts = None
+        self._hash_sequence = None
+        self._hash_outputs = None
+
+    def hash_prevouts(self):
+        if self._hash_prevouts is None:
+            writer = Writer()
+            for prev_hash, prev_idx, _, _ in self.inputs:
+                writer.write(prev_hash)
+                writer.write_le_uint32(prev_idx)
+            self._hash_prevouts = double_sha256(writer.buf)
+        return self._hash_prevouts
+
+    def hash_sequence(self):
+        if self._hash_sequence is None:
+            writer = Writer()
+            for _, _, _, sequence in self.inputs:
+                writer.write_le_uint32(sequence)
+            self._hash_sequence = double_sha256(writer.buf)
+        return self._hash_sequence
+
+    def hash_outputs(self):
+        if self._hash_outputs is None:
+            writer = Writer()
+            for value, script in self.outputs:
+                writer.write_output(value, script)
+            self._hash_outputs = double_sha256(writer.buf)
+        return self._hash_outputs
+
+    def preimage(self, n, script_code, value, sighash=SIGHASH_ALL):
+        '''Return the preimage for input n.  script_code is the script being
+        satisfied and value that of the output being spent.
+        SIGHASH_FORKID is implied.'''
+        if not 0 <= n < len(self.inputs):
+            raise SigHashError(f'no input {n:d}')
+        base = sighash & 0x1f
+        if base not in (SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE):
+            raise SigHashError(f'invalid sighash type {sighash:#x}')
+        anyonecanpay = sighash & SIGHASH_ANYONECANPAY
+
+        hash_prevouts = ZERO_HASH if anyonecanpay else self.hash_prevouts()
+        if anyonecanpay or base != SIGHASH_ALL:
+            hash_sequence = ZERO_HASH
+        else:
+            hash_sequence = self.hash_sequence()
+        if base == SIGHASH_ALL:
+            hash_outputs = self.hash_outputs()
+        elif base == SIGHASH_SINGLE and n < len(self.outputs):
+            writer = Writer()
+            writer.write_output(*self.outputs[n])
+            hash_outputs = double_sha256(writer.buf)
+        else:
+            hash_outputs = ZERO_HASH
+
+        prev_hash, prev_idx, _, sequence = self.inputs[n]
+        writer = Writer()
+        writer.write_le_int32(self.version)
+        writer.write(hash_prevouts)
+        writer.write(hash_sequence)
+        writer.write(prev_hash)
+        writer.write_le_uint32(prev_idx)
+        writer.write_varbytes(script_code)
+        writer.write_le_int64(value)
+        writer.write_le_uint32(sequence)
+        writer.write(hash_outputs)
+        writer.write_le_uint32(self.locktime)
+        writer.write_le_uint32(self.sighash_type(sighash))
+        return writer.getvalue()
+
+    def sighash_type(self, sighash):
+        '''Return the 32-bit sighash type committed to.'''
+        return (self.fork_id << 8) | sighash | SIGHASH_FORKID
+
+    def digest(self, n, script_code, value, sighash=SIGHASH_ALL):
+        '''Return the signature hash for input n.'''
+        return double_sha256(self.preimage(n, script_code, value, sighash))
+
+
+def sign_inputs(hasher, master_privkey, specs, sighash=SIGHASH_ALL,
+                executor=None):
+    '''Sign inputs of a transaction with keys derived from master_privkey.
+
+    specs is an iterable of (n, path, script_code, value) tuples; n is
+    the input index and path the sequence of child numbers of the
+    signing key.  Return a list of DER signatures with the sighash
+    byte appended, in the order of specs.  executor is passed to
+    lib.signing.sign_batch.
+    '''
+    cache = {}
+    pairs = [(derive_path(master_privkey, path, cache),
+              hasher.digest(n, script_code, value, sighash))
+             for n, path, script_code, value in specs]
+    sighash_byte = bytes([(sighash | SIGHASH_FORKID) & 0xff])
+    return [signature + sighash_byte
+            for signature in sign_batch(pairs, executor)]
@@ -0,0 +1,90 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Batch ECDSA signing of digests, optionally over a process pool.
+
+Nonces are deterministic (RFC 6979) so a batch signed in parallel is
+bit-identical to one signed serially.  Signing works directly from
+secret exponents with the curve generator, whose precomputed
+multiplication tables are built once per worker process, and avoids
+constructing a SigningKey (and so a public key) per signature.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+
+import ecdsa
+import ecdsa.numbertheory as NT
+from ecdsa import rfc6979
+from ecdsa.util import sigencode_der
+
+from lib.util import bytes_to_int, chunks
+
+
+CURVE = ecdsa.SECP256k1
+ORDER = CURVE.order
+
+
+def to_secret_exponent(key):
+    '''Accepts a MasterPrivKey, 32 raw bytes or an integer exponent.'''
+    if isinstance(key, int):
+        exponent = key
+    elif isinstance(key, (bytes, bytearray)):
+        exponent = bytes_to_int(key)
+    else:
+        exponent = key.secret_exponent()
+    if not 1 <= exponent < ORDER:
+        raise ValueError('invalid secret exponent')
+    return exponent
+
+
+def sign_digest(exponent, digest):
+    '''Sign a 32-byte digest with the secret exponent.  Return a low-S
+    DER signature.  The nonce is derived with RFC 6979.'''
+    generator = CURVE.generator
+    e = bytes_to_int(digest)
+    retry_gen = 0
+    while True:
+        k = rfc6979.generate_k(ORDER, exponent, sha256, digest,
+                               retry_gen=retry_gen)
+        r = (generator * k).x() % ORDER
+        s = NT.inverse_mod(k, ORDER) * (e + r * exponent) % ORDER
+        if r and s:
+            break
+        retry_gen += 1
+    if s > ORDER // 2:
+        s = ORDER - s
+    return sigencode_der(r, s, ORDER)
+
+
+def _sign_chunk(pairs):
+    return [sign_digest(exponent, digest) for exponent, digest in pairs]
+
+
+def _init_worker():
+    # Build the generator's precomputed tables once per process
+    CURVE.generator * 1
+
+
+def signing_pool(max_workers=None):
+    '''Return a process pool suitable for passing to sign_batch.'''
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               initializer=_init_worker)
+
+
+def sign_batch(pairs, executor=None, chunk_size=32):
+    '''Sign a batch of (key, digest) pairs and return the signatures in
+    order.  A key is a MasterPrivKey, 32 raw bytes, or a secret exponent.
+
+    If executor is given and the batch is large enough, chunks of
+    chunk_size pairs are signed in parallel on it.
+    '''
+    pairs = [(to_secret_exponent(key), digest) for key, digest in pairs]
+    if executor is None or len(pairs) <= chunk_size:
+        return _sign_chunk(pairs)
+    results = executor.map(_sign_chunk, chunks(pairs, chunk_size))
+    return [signature for chunk in results for signature in chunk]
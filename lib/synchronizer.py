@@ -4,3 +4,245 @@
 #
 # See the file "LICENCE" for information about the copyright
 # and warranty status of this software.
+
+'''Synchronization of scripthash subscriptions with a server.'''
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+from lib.hash import hash_to_hex_str, hex_str_to_hash
+import lib.instrument as instrument
+from lib.history import parse_history
+from lib.util import LoggedClass
+
+
+# Scheduling priorities, most urgent first
+PRIORITY_ACTIVE = 0     # Addresses with recent or unconfirmed history
+PRIORITY_RECEIVE = 1    # Unused receiving addresses
+PRIORITY_CHANGE = 2     # Unused change addresses
+PRIORITY_DORMANT = 3    # Addresses whose history is old
+
+# Status of a subscription whose history must be fetched again
+_STALE = object()
+
+
+class Scheduler(LoggedClass):
+    '''Runs queued work items in priority order with backpressure.
+
+    func is a coroutine function called with each item.  At most
+    max_in_flight calls are outstanding at once, so a slow server
+    throttles how fast new requests are made.  If rate is given, no
+    more than that many calls are started per second on average, in
+    bursts of at most burst.  Items of equal priority run in the order
+    added.
+    '''
+
+    def __init__(self, func, max_in_flight=50, rate=None, burst=10,
+                 window=10.0):
+        super().__init__()
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1')
+        self.func = func
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.token_time = time.monotonic()
+        self.queue = []
+        self.counter = itertools.count()
+        self.in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.window = window
+        self.completion_times = deque()
+        self.slot_free = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.runner = None
+
+    def add(self, item, priority):
+        '''Queue an item.  Lower priorities run first.'''
+        heapq.heappush(self.queue, (priority, next(self.counter), item))
+        self.idle.clear()
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.ensure_future(self._run())
+
+    async def join(self):
+        '''Wait until the queue is empty and nothing is in flight.'''
+        await self.idle.wait()
+
+    def cancel(self):
+        '''Discard queued items.  Those in flight complete normally.'''
+        self.queue.clear()
+        if self.runner:
+            self.runner.cancel()
+        self._check_idle()
+
+    async def _take_token(self):
+        if self.rate is None:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens
+                              + (now - self.token_time) * self.rate)
+            self.token_time = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def _run(self):
+        while self.queue:
+            while self.in_flight >= self.max_in_flight:
+                self.slot_free.clear()
+                await self.slot_free.wait()
+            await self._take_token()
+            # Pop only now so later, more urgent, items go first
+            _, _, item = heapq.heappop(self.queue)
+            self.in_flight += 1
+            asyncio.ensure_future(self._call(item))
+
+    async def _call(self, item):
+        try:
+            await self.func(item)
+        except Exception as e:
+            self.errors += 1
+            self.log_error('work item failed: %r', e, throttle=True)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.completion_times.append(time.monotonic())
+            self.slot_free.set()
+            self._check_idle()
+
+    def _check_idle(self):
+        if not self.queue and not self.in_flight:
+            self.idle.set()
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def throughput(self):
+        '''Return completions per second over the recent window.'''
+        times = self.completion_times
+        cutoff = time.monotonic() - self.window
+        while times and times[0] < cutoff:
+            times.popleft()
+        return len(times) / self.window
+
+    def metrics(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'errors': self.errors,
+            'throughput': self.throughput(),
+        }
+
+
+class Synchronizer(LoggedClass):
+    '''Subscribes to scripthashes over a server session and passes their
+    status changes to a handler.
+
+    session must provide a coroutine send_request(method, args); its
+    owner should pass scripthash notifications to on_notification().
+    handler is a coroutine function called with (scripthash, status)
+    whenever a subscribed scripthash's status changes.  Scripthashes
+    are binary here, and hex strings on the wire.
+
+    If prefetch is given it is called with the tx hashes of each
+    history fetched, e.g. TxCache.prefetch.  It must not block.
+
+    Subscriptions are made through a Scheduler; keyword arguments are
+    passed to its constructor.
+    '''
+
+    def __init__(self, session, handler, prefetch=None, **kwargs):
+        super().__init__()
+        self.session = session
+        self.handler = handler
+        self.prefetch = prefetch
+        self.statuses = {}
+        self.scheduler = Scheduler(self._subscribe, **kwargs)
+        # Reports on subscriptions queued since the queue was last empty
+        self.subscribe_progress = None
+
+    def _queue(self, scripthash, priority):
+        self.scheduler.add(scripthash, priority)
+        if self.subscribe_progress is None:
+            self.subscribe_progress = self.progress('subscriptions')
+        self.subscribe_progress.total += 1
+
+    def subscribe(self, scripthashes, priority=PRIORITY_RECEIVE):
+        '''Queue subscriptions to an iterable of scripthashes.'''
+        for scripthash in scripthashes:
+            if scripthash not in self.statuses:
+                self.statuses[scripthash] = None
+                self._queue(scripthash, priority)
+
+    def resync(self, scripthashes, priority=PRIORITY_ACTIVE):
+        '''Queue a status query for subscribed scripthashes, e.g. after a
+        reorg.  The handler is called for each whatever its status.'''
+        for scripthash in scripthashes:
+            if scripthash in self.statuses:
+                self.statuses[scripthash] = _STALE
+                self._queue(scripthash, priority)
+
+    async def wait_idle(self):
+        '''Wait until all queued subscriptions have been made.'''
+        await self.scheduler.join()
+
+    async def _subscribe(self, scripthash):
+        try:
+            # Skip if unsubscribed while queued
+            if scripthash not in self.statuses:
+                return
+            with instrument.timer('sync.subscribe'):
+                status = await self.session.send_request(
+                    'blockchain.scripthash.subscribe',
+                    [hash_to_hex_str(scripthash)])
+            await self._set_status(scripthash, status)
+        finally:
+            progress = self.subscribe_progress
+            if progress is not None:
+                progress.update()
+                if progress.count >= progress.total:
+                    progress.done()
+                    self.subscribe_progress = None
+
+    async def unsubscribe(self, scripthashes):
+        '''Unsubscribe from an iterable of scripthashes.  Notifications for
+        them that arrive later are ignored.'''
+        scripthashes = [scripthash for scripthash in scripthashes
+                        if scripthash in self.statuses]
+        for scripthash in scripthashes:
+            del self.statuses[scripthash]
+        await asyncio.gather(*(self.session.send_request(
+            'blockchain.scripthash.unsubscribe', [hash_to_hex_str(scripthash)])
+                               for scripthash in scripthashes))
+
+    async def on_notification(self, scripthash_hex, status):
+        '''Called with the parameters of a scripthash notification.'''
+        scripthash = hex_str_to_hash(scripthash_hex)
+        if scripthash in self.statuses:
+            await self._set_status(scripthash, status)
+
+    async def _set_status(self, scripthash, status):
+        if scripthash in self.statuses and self.statuses[scripthash] != status:
+            self.statuses[scripthash] = status
+            await self.handler(scripthash, status)
+
+    async def get_history(self, scripthash):
+        '''Return the history of scripthash as (tx_hash, height, fee)
+        entries.'''
+        with instrument.timer('sync.get_history'):
+            result = await self.session.send_request(
+                'blockchain.scripthash.get_history',
+                [hash_to_hex_str(scripthash)])
+        hist = parse_history(result)
+        if self.prefetch is not None:
+            self.prefetch([tx_hash for tx_hash, _, _ in hist])
+        return hist
@@ -0,0 +1,194 @@
+# Copyright (c) 2016-2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''Deserialization of transactions and blocks.
+
+Parsing works over a memoryview of the original buffer and never
+copies it: hashes and scripts are memoryview slices, and transaction
+hashes are computed over the transaction's span of the buffer.
+Slices of a read-only buffer such as bytes are hashable and compare
+equal to bytes, so scripts can be looked up in a set of bytes
+directly.
+'''
+
+import struct
+from collections import namedtuple
+
+from lib.hash import double_sha256, hash_to_hex_str
+from lib.serialize import read_varint
+from lib.util import unpack_int32_from, unpack_int64_from, unpack_uint32_from
+
+
+HEADER_LEN = 80
+
+
+class TxInput(namedtuple('TxInput', 'prev_hash prev_idx script sequence')):
+    '''A transaction input.  prev_hash and script are memoryviews.'''
+
+    def is_coinbase(self):
+        return self.prev_idx == 0xffffffff and not any(self.prev_hash)
+
+
+class TxOutput(namedtuple('TxOutput', 'value script')):
+    '''A transaction output.  script is a memoryview.'''
+
+
+class Tx(object):
+    '''A transaction located in a buffer.
+
+    Construction records the offsets of the input and output sections;
+    inputs() and outputs() decode them lazily on each call.
+    '''
+
+    __slots__ = ('view', 'start', 'end', 'version', 'locktime',
+                 'input_count', 'inputs_start', 'output_count',
+                 'outputs_start')
+
+    def __init__(self, view, start, end, version, locktime, input_count,
+                 inputs_start, output_count, outputs_start):
+        self.view = view
+        self.start = start
+        self.end = end
+        self.version = version
+        self.locktime = locktime
+        self.input_count = input_count
+        self.inputs_start = inputs_start
+        self.output_count = output_count
+        self.outputs_start = outputs_start
+
+    def raw(self):
+        '''Return the serialized transaction as a memoryview.'''
+        return self.view[self.start:self.end]
+
+    def size(self):
+        return self.end - self.start
+
+    def tx_hash(self):
+        '''Return the binary transaction hash.'''
+        return double_sha256(self.view[self.start:self.end])
+
+    def txid(self):
+        '''Return the transaction hash in display form.'''
+        return hash_to_hex_str(self.tx_hash())
+
+    def inputs(self):
+        '''Yield the transaction's inputs as TxInput objects.'''
+        deserializer = Deserializer(self.view, self.inputs_start)
+        for _ in range(self.input_count):
+            yield deserializer._read_input()
+
+    def outputs(self):
+        '''Yield the transaction's outputs as TxOutput objects.'''
+        deserializer = Deserializer(self.view, self.outputs_start)
+        for _ in range(self.output_count):
+            yield deserializer._read_output()
+
+    def output_scripts(self):
+        '''Yield (tx_pos, script) pairs; cheaper than outputs() when values
+        are not needed.'''
+        view = self.view
+        deserializer = Deserializer(view, self.outputs_start)
+        for tx_pos in range(self.output_count):
+            deserializer.cursor += 8
+            script_len = deserializer._read_varint()
+            cursor = deserializer.cursor
+            deserializer.cursor += script_len
+            yield tx_pos, view[cursor:cursor + script_len]
+
+
+class Deserializer(object):
+    '''Deserializes transactions and blocks from a buffer.
+
+    binary is any object supporting the buffer protocol; start is the
+    offset to begin reading at.
+    '''
+
+    def __init__(self, binary, start=0):
+        self.view = memoryview(binary)
+        self.cursor = start
+
+    def read_tx(self):
+        '''Return the Tx at the cursor and advance past it.'''
+        start = self.cursor
+        try:
+            version = self._read_le_int32()
+            input_count = self._read_varint()
+            inputs_start = self.cursor
+            for _ in range(input_count):
+                self.cursor += 36
+                script_len = self._read_varint()
+                self.cursor += script_len + 4
+            output_count = self._read_varint()
+            outputs_start = self.cursor
+            for _ in range(output_count):
+                self.cursor += 8
+                script_len = self._read_varint()
+                self.cursor += script_len
+            locktime = self._read_le_uint32()
+        except (IndexError, struct.error):
+            raise ValueError('truncated transaction') from None
+        return Tx(self.view, start, self.cursor, version, locktime,
+                  input_count, inputs_start, output_count, outputs_start)
+
+    def read_txs(self, count):
+        '''Yield count transactions.'''
+        for _ in range(count):
+            yield self.read_tx()
+
+    def read_header(self):
+        '''Return the 80-byte block header at the cursor as a memoryview.'''
+        return self._read_nbytes(HEADER_LEN)
+
+    def read_block(self):
+        '''Return a (header, txs) pair for the block at the cursor.  txs is
+        a generator of the block's transactions.'''
+        header = self.read_header()
+        return header, self.read_txs(self._read_varint())
+
+    def _read_input(self):
+        return TxInput(
+            self._read_nbytes(32),      # prev_hash
+            self._read_le_uint32(),     # prev_idx
+            self._read_varbytes(),      # script
+            self._read_le_uint32()      # sequence
+        )
+
+    def _read_output(self):
+        return TxOutput(
+            self._read_le_int64(),      # value
+            self._read_varbytes(),      # script
+        )
+
+    def _read_nbytes(self, n):
+        cursor = self.cursor
+        end = cursor + n
+        if end > len(self.view):
+            raise ValueError('buffer too short')
+        self.cursor = end
+        return self.view[cursor:end]
+
+    def _read_varbytes(self):
+        return self._read_nbytes(self._read_varint())
+
+    def _read_varint(self):
+        value, self.cursor = read_varint(self.view, self.cursor)
+        return value
+
+    def _read_le_int32(self):
+        result, = unpack_int32_from(self.view, self.cursor)
+        self.cursor += 4
+        return result
+
+    def _read_le_int64(self):
+        result, = unpack_int64_from(self.view, self.cursor)
+        self.cursor += 8
+        return result
+
+    def _read_le_uint32(self):
+        result, = unpack_uint32_from(self.view, self.cursor)
+        self.cursor += 4
+        return result
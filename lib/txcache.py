@@ -0,0 +1,198 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''A cache of raw transactions keyed by binary tx hash.
+
+Recently used transactions are held in memory in an LRU bounded by
+their total size in bytes.  Every transaction is also appended to a
+data file on disk, with a (tx_hash, offset, length) record appended
+to an index file; only the index is read at startup.  Transactions
+are never removed from disk, as a confirmed transaction never changes.
+
+prefetch() is the hook for lib.synchronizer.Synchronizer: it is passed
+the tx hashes of each history fetched, and queues fetches of those not
+already cached at low priority through a Scheduler.
+'''
+
+import os
+from collections import OrderedDict
+from struct import Struct
+
+from lib.hash import double_sha256, hash_to_hex_str
+from lib.synchronizer import PRIORITY_DORMANT, Scheduler
+from lib.util import LoggedClass
+
+
+# tx_hash, offset, length
+_index_record = Struct('<32sQI')
+
+
+class TxCacheError(Exception):
+    '''Raised when a server returns a transaction that does not match.'''
+
+
+class TxCache(LoggedClass):
+    '''Raw transaction cache.  session is as for Synchronizer; path is
+    that of the data file, and the index is stored beside it.  Without
+    a path the cache is memory-only.  Keyword arguments are passed to
+    the prefetch Scheduler.'''
+
+    def __init__(self, session, path=None, max_bytes=16 * 1024 * 1024,
+                 **kwargs):
+        super().__init__()
+        self.session = session
+        self.path = path
+        self.max_bytes = max_bytes
+        # tx_hash -> raw bytes, least recently used first
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        # tx_hash -> (offset, length) in the data file
+        self.index = {}
+        self.disk_bytes = 0
+        self.data_file = self.index_file = None
+        self.hits = self.misses = self.bytes_saved = 0
+        self.prefetching = set()
+        self.scheduler = Scheduler(self._prefetch_one, **kwargs)
+        if path is not None:
+            self._open(path)
+
+    def _open(self, path):
+        index_path = path + '.idx'
+        for name in (path, index_path):
+            open(name, 'ab').close()
+        self.disk_bytes = os.path.getsize(path)
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        good = 0
+        for tx_hash, offset, length in _index_record.iter_unpack(
+                data[:len(data) - len(data) % _index_record.size]):
+            # A crash can leave index records for data never written
+            if offset + length > self.disk_bytes:
+                break
+            self.index[tx_hash] = (offset, length)
+            good += _index_record.size
+        if good != len(data):
+            self.log_warning(f'discarding {len(data) - good:,d} bytes of '
+                             f'{index_path}')
+            with open(index_path, 'r+b') as f:
+                f.truncate(good)
+        self.data_file = open(path, 'a+b')
+        self.index_file = open(index_path, 'ab')
+
+    def close(self):
+        self.scheduler.cancel()
+        self.prefetching.clear()
+        for f in (self.data_file, self.index_file):
+            if f is not None:
+                f.close()
+        self.data_file = self.index_file = None
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.memory or tx_hash in self.index
+
+    def __len__(self):
+        # Everything in memory is on disk too, if there is a disk
+        return len(self.index) if self.path is not None else len(self.memory)
+
+    def _remember(self, tx_hash, raw):
+        '''Add to the memory tier, evicting as necessary.'''
+        if len(raw) > self.max_bytes:
+            return
+        self.memory[tx_hash] = raw
+        self.memory_bytes += len(raw)
+        while self.memory_bytes > self.max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _read(self, tx_hash):
+        offset, length = self.index[tx_hash]
+        self.data_file.seek(offset)
+        return self.data_file.read(length)
+
+    def get(self, tx_hash):
+        '''Return the raw transaction, or None if not cached.'''
+        raw = self.memory.get(tx_hash)
+        if raw is not None:
+            self.memory.move_to_end(tx_hash)
+        elif tx_hash in self.index:
+            raw = self._read(tx_hash)
+            self._remember(tx_hash, raw)
+        else:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_saved += len(raw)
+        return raw
+
+    def put(self, tx_hash, raw):
+        '''Add a raw transaction to the cache.'''
+        raw = bytes(raw)
+        if tx_hash in self.memory:
+            self.memory.move_to_end(tx_hash)
+        else:
+            self._remember(tx_hash, raw)
+        if self.data_file is not None and tx_hash not in self.index:
+            offset = self.disk_bytes
+            self.data_file.seek(0, os.SEEK_END)
+            self.data_file.write(raw)
+            self.data_file.flush()
+            self.index_file.write(_index_record.pack(tx_hash, offset,
+                                                     len(raw)))
+            self.index_file.flush()
+            self.index[tx_hash] = (offset, len(raw))
+            self.disk_bytes += len(raw)
+
+    async def _request(self, tx_hash):
+        raw = bytes.fromhex(await self.session.send_request(
+            'blockchain.transaction.get', [hash_to_hex_str(tx_hash)]))
+        if double_sha256(raw) != tx_hash:
+            raise TxCacheError(f'server sent wrong transaction for '
+                               f'{hash_to_hex_str(tx_hash)}')
+        self.put(tx_hash, raw)
+        return raw
+
+    async def fetch(self, tx_hash):
+        '''Return the raw transaction, requesting it from the server if it
+        is not cached.'''
+        raw = self.get(tx_hash)
+        if raw is None:
+            raw = await self._request(tx_hash)
+        return raw
+
+    def prefetch(self, tx_hashes):
+        '''Queue background fetches of those tx_hashes not cached.'''
+        for tx_hash in tx_hashes:
+            if tx_hash not in self and tx_hash not in self.prefetching:
+                self.prefetching.add(tx_hash)
+                self.scheduler.add(tx_hash, PRIORITY_DORMANT)
+
+    async def _prefetch_one(self, tx_hash):
+        try:
+            if tx_hash not in self:
+                await self._request(tx_hash)
+        finally:
+            self.prefetching.discard(tx_hash)
+
+    async def wait_prefetched(self):
+        '''Wait until queued prefetches are done.'''
+        await self.scheduler.join()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def metrics(self):
+        return {
+            'count': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+            'bytes_saved': self.bytes_saved,
+            'memory_bytes': self.memory_bytes,
+            'disk_bytes': self.disk_bytes,
+            'prefetch_queue': self.scheduler.queue_depth(),
+        }
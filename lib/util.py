@@ -27,59 +27,401 @@
 '''Miscellaneous utility classes and functions.'''
 
 
-import array
-import inspect
-from ipaddress import ip_address
 import logging
-import re
 import sys
-from collections import Container, Mapping
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
 from struct import pack, Struct
 
 
 class LoggedClass(object):
+    '''Base class of objects with a logger.
+
+    Messages are %-style format strings with arguments, and are only
+    formatted if the level is enabled.  With throttle=True a message is
+    rate-limited: at most LOG_BURST messages with the same key (by
+    default the format string) are logged per LOG_WINDOW seconds.  When
+    a window with suppressions ends, the last message suppressed is
+    logged saying how many were.  That happens on the next log call, or
+    on time if an event loop is running.
+    '''
+
+    LOG_WINDOW = 60.0
+    LOG_BURST = 3
 
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.INFO)
         self.log_prefix = ''
-        self.throttled = 0
+        # key -> [window start, count logged in window, count suppressed,
+        #         level, msg and args of the last message]
+        self.rate_limits = {}
+        # When the earliest window with suppressions ends, or None
+        self.flush_at = None
 
-    def log_info(self, msg, throttle=False):
-        # Prevent annoying log messages by throttling them if there
-        # are too many in a short period
+    def _log(self, level, msg, args, throttle, key):
+        if self.flush_at is not None and time.monotonic() >= self.flush_at:
+            self.flush_suppressed()
+        logger = self.logger
+        if not logger.isEnabledFor(level):
+            return
         if throttle:
-            self.throttled += 1
-            if self.throttled > 3:
+            now = time.monotonic()
+            key = key or msg
+            limit = self.rate_limits.get(key)
+            if limit is None or now - limit[0] >= self.LOG_WINDOW:
+                self.rate_limits[key] = [now, 1, 0, level, msg, args]
+            elif limit[1] >= self.LOG_BURST:
+                if not limit[2]:
+                    self._schedule_flush(limit[0] + self.LOG_WINDOW)
+                limit[2:] = limit[2] + 1, level, msg, args
                 return
-            if self.throttled == 3:
-                msg += ' (throttling later logs)'
-        self.logger.info(self.log_prefix + msg)
+            else:
+                limit[1] += 1
+                if limit[1] == self.LOG_BURST:
+                    msg += ' (throttling similar messages)'
+        logger.log(level, self.log_prefix + msg, *args)
+
+    def _schedule_flush(self, when):
+        if self.flush_at is not None and self.flush_at <= when:
+            return
+        self.flush_at = when
+        # Without a running event loop the next log call flushes
+        asyncio = sys.modules.get('asyncio')
+        if asyncio is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.call_later(when - time.monotonic(), self.flush_suppressed)
+
+    def flush_suppressed(self):
+        '''Log, for each key whose window has ended with suppressions, the
+        last message suppressed and how many were.'''
+        now = time.monotonic()
+        self.flush_at = None
+        pending = []
+        for key, limit in list(self.rate_limits.items()):
+            start, _, suppressed, level, msg, args = limit
+            if not suppressed:
+                continue
+            if now - start >= self.LOG_WINDOW:
+                del self.rate_limits[key]
+                msg += f' ({suppressed:,d} similar messages suppressed)'
+                self.logger.log(level, self.log_prefix + msg, *args)
+            else:
+                pending.append(start + self.LOG_WINDOW)
+        if pending:
+            self._schedule_flush(min(pending))
+
+    def log_debug(self, msg, *args, throttle=False, key=None):
+        self._log(logging.DEBUG, msg, args, throttle, key)
+
+    def log_info(self, msg, *args, throttle=False, key=None):
+        self._log(logging.INFO, msg, args, throttle, key)
+
+    def log_warning(self, msg, *args, throttle=False, key=None):
+        self._log(logging.WARNING, msg, args, throttle, key)
+
+    def log_error(self, msg, *args, throttle=False, key=None):
+        self._log(logging.ERROR, msg, args, throttle, key)
+
+    def progress(self, label, total=0, every=10000, interval=5.0):
+        '''Return a Progress reporting on this object's logger.'''
+        return Progress(self, label, total, every, interval)
+
+
+class Progress(object):
+    '''Reports progress through a long loop at INFO level every every
+    items or interval seconds, whichever comes first.  Call update()
+    with the number of items done since the last call, ideally per
+    batch, and done() at the end.  Loops too short to report progress
+    log their completion at DEBUG level only.
+
+    total may be increased as more work is queued.
+    '''
+
+    def __init__(self, owner, label, total=0, every=10000, interval=5.0):
+        self.owner = owner
+        self.label = label
+        self.total = total
+        self.every = every
+        self.interval = interval
+        self.count = 0
+        self.start = self.last_time = time.monotonic()
+        self.next_count = every
+        self.reported = False
+
+    def update(self, n=1):
+        self.count += n
+        if self.count >= self.next_count:
+            self._report(time.monotonic())
+        elif self.interval is not None:
+            now = time.monotonic()
+            if now - self.last_time >= self.interval:
+                self._report(now)
+
+    def _report(self, now):
+        self.last_time = now
+        self.next_count = self.count + self.every
+        self.reported = True
+        if self.total:
+            self.owner.log_info('%s: %s/%s (%d%%)', self.label,
+                                f'{self.count:,d}', f'{self.total:,d}',
+                                self.count * 100 // self.total)
+        else:
+            self.owner.log_info('%s: %s', self.label, f'{self.count:,d}')
+
+    def done(self):
+        elapsed = time.monotonic() - self.start
+        log = self.owner.log_info if self.reported else self.owner.log_debug
+        log('%s: done %s in %.2fs', self.label, f'{self.count:,d}', elapsed)
+
+
+class CacheRegistry(object):
+    '''Tracks the caches of the process so their statistics can be
+    reported in one place.  A cache is anything with a name attribute
+    and a stats() method returning a dict.'''
+
+    def __init__(self):
+        self.caches = []
+        self.lock = threading.Lock()
+
+    def register(self, cache):
+        with self.lock:
+            self.caches.append(cache)
+        return cache
+
+    def stats(self):
+        '''Return a dict mapping cache name to its statistics.'''
+        with self.lock:
+            caches = list(self.caches)
+        return {cache.name: cache.stats() for cache in caches}
+
+    def clear(self):
+        '''Empty every cache, keeping their statistics.'''
+        with self.lock:
+            caches = list(self.caches)
+        for cache in caches:
+            cache.clear()
+
+
+cache_registry = CacheRegistry()
+
+
+def default_sizeof(key, value):
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
 
-    def log_warning(self, msg):
-        self.logger.warning(self.log_prefix + msg)
+class LRUCache(object):
+    '''A thread-safe mapping bounded by entry count, by total size, or
+    both.  size is computed by sizeof(key, value).
 
-    def log_error(self, msg):
-        self.logger.error(self.log_prefix + msg)
+    policy 'lru' evicts the least recently used entry; 'fifo' evicts
+    the oldest, and a hit costs less as nothing is reordered.
+    '''
 
+    POLICIES = ('lru', 'fifo')
 
-# Method decorator.  To be used for calculations that will always
-# deliver the same result.  The method cannot take any arguments
-# and should be accessed as an attribute.
-class cachedproperty(object):
+    def __init__(self, name, maxsize=128, max_bytes=None, sizeof=None,
+                 policy='lru', register=True):
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown cache policy {policy!r}')
+        if maxsize is None and max_bytes is None:
+            raise ValueError('a cache needs maxsize or max_bytes')
+        self.name = name
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or default_sizeof
+        self.lru = policy == 'lru'
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.RLock()
+        if register:
+            cache_registry.register(self)
 
-    def __init__(self, f):
-        self.f = f
+    def __len__(self):
+        return len(self.entries)
 
-    def __get__(self, obj, type):
-        obj = obj or type
-        value = self.f(obj)
-        setattr(obj, self.f.__name__, value)
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.lru:
+                self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.sizes[key]
+                del self.entries[key]
+            size = self.sizeof(key, value)
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.nbytes += size
+            while self.entries and (
+                    (self.maxsize is not None
+                     and len(self.entries) > self.maxsize)
+                    or (self.max_bytes is not None
+                        and self.nbytes > self.max_bytes)):
+                old_key, _ = self.entries.popitem(last=False)
+                self.nbytes -= self.sizes.pop(old_key)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        '''Remove key and return its value, or default if not cached.'''
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.nbytes -= self.sizes.pop(key)
+            return self.entries.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+            }
+
+
+_MISSING = object()
+
+
+def memoize(maxsize=128, max_bytes=None, sizeof=None, policy='lru',
+            name=None):
+    '''Function decorator caching results by positional arguments, which
+    must be hashable, in an LRUCache available as the cache attribute
+    of the wrapper.'''
+    def decorator(func):
+        cache = LRUCache(name or f'{func.__module__}.{func.__qualname__}',
+                         maxsize, max_bytes, sizeof, policy)
+
+        @wraps(func)
+        def wrapper(*args):
+            try:
+                result = cache.get(args, _MISSING)
+            except TypeError:
+                # Unhashable arguments, e.g. a bytearray, are not cached
+                return func(*args)
+            if result is _MISSING:
+                result = func(*args)
+                cache.put(args, result)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+class lazyproperty(object):
+    '''Decorator for a method with no arguments computing a value that
+    never changes, accessed as an attribute.  The value is computed once
+    per instance.
+
+    It is stored in the instance's __dict__ if it has one, or else in a
+    slot named '_' plus the method name if the class has one.  Other
+    instances, such as namedtuples with empty __slots__, must be
+    hashable and immutable; their values are kept in an LRUCache of
+    maxsize entries keyed by instance.
+
+    Accessed on the class the descriptor itself is returned.
+
+    stats() counts the values computed.  Only for values kept in the
+    LRUCache does it report hits and sizes too: later lookups of a
+    value in an instance's __dict__ never reach the descriptor, and a
+    slot lookup is not worth slowing down to count.
+    '''
+
+    def __init__(self, func, maxsize=10000):
+        self.func = func
+        self.__doc__ = func.__doc__
+        self.attr = func.__name__
+        self.slot = '_' + func.__name__
+        self.maxsize = maxsize
+        self.name = None
+        self.computed = 0
+        self.cache = None
+        self.lock = threading.Lock()
+
+    def __set_name__(self, owner, name):
+        self.attr = name
+        self.slot = '_' + name
+        self.name = f'{owner.__module__}.{owner.__qualname__}.{name}'
+        cache_registry.register(self)
+
+    def _compute(self, obj):
+        value = self.func(obj)
+        self.computed += 1
+        return value
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        obj_dict = getattr(obj, '__dict__', None)
+        if obj_dict is not None:
+            # Later lookups find it in the instance dict, not here
+            value = obj_dict[self.attr] = self._compute(obj)
+            return value
+        value = getattr(obj, self.slot, _MISSING)
+        if value is not _MISSING:
+            return value
+        if any(self.slot in getattr(klass, '__slots__', ())
+               for klass in type(obj).__mro__):
+            value = self._compute(obj)
+            object.__setattr__(obj, self.slot, value)
+            return value
+        if self.cache is None:
+            with self.lock:
+                if self.cache is None:
+                    self.cache = LRUCache(self.name or self.attr,
+                                          self.maxsize, register=False)
+        value = self.cache.get(obj, _MISSING)
+        if value is _MISSING:
+            value = self._compute(obj)
+            self.cache.put(obj, value)
         return value
 
+    def clear(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def stats(self):
+        '''Return a dict of the number of values computed, and the LRUCache
+        statistics if one is in use.'''
+        result = {'computed': self.computed}
+        if self.cache is not None:
+            result.update(self.cache.stats())
+        return result
+
 
 def subclasses(base_class, strict=True):
     '''Return a list of subclasses of base_class in its module.'''
+    import inspect
+
     def select(obj):
         return (inspect.isclass(obj) and issubclass(obj, base_class) and
                 (not strict or obj != base_class))
@@ -88,6 +430,31 @@ def subclasses(base_class, strict=True):
     return [pair[1] for pair in pairs]
 
 
+def lazy_import(name):
+    '''Return the module name, importing it if necessary.  A module not
+    yet imported is only executed when an attribute is first accessed,
+    so dependencies slow to import, such as ecdsa, cost nothing until
+    used.'''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    import importlib.util
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'no module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    # As the import statement does, so "import a.b; a.b" works
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    loader.exec_module(module)
+    return module
+
+
 def chunks(items, size):
     '''Break up items, an iterable, into chunks of length size.'''
     for i in range(0, len(items), size):
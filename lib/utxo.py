@@ -0,0 +1,116 @@
+# Copyright (c) 2018, Neil Booth
+#
+# All rights reserved.
+#
+# See the file "LICENCE" for information about the copyright
+# and warranty status of this software.
+
+'''The set of unspent transaction outputs of an account.'''
+
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+
+class UTXO(namedtuple('UTXO', 'tx_hash tx_pos value height addr')):
+    '''An unspent output.  tx_hash is binary; height is 0 if unconfirmed.'''
+
+    @property
+    def outpoint(self):
+        return (self.tx_hash, self.tx_pos)
+
+
+class UTXOSet(object):
+    '''UTXOs indexed by outpoint and by value.
+
+    The value index is a list of (value, tx_hash, tx_pos) tuples kept
+    sorted, so coin selection can find candidates in a value range by
+    bisection rather than scanning the whole set.
+    '''
+
+    def __init__(self):
+        self.by_outpoint = {}
+        self.by_value = []
+
+    def __len__(self):
+        return len(self.by_outpoint)
+
+    def __iter__(self):
+        return iter(self.by_outpoint.values())
+
+    def __contains__(self, outpoint):
+        return outpoint in self.by_outpoint
+
+    def get(self, tx_hash, tx_pos):
+        return self.by_outpoint.get((tx_hash, tx_pos))
+
+    def total(self):
+        '''Return the sum of the values of all UTXOs.'''
+        return sum(utxo.value for utxo in self.by_outpoint.values())
+
+    def balance(self):
+        '''Return a (confirmed, unconfirmed) pair of value sums.'''
+        confirmed = unconfirmed = 0
+        for utxo in self.by_outpoint.values():
+            if utxo.height > 0:
+                confirmed += utxo.value
+            else:
+                unconfirmed += utxo.value
+        return confirmed, unconfirmed
+
+    def add(self, utxo):
+        '''Add a UTXO.  Adding one already present does nothing.'''
+        outpoint = utxo.outpoint
+        if outpoint not in self.by_outpoint:
+            self.by_outpoint[outpoint] = utxo
+            insort(self.by_value, (utxo.value, ) + outpoint)
+
+    def update(self, utxos):
+        '''Add many UTXOs, re-sorting the value index once.'''
+        by_outpoint, by_value = self.by_outpoint, self.by_value
+        for utxo in utxos:
+            outpoint = utxo.outpoint
+            if outpoint not in by_outpoint:
+                by_outpoint[outpoint] = utxo
+                by_value.append((utxo.value, ) + outpoint)
+        by_value.sort()
+
+    def spend(self, tx_hash, tx_pos):
+        '''Remove and return the UTXO at the outpoint, or None if it is
+        not in the set.'''
+        utxo = self.by_outpoint.pop((tx_hash, tx_pos), None)
+        if utxo is not None:
+            by_value = self.by_value
+            del by_value[bisect_left(by_value, (utxo.value, tx_hash, tx_pos))]
+        return utxo
+
+    def rollback(self, height):
+        '''Remove UTXOs confirmed at or above height, after a reorg.  Their
+        addresses' UTXOs must be fetched again.  Return the set of
+        addresses affected.'''
+        addrs = set()
+        for utxo in [utxo for utxo in self if utxo.height >= height]:
+            self.spend(*utxo.outpoint)
+            addrs.add(utxo.addr)
+        return addrs
+
+    def remove_address(self, addr):
+        '''Remove all UTXOs paying to addr.'''
+        for utxo in [utxo for utxo in self if utxo.addr == addr]:
+            self.spend(*utxo.outpoint)
+
+    def value_range(self, lo, hi, limit=None):
+        '''Return the UTXOs with lo <= value <= hi in descending value order.
+        If limit is given return at most that many, the largest.'''
+        by_value, by_outpoint = self.by_value, self.by_outpoint
+        start = bisect_left(by_value, (lo, ))
+        end = bisect_left(by_value, (hi + 1, ))
+        if limit is not None:
+            start = max(start, end - limit)
+        return [by_outpoint[by_value[n][1:]]
+                for n in range(end - 1, start - 1, -1)]
+
+    def largest(self):
+        '''Yield UTXOs in descending value order.'''
+        by_outpoint = self.by_outpoint
+        for key in reversed(self.by_value):
+            yield by_outpoint[key[1:]]
@@ -0,0 +1,287 @@
+#
+# Tests of client/daemon.py
+#
+
+import asyncio
+import os
+
+import pytest
+
+from client.daemon import Daemon, derive_addresses, parse_server, worker_pool
+from lib.hash import sha256
+from lib.jsonrpc import (JSONRPCSession, RPCError, INVALID_PARAMS,
+                         METHOD_NOT_FOUND, connect)
+from lib.keys import AddressError, address_from_string, address_to_string
+
+
+MXPUB = 'xpub661MyMwAqRbcFARxxUUxAsjGGifn6Djc4YUsFbAisUU3GaEMn2BABYKVQTHrDtwvSfgY2bK8aFGyCNmB52SKjkFGP18sSRTNn1sCeez7Utd'
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class FakeServer(object):
+    '''Answers the Electrum protocol requests the daemon makes.'''
+
+    def __init__(self):
+        self.histories = {}
+        self.unspent = {}
+        self.subscribed = set()
+
+    def status(self, scripthash_hex):
+        hist = self.histories.get(scripthash_hex)
+        return sha256(repr(hist).encode()).hex() if hist else None
+
+    async def send_request(self, method, args=()):
+        return await self.handle(method, args)
+
+    async def handle(self, method, args):
+        if method == 'server.version':
+            return ['fake', '1.4']
+        if method == 'blockchain.headers.subscribe':
+            return {'height': 1000, 'hex': ''}
+        scripthash_hex, = args
+        if method == 'blockchain.scripthash.subscribe':
+            self.subscribed.add(scripthash_hex)
+            return self.status(scripthash_hex)
+        if method == 'blockchain.scripthash.unsubscribe':
+            self.subscribed.discard(scripthash_hex)
+            return True
+        if method == 'blockchain.scripthash.get_history':
+            return self.histories.get(scripthash_hex, [])
+        if method == 'blockchain.scripthash.listunspent':
+            return self.unspent.get(scripthash_hex, [])
+        raise RPCError(METHOD_NOT_FOUND, method)
+
+    def pay(self, address, tx_hash, value, height):
+        sh_hex = address_from_string(address).to_scripthash_hex()
+        self.histories.setdefault(sh_hex, []).append(
+            {'tx_hash': tx_hash, 'height': height})
+        self.unspent.setdefault(sh_hex, []).append(
+            {'tx_hash': tx_hash, 'tx_pos': 0, 'value': value,
+             'height': height})
+        return sh_hex
+
+
+def test_addresses():
+    addresses = derive_addresses(MXPUB, 0, 0, 5)
+    assert len(set(addresses)) == 5
+    assert derive_addresses(MXPUB, 0, 3, 2) == addresses[3:]
+    assert derive_addresses(MXPUB, 1, 0, 5) != addresses
+    for address in addresses:
+        addr = address_from_string(address)
+        assert address_to_string(addr) == address
+        assert address_from_string('bitcoincash:' + address) == addr
+    testnet = address_to_string(addr, 'bchtest')
+    with pytest.raises(AddressError):
+        address_from_string('bchtest:' + testnet)
+    with pytest.raises(ValueError):
+        address_from_string('bitcoincash:' + testnet)
+
+
+def test_parse_server():
+    assert parse_server('example.com:50002') == ('example.com', 50002, True)
+    assert parse_server('example.com:50001:t') == ('example.com', 50001,
+                                                   False)
+    for bad in ('example.com', 'example.com:1:x', 'a:b:c:d'):
+        with pytest.raises(ValueError):
+            parse_server(bad)
+
+
+def test_requests():
+    async def test():
+        server = FakeServer()
+        daemon = Daemon(server)
+        await daemon.start()
+        request = daemon.handle_request
+
+        account_id = await request('add_account', [MXPUB, 3, 2])
+        await daemon.engine.wait_idle()
+        info = await request('getinfo', [])
+        assert info == {'height': 1000, 'accounts': 1, 'subscriptions': 5,
+                        'pending': 0}
+        receiving = await request('get_addresses', [account_id])
+        assert receiving == derive_addresses(MXPUB, 0, 0, 3)
+        change = await request('get_addresses', {'account_id': account_id,
+                                                 'chain': 1})
+        assert change == derive_addresses(MXPUB, 1, 0, 2)
+
+        # Payments to receiving address 1, one confirmed
+        server.pay(receiving[1], '11' * 32, 5000, 900)
+        sh_hex = server.pay(receiving[1], '22' * 32, 700, 0)
+        await daemon.on_notification('blockchain.scripthash.subscribe',
+                                     [sh_hex, server.status(sh_hex)])
+        await daemon.engine.wait_idle()
+        # The gap was extended
+        assert len(await request('get_addresses', [account_id])) == 5
+        assert await request('get_balance', [account_id]) == {
+            'confirmed': 5000, 'unconfirmed': 700}
+        unspent = await request('list_unspent', [account_id])
+        assert [utxo['value'] for utxo in unspent] == [5000, 700]
+        assert all(utxo['address'] == receiving[1] for utxo in unspent)
+        history = await request('get_history', [account_id])
+        assert [(entry['tx_hash'], entry['height']) for entry in history] \
+            == [('11' * 32, 900), ('22' * 32, 0)]
+        assert len(await request('get_address_history', [receiving[1]])) == 2
+        assert await request('get_address_history', [receiving[0]]) == []
+
+        await daemon.on_notification('blockchain.headers.subscribe',
+                                     [{'height': 1001, 'hex': ''}])
+        assert (await request('getinfo', []))['height'] == 1001
+
+        assert await request('remove_account', [account_id]) is True
+        assert not server.subscribed
+
+        for method, params in (('add_account', ['xpubnonsense']),
+                               ('add_account', [1234]),
+                               ('add_account', [MXPUB, 0]),
+                               ('get_balance', [account_id]),
+                               ('get_addresses', [99, 0]),
+                               ('get_balance', []),
+                               ('get_balance', [0, 1, 2]),
+                               ('derive_addresses', [MXPUB, 0, 0]),
+                               ('get_address_history', ['nonsense'])):
+            with pytest.raises(RPCError) as e:
+                await request(method, params)
+            assert e.value.code == INVALID_PARAMS
+        with pytest.raises(RPCError) as e:
+            await request('close', [])
+        assert e.value.code == METHOD_NOT_FOUND
+        await daemon.close()
+
+    run(test())
+
+
+def test_reorg():
+    async def test():
+        server = FakeServer()
+        daemon = Daemon(server)
+        await daemon.start()
+        request = daemon.handle_request
+        account_id = await request('add_account', [MXPUB, 3, 2])
+        await daemon.engine.wait_idle()
+        receiving = await request('get_addresses', [account_id])
+
+        # A payment at height 990 is spent in block 1000
+        sh_hex = server.pay(receiving[0], '11' * 32, 5000, 990)
+        server.histories[sh_hex].append({'tx_hash': '22' * 32,
+                                         'height': 1000})
+        server.unspent[sh_hex] = []
+        await daemon.on_notification('blockchain.scripthash.subscribe',
+                                     [sh_hex, server.status(sh_hex)])
+        await daemon.engine.wait_idle()
+        assert await request('get_balance', [account_id]) == {
+            'confirmed': 0, 'unconfirmed': 0}
+
+        # Block 1000 is replaced by one without the spend; only the new
+        # tip is notified, and the payment is unspent again
+        server.histories[sh_hex].pop()
+        server.unspent[sh_hex] = [{'tx_hash': '11' * 32, 'tx_pos': 0,
+                                   'value': 5000, 'height': 990}]
+        await daemon.on_notification('blockchain.headers.subscribe',
+                                     [{'height': 1000, 'hex': ''}])
+        await daemon.engine.wait_idle()
+        assert await request('get_balance', [account_id]) == {
+            'confirmed': 5000, 'unconfirmed': 0}
+        history = await request('get_history', [account_id])
+        assert [entry['height'] for entry in history] == [990]
+
+    run(test())
+
+
+def test_gap_in_worker():
+    '''The keys a gap needs are derived in a worker process while other
+    requests are served.'''
+    async def test():
+        server = FakeServer()
+        executor = worker_pool(1)
+        daemon = Daemon(server, executor)
+        await daemon.start()
+        request = daemon.handle_request
+        account_id = await request('add_account', [MXPUB, 400, 2])
+        await daemon.engine.wait_idle()
+        receiving = await request('get_addresses', [account_id])
+
+        # A payment to the last address needs 400 more keys
+        sh_hex = server.pay(receiving[-1], '11' * 32, 5000, 900)
+        gap_lock = daemon.engine.gap_lock
+        notification = asyncio.ensure_future(daemon.on_notification(
+            'blockchain.scripthash.subscribe',
+            [sh_hex, server.status(sh_hex)]))
+
+        async def gap_started():
+            while not gap_lock.locked():
+                await asyncio.sleep(0.001)
+
+        await asyncio.wait_for(gap_started(), 5)
+        assert (await request('getinfo', []))['accounts'] == 1
+        assert gap_lock.locked()
+
+        await notification
+        await daemon.engine.wait_idle()
+        receiving = await request('get_addresses', [account_id])
+        assert len(receiving) == 800
+        assert receiving[-2:] == derive_addresses(MXPUB, 0, 798, 2)
+
+        # A failed pool is an internal error, not a bad xpub
+        executor.shutdown()
+        with pytest.raises(RuntimeError):
+            await request('add_account', [MXPUB])
+        await daemon.close()
+
+    run(test())
+
+
+def test_served(tmpdir):
+    '''End to end over sockets; derivation in a worker process does not
+    hold up other clients.'''
+    path = str(tmpdir.join('rpc.sock'))
+
+    async def test():
+        server = FakeServer()
+
+        async def on_server_client(reader, writer):
+            await JSONRPCSession(reader, writer, server.handle).run()
+
+        fake = await asyncio.start_server(on_server_client, '127.0.0.1', 0)
+        port = fake.sockets[0].getsockname()[1]
+        session = await connect('127.0.0.1', port)
+        executor = worker_pool(1)
+        daemon = Daemon(session, executor)
+        await daemon.start()
+        await daemon.serve(path=path)
+        assert os.stat(path).st_mode & 0o077 == 0
+
+        reader, writer = await asyncio.open_unix_connection(path)
+        client = JSONRPCSession(reader, writer)
+        client_task = asyncio.ensure_future(client.run())
+        # Warm up the worker
+        assert len(await client.send_request('derive_addresses',
+                                             [MXPUB, 0, 1])) == 1
+
+        finished = []
+
+        async def request(method, params):
+            result = await client.send_request(method, params)
+            finished.append(method)
+            return result
+
+        derivation = asyncio.ensure_future(
+            request('derive_addresses', [MXPUB, 0, 400]))
+        await asyncio.sleep(0.01)
+        info, addresses = await asyncio.gather(request('getinfo', []),
+                                               derivation)
+        assert info['height'] == 1000
+        assert len(addresses) == 400
+        assert finished == ['getinfo', 'derive_addresses']
+
+        client.close()
+        await client_task
+        await daemon.close()
+        session.close()
+        fake.close()
+        await fake.wait_closed()
+        executor.shutdown()
+
+    run(test())
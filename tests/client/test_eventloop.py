@@ -0,0 +1,108 @@
+#
+# Tests of client/eventloop.py
+#
+
+import asyncio
+import time
+
+import pytest
+
+import lib.bip32 as bip32
+from client.eventloop import LoopStepper, STEP_INTERVAL_MS, worker_executor
+from lib.account import BIP32Account
+from lib.manager import AccountManager
+from tests.lib.test_manager import MXPUB, FakeSession, scripthash_hex
+
+
+# A 60Hz frame
+FRAME_BUDGET = 1 / 60
+
+
+@pytest.fixture
+def stepper():
+    previous = asyncio.get_event_loop()
+    stepper = LoopStepper()
+    yield stepper
+    stepper.close()
+    asyncio.set_event_loop(previous)
+
+
+def drive(stepper, future, timeout=30):
+    '''Step the loop every STEP_INTERVAL_MS, as the Qt timer does, until
+    future is done.  Return the longest step in seconds.'''
+    future = asyncio.ensure_future(future, loop=stepper.loop)
+    deadline = time.monotonic() + timeout
+    while not future.done():
+        assert time.monotonic() < deadline
+        time.sleep(STEP_INTERVAL_MS / 1000)
+        stepper.step()
+    future.result()
+    return stepper.max_step
+
+
+def test_step(stepper):
+    assert asyncio.get_event_loop() is stepper.loop
+    events = []
+
+    async def work():
+        events.append('start')
+        await asyncio.sleep(0.02)
+        events.append('slept')
+        return 5
+
+    task = stepper.loop.create_task(work())
+    stepper.step()
+    assert events == ['start']
+    # A step never blocks waiting for the timer
+    start = time.perf_counter()
+    stepper.step()
+    assert time.perf_counter() - start < 0.01
+    assert events == ['start']
+    drive(stepper, task)
+    assert events == ['start', 'slept']
+    assert task.result() == 5
+
+
+def measure_gap_derivation(stepper, executor, gap_limit=600):
+    '''Return the longest step while the manager derives gap_limit keys
+    after a payment.'''
+    mpubkey, _ = bip32.from_extended_key_string(MXPUB)
+    session = FakeSession()
+    changes = []
+    manager = AccountManager(session, executor=executor,
+                             on_change=lambda *args: changes.append(args))
+    account = BIP32Account(mpubkey, 5, 2)
+
+    async def setup():
+        manager.add_account(account)
+        await manager.wait_idle()
+
+    async def pay():
+        sh_hex = scripthash_hex(account, 0, 4)
+        session.histories[sh_hex] = [{'tx_hash': '11' * 32, 'height': 10}]
+        await manager.synchronizer.on_notification(sh_hex,
+                                                   session.status(sh_hex))
+        await manager.wait_idle()
+
+    drive(stepper, setup())
+    # A payment to the last key extends the gap by gap_limit
+    account.rec_keys.gap_limit = gap_limit
+    stepper.max_step = 0
+    max_step = drive(stepper, pay())
+    assert len(account.rec_keys.pubkeys) == 5 + gap_limit
+    assert changes == [(0, 0, 4)]
+    return max_step
+
+
+def test_gap_derivation_off_gui_thread(stepper):
+    executor = worker_executor()
+    try:
+        max_step = measure_gap_derivation(stepper, executor)
+    finally:
+        executor.shutdown()
+    assert max_step < FRAME_BUDGET
+
+
+def test_gap_derivation_on_gui_thread_stalls(stepper):
+    # Without the worker, the derivation freezes a step for many frames
+    assert measure_gap_derivation(stepper, None) > 10 * FRAME_BUDGET
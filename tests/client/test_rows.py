@@ -0,0 +1,247 @@
+#
+# Tests of client/rows.py
+#
+
+import time
+
+from client.rows import (AddressRows, HistoryRows, PagedRows, RowUpdates,
+                         format_amount)
+from lib.account import Account, PubKeyList
+from lib.hash import hash_to_hex_str
+from lib.keys import HDPublicKey, address_to_string
+from lib.utxo import UTXO
+
+
+def make_account(count):
+    keys = PubKeyList()
+    keys.pubkeys = [HDPublicKey(bytes([2]) + n.to_bytes(32, 'big'), n)
+                    for n in range(count)]
+    return Account(keys, PubKeyList())
+
+
+def tx_hash(n):
+    return n.to_bytes(32, 'little')
+
+
+def test_format_amount():
+    assert format_amount(0) == '0'
+    assert format_amount(5000) == '0.00005'
+    assert format_amount(123456789012) == '1,234.56789012'
+    assert format_amount(-150000000) == '-1.5'
+    assert format_amount(250, decimal_point=2) == '2.5'
+
+
+def test_address_rows():
+    account = make_account(10)
+    addr = account.pubkey(0, 3).address
+    account.set_address_history(addr, [(tx_hash(1), 100, 0),
+                                       (tx_hash(2), 0, 0)])
+    account.utxos.update([UTXO(tx_hash(1), 0, 150000, 100, addr),
+                          UTXO(tx_hash(2), 1, 50000, 0, addr)])
+    rows = PagedRows(AddressRows(account, 0), page_size=4)
+    assert rows.source.ROLES[0] == 'address'
+
+    assert rows.loaded == 0
+    pages = []
+    while rows.can_fetch_more():
+        pages.append(rows.next_page())
+        rows.fetch_more()
+    assert pages == [(0, 3), (4, 7), (8, 9)]
+    assert rows.next_page() == (10, 9)
+
+    assert rows.row(3) == {'address': address_to_string(addr), 'index': 3,
+                           'balance': '0.002', 'txCount': 2}
+    assert rows.data(4, 'balance') == '0'
+    assert rows.data(4, 'txCount') == 0
+    assert rows.data(4, 'nonexistent') is None
+
+    # Rendered rows are cached until a refresh
+    account.utxos.spend(tx_hash(2), 1)
+    assert rows.data(3, 'balance') == '0.002'
+    rows.refresh()
+    assert rows.data(3, 'balance') == '0.0015'
+    assert rows.loaded == 10
+
+
+def test_history_rows():
+    account = make_account(5)
+    addrs = [account.pubkey(0, n).address for n in range(5)]
+    account.set_address_history(addrs[0], [(tx_hash(1), 10, 0),
+                                           (tx_hash(4), 40, 0)])
+    account.set_address_history(addrs[2], [(tx_hash(2), 20, 500),
+                                           (tx_hash(5), 0, 300)])
+    account.set_address_history(addrs[4], [(tx_hash(3), 30, 0),
+                                           (tx_hash(6), -1, 0)])
+    rows = PagedRows(HistoryRows(account))
+    assert len(rows.source) == 6
+    rows.fetch_more()
+    assert rows.loaded == 6
+    # Unconfirmed first, then newest
+    assert [rows.data(n, 'height') for n in range(6)] == [-1, 0, 40, 30,
+                                                           20, 10]
+    assert rows.row(1) == {'txHash': hash_to_hex_str(tx_hash(5)),
+                           'height': 0,
+                           'address': address_to_string(addrs[2]),
+                           'fee': '0.000003'}
+
+    account.set_address_history(addrs[1], [(tx_hash(7), 50, 0)])
+    rows.refresh()
+    assert len(rows.source) == 7
+    assert rows.loaded == 6 and rows.can_fetch_more()
+    assert rows.data(2, 'height') == 50
+
+
+def test_huge_wallet():
+    '''Opening a large account and showing its first page is quick
+    however many keys and transactions it has.'''
+    count = 100000
+    account = make_account(count)
+    history = account.history
+    for n, pubkey in enumerate(account.rec_keys.pubkeys[:20000]):
+        history.set_history(pubkey.address, [(tx_hash(n), n + 1, 0)])
+
+    start = time.monotonic()
+    addresses = PagedRows(AddressRows(account, 0))
+    txs = PagedRows(HistoryRows(account))
+    for rows in (addresses, txs):
+        rows.fetch_more()
+        for n in range(rows.loaded):
+            rows.row(n)
+    elapsed = time.monotonic() - start
+    assert txs.data(0, 'height') == 20000
+    assert addresses.loaded == txs.loaded == PagedRows.PAGE_SIZE
+    # Only the rows shown were computed
+    assert len(txs.source.entries) == PagedRows.PAGE_SIZE
+    assert elapsed < 1.0
+
+
+def test_row_updates_coalesce():
+    account = make_account(50)
+    rows = PagedRows(AddressRows(account, 0), page_size=20)
+    rows.fetch_more()
+    updates = RowUpdates(rows)
+    assert not updates.pending
+    for n in range(rows.loaded):
+        rows.row(n)
+
+    for n in (5, 3, 4, 4, 9, 30, 12, 11):
+        updates.changed(n)
+    assert updates.pending
+    changes = updates.flush()
+    assert not changes.reset
+    # Loaded rows in ranges; row 30 is not loaded
+    assert changes.changed == [(3, 5), (9, 9), (11, 12)]
+    assert changes.inserted is None
+    assert not updates.pending
+    # Changed rows are rendered afresh
+    assert 4 not in rows.cache and 6 in rows.cache
+
+    # Only rows on screen are repainted, but off-screen rows are not
+    # left stale in the cache
+    updates.set_visible(10, 15)
+    for n in (2, 10, 11, 15, 16):
+        updates.changed(n)
+    changes = updates.flush()
+    assert changes.changed == [(10, 11), (15, 15)]
+    assert 2 not in rows.cache and 16 not in rows.cache
+
+    updates.reset()
+    updates.changed(10)
+    changes = updates.flush()
+    assert changes == (True, [], None)
+    assert not updates.pending
+
+
+def test_row_updates_appended():
+    account = make_account(10)
+    rows = PagedRows(AddressRows(account, 0), page_size=4)
+    updates = RowUpdates(rows)
+    rows.fetch_more()
+
+    # Rows appended to a partly loaded list wait to be fetched
+    account.rec_keys.pubkeys.append(
+        HDPublicKey(bytes([2]) + (10).to_bytes(32, 'big'), 10))
+    assert updates.pending
+    assert updates.flush().inserted is None
+    while rows.can_fetch_more():
+        rows.fetch_more()
+
+    # Rows appended to a fully loaded list are inserted a page at most
+    # at a time
+    for n in range(11, 17):
+        account.rec_keys.pubkeys.append(
+            HDPublicKey(bytes([2]) + n.to_bytes(32, 'big'), n))
+        updates.changed(n)
+    changes = updates.flush()
+    assert changes.changed == []
+    assert changes.inserted == (11, 14)
+    rows.fetch_more()
+    assert not updates.pending
+
+
+def test_row_updates_history_reset():
+    account = make_account(5)
+    addrs = [account.pubkey(0, n).address for n in range(5)]
+    account.set_address_history(addrs[0], [(tx_hash(1), 10, 0)])
+    rows = PagedRows(HistoryRows(account))
+    rows.fetch_more()
+    updates = RowUpdates(rows)
+    assert rows.data(0, 'height') == 10
+
+    account.set_address_history(addrs[1], [(tx_hash(2), 20, 0)])
+    updates.reset()
+    assert updates.flush().reset
+    assert len(rows.source) == 2 and rows.loaded == 1
+    assert rows.data(0, 'height') == 20
+    assert not updates.pending
+
+
+def test_history_rows_stale():
+    account = make_account(3)
+    addrs = [account.pubkey(0, n).address for n in range(3)]
+    account.set_address_history(addrs[0], [(tx_hash(1), 10, 0)])
+    source = HistoryRows(account)
+    assert not any(source.is_stale(addr) for addr in addrs)
+    # An address still without history changes nothing
+    account.set_address_history(addrs[1], [])
+    assert not source.is_stale(addrs[1])
+    account.set_address_history(addrs[2], [(tx_hash(2), 0, 0)])
+    assert source.is_stale(addrs[2])
+    account.history.merge(addrs[0], [(tx_hash(3), 20, 0)])
+    assert source.is_stale(addrs[0])
+    source.refresh()
+    assert not any(source.is_stale(addr) for addr in addrs)
+    # A confirmation replaces the history
+    account.set_address_history(addrs[2], [(tx_hash(2), 30, 0)])
+    assert source.is_stale(addrs[2])
+
+
+def test_row_updates_sync_burst():
+    '''A sync touching thousands of rows costs a view a few repaints.'''
+    count = 100000
+    account = make_account(count)
+    rows = PagedRows(AddressRows(account, 0))
+    updates = RowUpdates(rows)
+    while rows.loaded < 2000:
+        rows.fetch_more()
+    updates.set_visible(1000, 1029)
+    for n in range(1000, 1030):
+        rows.row(n)
+
+    start = time.monotonic()
+    history = account.history
+    for n in range(0, count, 20):
+        history.set_history(account.pubkey(0, n).address,
+                            [(tx_hash(n), n + 1, 0)])
+        updates.changed(n)
+    changes = updates.flush()
+    # Rows re-rendered: only the changed ones on screen
+    rendered = 0
+    for first, last in changes.changed:
+        for n in range(first, last + 1):
+            rows.row(n)
+            rendered += 1
+    elapsed = time.monotonic() - start
+    assert changes.changed == [(n, n) for n in range(1000, 1030, 20)]
+    assert rendered == 2
+    assert elapsed < 1.0
@@ -0,0 +1,131 @@
+#
+# Tests of client/startup.py
+#
+
+import asyncio
+import time
+from functools import partial
+
+import pytest
+
+import lib.instrument as instrument
+from client.daemon import derive_addresses, open_session
+from client.startup import (BalanceCache, Startup, StartupMetrics,
+                            XpubError, FIRST_FRAME, FRESH_BALANCE,
+                            total_balance)
+from lib.jsonrpc import JSONRPCSession
+
+from tests.client.test_daemon import FakeServer, MXPUB
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_metrics(monkeypatch):
+    monkeypatch.setattr(instrument, 'enabled', True)
+    instrument.reset()
+    metrics = StartupMetrics(time.perf_counter() - 1.0)
+    metrics.mark(FIRST_FRAME)
+    first = metrics.marks[FIRST_FRAME]
+    assert 1.0 <= first < 2.0
+    # Only the first mark counts
+    metrics.mark(FIRST_FRAME)
+    assert metrics.marks[FIRST_FRAME] == first
+    assert instrument.timers['startup.first_frame'][0] == 1
+    instrument.reset()
+
+
+def test_balance_cache(tmpdir):
+    path = str(tmpdir.join('balances.json'))
+    cache = BalanceCache(path)
+    assert cache.load() == {}
+    cache.save({'xpub1': (100, 5), 'xpub2': (7, 0)})
+    balances = cache.load()
+    assert balances == {'xpub1': (100, 5), 'xpub2': (7, 0)}
+    assert total_balance(balances, ['xpub1', 'xpub2']) == (107, 5)
+    assert total_balance(balances, ['xpub1', 'xpub3']) is None
+    assert total_balance(balances, []) == (0, 0)
+
+    for junk in ('{', '[1, 2]', '{"xpub1": 5}'):
+        with open(path, 'w') as f:
+            f.write(junk)
+        assert cache.load() == {}
+
+
+def test_staged_load(tmpdir):
+    '''The last session's balance is available at once; the fresh one
+    after the wallet loads.'''
+    cache = BalanceCache(str(tmpdir.join('balances.json')))
+    cache.save({MXPUB: (1000, 0)})
+    receiving = derive_addresses(MXPUB, 0, 0, 20)
+
+    async def test():
+        server = FakeServer()
+        server.pay(receiving[0], '11' * 32, 5000, 900)
+        server.pay(receiving[4], '22' * 32, 700, 0)
+
+        async def on_server_client(reader, writer):
+            await JSONRPCSession(reader, writer, server.handle).run()
+
+        fake = await asyncio.start_server(on_server_client, '127.0.0.1', 0)
+        port = fake.sockets[0].getsockname()[1]
+
+        progress = []
+        shown = []
+        metrics = StartupMetrics()
+        startup = Startup([MXPUB], partial(open_session,
+                                           f'127.0.0.1:{port:d}:t'),
+                          cache, metrics,
+                          on_progress=lambda *args: progress.append(args),
+                          on_account=lambda *args: shown.append(args))
+        assert startup.balance == (1000, 0) and not startup.fresh
+
+        await startup.run()
+        assert startup.fresh
+        assert startup.balance == (5000, 700)
+        assert cache.load() == {MXPUB: (5000, 700)}
+        assert FRESH_BALANCE in metrics.marks
+        assert [account_id for _, account_id in shown] == [0]
+        # The gap was extended past the payment to key 4
+        assert len(shown[0][0].rec_keys.pubkeys) == 25
+
+        stages = [stage for stage, _ in progress]
+        assert stages[0] == 'keys' and stages[-1] == 'ready'
+        assert [stage for stage in Startup.STAGES if stage in stages] \
+            == list(Startup.STAGES)
+        fractions = [fraction for _, fraction in progress]
+        assert fractions == sorted(fractions)
+        assert fractions[-1] == 1.0
+
+        startup.close()
+        fake.close()
+        await fake.wait_closed()
+
+    run(test())
+
+
+def test_connect_failure(tmpdir):
+    cache = BalanceCache(str(tmpdir.join('balances.json')))
+
+    async def refuse(handler):
+        raise ConnectionRefusedError
+
+    startup = Startup([MXPUB], refuse, cache, StartupMetrics())
+    assert startup.balance is None
+    with pytest.raises(OSError):
+        run(startup.run())
+    assert not startup.fresh
+    startup.close()
+
+
+def test_bad_xpub(tmpdir):
+    cache = BalanceCache(str(tmpdir.join('balances.json')))
+
+    async def connect(handler):
+        raise AssertionError('connected with a bad xpub')
+
+    startup = Startup([MXPUB[:-1] + 'e'], connect, cache, StartupMetrics())
+    with pytest.raises(XpubError):
+        run(startup.run())
+    startup.close()
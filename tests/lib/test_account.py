@@ -0,0 +1,95 @@
+#
+# Tests of lib/account.py
+#
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from lib.account import (BIP32PubKeyList, HDPubKeyList, MultisigAccount,
+                         MultisigPubKeyList)
+from lib.keys import Address, HDPublicKey
+from lib.script import Script
+
+from tests.lib.test_bip32 import mpubkey, mprivkey
+
+
+COSIGNERS = [mpubkey, mprivkey.child(7).public_key,
+             mprivkey.child(8).public_key]
+
+
+def test_bip32_batch_matches_child():
+    master = mpubkey.child(0)
+    keys = BIP32PubKeyList(master, 5)
+    keys.generate_gap(10)
+    assert len(keys.pubkeys) == 16
+    assert keys.pubkeys[12] == keys.child(12)
+    keys.generate_gap(12)
+    assert [pubkey.n for pubkey in keys.pubkeys] == list(range(18))
+
+
+def test_multisig_key():
+    masters = [cosigner.child(0) for cosigner in COSIGNERS]
+    keys = MultisigPubKeyList(masters, 2, 20)
+    key = keys.child(4)
+    pubkeys = sorted(master.child_compressed_pubkey(4) for master in masters)
+    assert list(key.pubkeys) == pubkeys
+    script = Script.multisig_script(2, pubkeys)
+    assert key.script == script
+    assert key.address == Address.from_multisig_script(script)
+    assert key.address.kind == Address.ADDR_P2SH
+    assert key.n == 4
+
+
+@pytest.mark.parametrize('m, count', [(0, 3), (4, 3), (1, 17)])
+def test_multisig_bad(m, count):
+    with pytest.raises(ValueError):
+        MultisigPubKeyList([mpubkey] * count, m, 20)
+
+
+def test_multisig_bad_type():
+    with pytest.raises(TypeError):
+        MultisigPubKeyList([mpubkey, mpubkey.pubkey_bytes], 1, 20)
+
+
+def test_multisig_gap():
+    masters = [cosigner.child(1) for cosigner in COSIGNERS]
+    keys = MultisigPubKeyList(masters, 2, 6)
+    keys.generate_gap(-1)
+    assert len(keys.pubkeys) == 6
+    keys.generate_gap(3)
+    assert len(keys.pubkeys) == 10
+    assert all(keys.pubkeys[n] == keys.child(n) for n in (0, 5, 9))
+
+
+def test_multisig_account_parallel():
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        account = MultisigAccount(COSIGNERS, 2, 20, 6, executor)
+        account.rec_keys.generate_gap(300)
+        account.chg_keys.generate_gap(-1)
+    serial = MultisigAccount(COSIGNERS, 2, 20, 6)
+    serial.rec_keys.generate_gap(300)
+    assert account.rec_keys.pubkeys == serial.rec_keys.pubkeys
+    assert len(account.rec_keys.pubkeys) == 321
+    assert len(account.chg_keys.pubkeys) == 6
+    assert account.pubkey(0, 5).address != account.pubkey(1, 5).address
+
+
+class CountingKeyList(HDPubKeyList):
+
+    def child(self, n):
+        return HDPublicKey(bytes(33), n)
+
+
+def test_generate_gap_logging(caplog, capsys):
+    keys = CountingKeyList(20)
+    with caplog.at_level(logging.INFO):
+        keys.generate_gap(-1)
+        keys.generate_gap(5)
+        keys.generate_gap(30000)
+    assert len(keys.pubkeys) == 30021
+    assert capsys.readouterr().out == ''
+    # Only the long run reports progress
+    assert caplog.messages[0] == 'generating keys: 10,000/29,995 (33%)'
+    assert caplog.messages[-1].startswith('generating keys: done 29,995 in')
@@ -394,3 +394,45 @@ class TestVectors():
         xpub = m1.public_key.extended_key_string(mpubver)
         assert xprv == "xprv9uPDJpEQgRQfDcW7BkF7eTya6RPxXeJCqCJGHuCJ4GiRVLzkTXBAJMu2qaMWPrS7AANYqdq6vcBcBUdJCVVFceUvJFjaPdGZ2y9WACViL4L"
         assert xpub == "xpub68NZiKmJWnxxS6aaHmn81bvJeTESw724CRDs6HbuccFQN9Ku14VQrADWgqbhhTHBaohPX4CjNLf9fq9MYo6oDaPPLPxSb7gwQN3ih19Zm4Y"
+
+
+def test_child_pubkeys():
+    rec_master = mpubkey.child(0)
+    expected = [rec_master.child_compressed_pubkey(n) for n in range(5, 25)]
+    assert bip32.child_pubkeys(rec_master, 5, 25) == expected
+    assert bip32.child_pubkeys(rec_master, 5, 5) == []
+    with pytest.raises(ValueError):
+        bip32.child_pubkeys(rec_master, -1, 5)
+    with pytest.raises(ValueError):
+        bip32.child_pubkeys(rec_master, 0, (1 << 31) + 1)
+
+
+def test_derive_pubkeys_parallel():
+    from concurrent.futures import ProcessPoolExecutor
+
+    keys = [mpubkey.child(n) for n in range(3)]
+    serial = bip32.derive_pubkeys(keys, 10, 60)
+    assert [len(column) for column in serial] == [50, 50, 50]
+    assert serial[1][7] == keys[1].child_compressed_pubkey(17)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        assert bip32.derive_pubkeys(keys, 10, 60, executor,
+                                    chunk_size=7) == serial
+
+
+def test_parse_path():
+    H = bip32.MasterPrivKey.HARDENED
+    assert bip32.parse_path('m') == ()
+    assert bip32.parse_path("m/44'/145'/0'/0/7") == (44 + H, 145 + H, H, 0, 7)
+    assert bip32.parse_path('m/1h/2') == (1 + H, 2)
+    for bad in ('', '44/0', 'm/', 'm/x', "m/-1", f'm/{H:d}', "m/1''"):
+        with pytest.raises(ValueError):
+            bip32.parse_path(bad)
+
+
+def test_pubkey_from_seed():
+    seed = bytes(range(64))
+    master = bip32.MasterPrivKey.from_seed(seed)
+    for path in ('m', "m/44'/145'/0'/0/7", 'm/0/1', "m/3/4'"):
+        path = bip32.parse_path(path)
+        expected = bip32.derive_path(master, path).public_key.pubkey_bytes
+        assert bip32.pubkey_from_seed(seed, path) == expected
@@ -0,0 +1,93 @@
+#
+# Tests of lib/blockfilter.py
+#
+
+import random
+import time
+
+import pytest
+
+import lib.blockfilter as blockfilter
+from lib.hash import sha256
+from lib.keys import Address
+
+
+def random_scripts(count, seed):
+    rng = random.Random(seed)
+    return [Address.from_P2PKH_hash(rng.getrandbits(160).to_bytes(20, 'big'))
+            .to_script() for _ in range(count)]
+
+
+BLOCK_HASH = sha256(b'block')
+
+
+def test_siphash_vectors():
+    # From the SipHash paper's reference implementation
+    k0, k1 = blockfilter.filter_key(bytes(range(16)))
+    assert blockfilter.siphash24(k0, k1, b'') == 0x726fdb47dd0e0e31
+    assert blockfilter.siphash24(k0, k1, bytes(range(15))) \
+        == 0xa129ca6149be45e5
+    assert blockfilter.siphash24(k0, k1, bytes(range(8))) \
+        == 0x93f5f5799a932462
+
+
+@pytest.mark.parametrize('count', [0, 1, 2, 100, 1000])
+def test_round_trip(count):
+    scripts = random_scripts(count, count)
+    data = blockfilter.build_filter(BLOCK_HASH, scripts)
+    assert blockfilter.filter_count(data) == count
+    values = list(blockfilter.decode_filter(data))
+    assert values == sorted(blockfilter.hashed_values(
+        BLOCK_HASH, count, scripts))
+    # About P + 2 bits per item
+    assert len(data) < 2 + count * (blockfilter.P + 3) / 8
+
+
+def test_truncated():
+    data = blockfilter.build_filter(BLOCK_HASH, random_scripts(10, 0))
+    with pytest.raises(ValueError):
+        list(blockfilter.decode_filter(data[:-5]))
+
+
+def test_match():
+    block_scripts = random_scripts(500, 1)
+    wallet = random_scripts(300, 2) + block_scripts[100:103]
+    data = blockfilter.build_filter(BLOCK_HASH, block_scripts)
+    matcher = blockfilter.FilterMatcher(wallet)
+    assert matcher.match(BLOCK_HASH, data) == set(block_scripts[100:103])
+    assert matcher.match_any(BLOCK_HASH, data)
+    # The key depends on the block hash
+    other = sha256(b'other block')
+    assert not blockfilter.FilterMatcher(random_scripts(300, 2)).match_any(
+        other, blockfilter.build_filter(other, block_scripts))
+    empty = blockfilter.build_filter(BLOCK_HASH, [])
+    assert not matcher.match_any(BLOCK_HASH, empty)
+    assert not blockfilter.FilterMatcher().match_any(BLOCK_HASH, data)
+
+
+def test_false_positive_rate():
+    block_scripts = random_scripts(1000, 3)
+    wallet = random_scripts(10000, 4)
+    matcher = blockfilter.FilterMatcher(wallet)
+    matches = 0
+    for n in range(3):
+        block_hash = sha256(bytes([n]))
+        data = blockfilter.build_filter(block_hash, block_scripts)
+        matches += len(matcher.match(block_hash, data))
+    # Expect 30000 / M, about 0.04
+    assert matches <= 2
+
+
+def test_match_speed():
+    # A full block: about 5000 scripts and a 12KB filter, against a
+    # wallet of 2000 scripts
+    block_scripts = random_scripts(5000, 5)
+    data = blockfilter.build_filter(BLOCK_HASH, block_scripts)
+    assert 11000 < len(data) < 14000
+    wallet = random_scripts(1990, 6) + block_scripts[:10]
+    matcher = blockfilter.FilterMatcher(wallet)
+    start = time.perf_counter()
+    assert matcher.match(BLOCK_HASH, data) == set(block_scripts[:10])
+    elapsed = time.perf_counter() - start
+    # Generous bound
+    assert elapsed < 1.0
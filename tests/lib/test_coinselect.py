@@ -0,0 +1,74 @@
+#
+# Tests of lib/coinselect.py
+#
+
+import random
+import time
+
+import pytest
+
+from lib.coinselect import (branch_and_bound, select_coins, SelectionError)
+from lib.utxo import UTXO, UTXOSet
+
+
+def make_set(values):
+    utxos = UTXOSet()
+    utxos.update(UTXO(n.to_bytes(32, 'little'), 0, value, 1, None)
+                 for n, value in enumerate(values))
+    return utxos
+
+
+def test_branch_and_bound():
+    values = [9, 7, 5, 4, 3, 1]
+    indices = branch_and_bound(values, 12, 0, 1000)
+    assert sum(values[n] for n in indices) == 12
+    assert branch_and_bound(values, 30, 0, 1000) is None
+    assert branch_and_bound([10, 10], 5, 0, 1000) is None
+    # Within the cost of change
+    indices = branch_and_bound([10, 6], 5, 1, 1000)
+    assert indices == [1]
+    # Budget exhausted
+    assert branch_and_bound([3] * 30 + [2], 200, 0, 10) is None
+
+
+def test_select_changeless():
+    utxos = make_set([100000, 60000, 40000, 25000, 12000])
+    sel = select_coins(utxos, 63000, fee_per_input=1000, cost_of_change=500)
+    assert not sel.change
+    assert 63000 <= sel.value <= 63500
+    assert sel.value == sum(utxo.value - 1000 for utxo in sel.utxos)
+
+
+def test_select_fallback():
+    utxos = make_set([100000, 60000, 40000])
+    sel = select_coins(utxos, 150000, fee_per_input=1000, cost_of_change=500)
+    assert sel.change
+    assert [utxo.value for utxo in sel.utxos] == [100000, 60000]
+
+    # Enough for the target but not for change
+    sel = select_coins(utxos, 197000, fee_per_input=1000, cost_of_change=5000)
+    assert not sel.change and len(sel.utxos) == 3
+
+    with pytest.raises(SelectionError):
+        select_coins(utxos, 198000, fee_per_input=1000)
+    with pytest.raises(ValueError):
+        select_coins(utxos, 0)
+
+
+def test_dust_ignored():
+    utxos = make_set([500, 500, 20000])
+    with pytest.raises(SelectionError):
+        select_coins(utxos, 20000, fee_per_input=600)
+
+
+@pytest.mark.parametrize('count', [1000, 10000, 100000])
+def test_selection_latency(count):
+    rng = random.Random(count)
+    utxos = make_set(rng.randrange(1000, 10 ** 8) for _ in range(count))
+    start = time.perf_counter()
+    sel = select_coins(utxos, 3 * 10 ** 8 + 1234, fee_per_input=148,
+                       cost_of_change=2000, max_tries=20000)
+    elapsed = time.perf_counter() - start
+    assert sel.value >= 3 * 10 ** 8 + 1234
+    # A few milliseconds in practice; generous for slow CI machines
+    assert elapsed < 0.5
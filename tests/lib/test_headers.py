@@ -0,0 +1,236 @@
+#
+# Tests of lib/headers.py
+#
+
+import itertools
+import time
+
+import pytest
+
+import lib.headers as headers
+from lib.hash import double_sha256
+from lib.serialize import pack_header
+
+from tests.lib.test_tx import GENESIS_HEADER
+
+
+# An easy limit so headers can be mined in tests
+EASY_LIMIT = (1 << 255) - 1
+EASY_BITS = headers.target_to_bits(EASY_LIMIT)
+
+
+def params(**kwargs):
+    base = dict(pow_limit=EASY_LIMIT, retarget_interval=16,
+                target_spacing=600, eda_height=None, daa_height=None,
+                check_difficulty=True)
+    base.update(kwargs)
+    return headers.ChainParams(**base)
+
+
+def mine(prev_hash, timestamp, bits, merkle_root=bytes(32)):
+    target = headers.bits_to_target(bits)
+    nonce = 0
+    while True:
+        raw = pack_header(1, prev_hash, merkle_root, timestamp, bits, nonce)
+        if int.from_bytes(double_sha256(raw), 'little') <= target:
+            return raw
+        nonce += 1
+
+
+def extend(store, count, spacing=600, bits=None):
+    '''Mine count headers on the store's tip; return them concatenated.'''
+    prev_hash = store.header_hash(store.height)
+    timestamp = headers._header_struct.unpack(
+        store.raw_header(store.height))[3]
+    window = store._window(store.count)
+    result = bytearray()
+    for n in range(count):
+        height = store.count + n
+        required = headers.required_bits(store.params, height, window)
+        timestamp += spacing
+        raw = mine(prev_hash, timestamp, bits or required)
+        window.extend([headers._header_struct.unpack(raw)])
+        prev_hash = double_sha256(raw)
+        result += raw
+    return bytes(result)
+
+
+@pytest.fixture
+def store(tmpdir):
+    path = str(tmpdir.join('headers'))
+    store = headers.HeaderStore(path, params())
+    store.connect(0, mine(bytes(32), 1500000000, EASY_BITS))
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize('bits', [0x1d00ffff, 0x1b0404cb, 0x207fffff,
+                                  0x03123456, 0x05009234])
+def test_bits_round_trip(bits):
+    assert headers.target_to_bits(headers.bits_to_target(bits)) == bits
+
+
+def test_negative_bits():
+    with pytest.raises(headers.HeaderError):
+        headers.bits_to_target(0x04923456)
+
+
+def test_genesis(tmpdir):
+    store = headers.HeaderStore(str(tmpdir.join('headers')))
+    assert store.height == -1 and store.tip_hash() is None
+    assert store.connect(0, GENESIS_HEADER) == 0
+    assert store.tip_hash() == ('000000000019d6689c085ae165831e934ff763ae46a2'
+                                'a6c172b3f1b60a8ce26f')
+    bad = bytearray(GENESIS_HEADER)
+    bad[-1] ^= 1
+    store.truncate(0)
+    with pytest.raises(headers.HeaderError):
+        store.connect(0, bytes(bad))
+    assert len(store) == 0
+    store.close()
+
+
+def test_connect_and_reopen(store, tmpdir):
+    raw = extend(store, 40)
+    assert store.connect(1, raw) == 40
+    assert store.raw_header(17) == raw[16 * 80: 17 * 80]
+    assert store.raw_headers(1, 40) == raw
+    tip = store.tip_hash()
+    path = store.path
+    store.close()
+
+    # A partial trailing record is dropped on open
+    with open(path, 'ab') as f:
+        f.write(bytes(20))
+    store = headers.HeaderStore(path, params())
+    assert store.height == 40
+    assert store.tip_hash() == tip
+    store.close()
+
+
+def test_linkage_and_pow(store):
+    raw = bytearray(extend(store, 5))
+    # Break the link of the third header
+    bad = bytearray(raw)
+    bad[2 * 80 + 4] ^= 1
+    with pytest.raises(headers.HeaderError, match='does not connect'):
+        store.connect(1, bytes(bad))
+    # Insufficient work
+    hard_bits = headers.target_to_bits(EASY_LIMIT >> 40)
+    with pytest.raises(headers.HeaderError, match='proof of work'):
+        store.connect(1, pack_header(1, store.header_hash(0), bytes(32),
+                                     1500000600, hard_bits, 0))
+    # Above the proof of work limit
+    with pytest.raises(headers.HeaderError, match='limit'):
+        store.connect(1, mine(store.header_hash(0), 1500000600, 0x2100ffff))
+    with pytest.raises(headers.HeaderError):
+        store.connect(1, bytes(raw[:100]))
+    with pytest.raises(headers.HeaderError):
+        store.connect(3, bytes(raw))
+    assert store.height == 0
+
+
+def test_retarget(store):
+    # Fast blocks shrink the target at the boundary.  The timespan is
+    # measured over 15 intervals, not 16, as in Bitcoin.
+    store.connect(1, extend(store, 15, spacing=300))
+    bits = store.required_bits(16)
+    expected = headers.bits_to_target(EASY_BITS) * 15 * 300 // (16 * 600)
+    assert bits == headers.target_to_bits(expected)
+    store.connect(16, extend(store, 1))
+    # Bits must stay the same within a period
+    assert store.required_bits(17) == bits
+    with pytest.raises(headers.HeaderError, match='has bits'):
+        store.connect(17, extend(store, 1, bits=EASY_BITS))
+
+
+def test_eda(tmpdir):
+    store = headers.HeaderStore(str(tmpdir.join('headers')),
+                                params(eda_height=10, retarget_interval=1000))
+    first = headers.target_to_bits(EASY_LIMIT >> 4)
+    store.connect(0, mine(bytes(32), 1500000000, first))
+    store.connect(1, extend(store, 20))
+    assert store.required_bits(21) == first
+    # Six slow blocks by median time past trigger a 25% easier target
+    store.connect(21, extend(store, 12, spacing=3 * 3600))
+    target = headers.bits_to_target(store.required_bits(store.count))
+    assert target > headers.bits_to_target(first)
+    store.close()
+
+
+def test_daa(tmpdir):
+    store = headers.HeaderStore(str(tmpdir.join('headers')),
+                                params(daa_height=150, retarget_interval=2016))
+    start = headers.target_to_bits(EASY_LIMIT >> 8)
+    store.connect(0, mine(bytes(32), 1500000000, start))
+    store.connect(1, extend(store, 149))
+    # Steady blocks leave the target unchanged, up to compact rounding
+    bits = store.required_bits(150)
+    assert abs(headers.bits_to_target(bits) - headers.bits_to_target(start)) \
+        < headers.bits_to_target(start) >> 15
+    store.connect(150, extend(store, 50, spacing=1200))
+    # Slow blocks make it easier
+    assert headers.bits_to_target(store.required_bits(store.count)) > \
+        headers.bits_to_target(start)
+    with pytest.raises(headers.HeaderError, match='has bits'):
+        store.connect(store.count, extend(store, 1, bits=start))
+    store.close()
+
+
+def abc_suitable_block(times, height):
+    '''Bitcoin ABC's GetSuitableBlock(), step for step.'''
+    blocks = [height - 2, height - 1, height]
+    if times[blocks[0]] > times[blocks[2]]:
+        blocks[0], blocks[2] = blocks[2], blocks[0]
+    if times[blocks[0]] > times[blocks[1]]:
+        blocks[0], blocks[1] = blocks[1], blocks[0]
+    if times[blocks[1]] > times[blocks[2]]:
+        blocks[1], blocks[2] = blocks[2], blocks[1]
+    return blocks[1]
+
+
+def test_suitable_ties():
+    window = headers._Window(100, [(0, 0, 0, t, 0) for t in (5, 5, 3)])
+    assert window.suitable(102) == 101
+    # Every ordering of three timestamps, ties included
+    for t0, t1, t2 in itertools.product(range(3), repeat=3):
+        window = headers._Window(100, [(0, 0, 0, t, 0)
+                                       for t in (t0, t1, t2)])
+        times = {100: t0, 101: t1, 102: t2}
+        assert window.suitable(102) == abc_suitable_block(times, 102)
+
+
+def test_reorg(store):
+    store.connect(1, extend(store, 30))
+    old_tip = store.tip_hash()
+    store.truncate(21)
+    assert store.height == 20
+    with pytest.raises(IndexError):
+        store.raw_header(21)
+    store.connect(21, extend(store, 12, spacing=599))
+    assert store.height == 32 and store.tip_hash() != old_tip
+    # connect() replaces a suffix directly
+    store.connect(25, extend_from(store, 24, 3))
+    assert store.height == 27
+
+
+def extend_from(store, height, count):
+    store_copy = headers.HeaderStore(store.path + '.copy', store.params)
+    store_copy.connect(0, store.raw_headers(0, height + 1))
+    raw = extend(store_copy, count, spacing=601)
+    store_copy.close()
+    return raw
+
+
+def test_bulk_speed(tmpdir):
+    store = headers.HeaderStore(str(tmpdir.join('headers')),
+                                params(retarget_interval=2016))
+    store.connect(0, mine(bytes(32), 1500000000, EASY_BITS))
+    raw = extend(store, 2016)
+    start = time.perf_counter()
+    store.connect(1, raw)
+    elapsed = time.perf_counter() - start
+    assert store.height == 2016
+    # Generous bound; about 10ms here
+    assert elapsed < 1.0
+    store.close()
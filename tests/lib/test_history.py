@@ -0,0 +1,88 @@
+#
+# Tests of lib/history.py
+#
+
+import sys
+
+import pytest
+
+from lib.history import AddressHistory, HistoryStore, parse_history
+
+
+def tx_hash(n):
+    return n.to_bytes(32, 'little')
+
+
+def test_parse_history():
+    items = [{'tx_hash': '00' * 31 + '01', 'height': 5},
+             {'tx_hash': '00' * 31 + '02', 'height': 0, 'fee': 226}]
+    assert parse_history(items) == [(tx_hash(1), 5, 0), (tx_hash(2), 0, 226)]
+
+
+def test_merge_ordering():
+    hist = AddressHistory([(tx_hash(3), 0, 100), (tx_hash(1), 10, 0),
+                           (tx_hash(4), -1, 50), (tx_hash(2), 20, 0)])
+    assert [height for _, height, _ in hist] == [10, 20, 0, -1]
+    assert hist.tx_hash(0) == tx_hash(1)
+    assert hist.index(tx_hash(4)) == 3
+    assert hist.index(tx_hash(9)) == -1
+
+    # Mempool tx confirms; a new one arrives
+    hist.merge([(tx_hash(3), 21, 100), (tx_hash(5), 15, 0)])
+    assert list(hist) == [(tx_hash(1), 10, 0), (tx_hash(5), 15, 0),
+                          (tx_hash(2), 20, 0), (tx_hash(3), 21, 100),
+                          (tx_hash(4), -1, 50)]
+    # Merging nothing, or an existing entry, changes nothing
+    before = list(hist)
+    hist.merge([])
+    hist.merge([(tx_hash(2), 20, 0)])
+    assert list(hist) == before
+
+    with pytest.raises(ValueError):
+        hist.merge([(bytes(31), 1, 0)])
+
+
+def test_index_alignment():
+    # A hash that occurs unaligned across two entries must not match
+    a, b = bytes(16) + b'\1' * 16, b'\2' * 16 + bytes(16)
+    hist = AddressHistory([(a, 1, 0), (b, 2, 0)])
+    assert hist.index(b'\1' * 16 + b'\2' * 16) == -1
+    assert hist.index(b) == 1
+
+
+def test_truncate():
+    hist = AddressHistory([(tx_hash(n), n, 0) for n in range(1, 11)]
+                          + [(tx_hash(11), 0, 5)])
+    assert hist.truncate(8) == 3
+    assert [height for _, height, _ in hist] == list(range(1, 8)) + [0]
+    assert hist.truncate(100) == 0
+
+
+def test_store():
+    store = HistoryStore()
+    store.set_history('a', [(tx_hash(1), 1, 0)])
+    store.merge('b', [(tx_hash(2), 2, 0)])
+    store.merge('b', [(tx_hash(3), 3, 0)])
+    assert len(store) == 2 and 'a' in store
+    assert len(store['b']) == 2
+    assert store.truncate(2) == {'b'}
+    assert len(store['b']) == 0
+    store.remove('a')
+    assert store.get('a') is None
+
+
+def test_memory_versus_lists():
+    # 50 busy addresses with 2,000 transactions each
+    entries = [(tx_hash(n), 500000 + n, 0) for n in range(2000)]
+    store = HistoryStore()
+    naive = {}
+    for addr in range(50):
+        store.set_history(addr, entries)
+        naive[addr] = [(bytes(h), height, fee) for h, height, fee in entries]
+
+    naive_size = sys.getsizeof(naive) + sum(
+        sys.getsizeof(hist) + sum(sys.getsizeof(entry) + sys.getsizeof(entry[0])
+                                  + sys.getsizeof(entry[1]) for entry in hist)
+        for hist in naive.values())
+    # About 44 bytes per entry against roughly 170
+    assert store.nbytes() * 3 < naive_size
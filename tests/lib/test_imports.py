@@ -0,0 +1,81 @@
+#
+# Import-time budget, measured with python -X importtime
+#
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+# Milliseconds of import time of our own modules, excluding their
+# standard library and third-party dependencies.  Well under half of
+# this is used; it is generous as test machines are noisy.
+OWN_BUDGET_MS = 60
+# Total milliseconds to import what the CLI needs
+CLI_BUDGET_MS = 150
+
+# Modules that only need hashing, scripts and addresses
+LIGHT_MODULES = ('lib.hash', 'lib.cashaddr', 'lib.keys', 'lib.account',
+                 'lib.manager', 'lib.headers', 'lib.merkle', 'lib.txcache',
+                 'lib.blockfilter', 'lib.tx', 'lib.coinselect')
+
+
+def import_times(args):
+    '''Run python with -X importtime and args; return a dict mapping
+    module name to (self, cumulative) import times in microseconds.'''
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            cwd=ROOT, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[12:].split('|')
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def own_ms(times):
+    return sum(own for name, (own, _) in times.items()
+               if name.split('.')[0] in ('lib', 'client')) / 1000
+
+
+def test_light_modules():
+    code = '; '.join(f'import {name}' for name in LIGHT_MODULES)
+    times = import_times(['-c', code])
+    assert set(LIGHT_MODULES) <= set(times)
+    for heavy in ('ecdsa', 'PyQt5', 'json'):
+        assert heavy not in times
+    assert own_ms(times) < OWN_BUDGET_MS
+
+
+def test_ecdsa_loaded_on_use():
+    code = '''if 1:
+        import sys
+        import lib.account as account
+        assert 'ecdsa' not in sys.modules
+        account.bip32.MasterPubKey
+        assert 'ecdsa' in sys.modules
+    '''
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+
+
+def test_lazy_module_set_on_parent():
+    code = 'import lib.account; import lib.bip32; lib.bip32.MasterPubKey'
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='runs the script')
+def test_cli_without_qt():
+    times = import_times([os.path.join(ROOT, 'electron'), '--version'])
+    assert 'client.app' in times
+    for name in times:
+        assert name.split('.')[0] not in ('PyQt5', 'ecdsa', 'lib')
+        assert not name.startswith('client.qt')
+    assert times['client.app'][1] / 1000 < CLI_BUDGET_MS
@@ -0,0 +1,109 @@
+#
+# Tests of lib/instrument.py
+#
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import lib.instrument as instrument
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(instrument, 'enabled', True)
+    instrument.reset()
+    yield
+    instrument.reset()
+
+
+def square(x):
+    return x * x
+
+
+def test_disabled_is_free(monkeypatch):
+    monkeypatch.setattr(instrument, 'enabled', False)
+    assert instrument.timed('square')(square) is square
+    assert instrument.timer('t') is instrument.timer('u')
+    instrument.count('c')
+    assert 'c' not in instrument.counters
+    instrument.record('r', 1.0)
+    assert 'r' not in instrument.timers
+
+
+def test_timed(enabled):
+    timed_square = instrument.timed('square')(square)
+    assert timed_square is not square
+    assert timed_square.__name__ == 'square'
+    assert [timed_square(n) for n in range(5)] == [0, 1, 4, 9, 16]
+    with pytest.raises(TypeError):
+        timed_square('x')
+    stats = instrument.stats()['timers']['square']
+    assert stats['calls'] == 6
+    assert 0 <= stats['max'] <= stats['total']
+    assert stats['mean'] == stats['total'] / 6
+
+
+def test_timer_and_counter(enabled, tmpdir):
+    with instrument.timer('sleep'):
+        time.sleep(0.01)
+    instrument.count('things')
+    instrument.count('things', 4)
+    stats = instrument.stats()
+    assert stats['counters'] == {'things': 5}
+    assert stats['timers']['sleep']['total'] >= 0.01
+    instrument.record('sleep', 0.5)
+    assert instrument.stats()['timers']['sleep']['max'] == 0.5
+    stats = instrument.stats()
+    path = str(tmpdir.join('stats.json'))
+    instrument.dump_json(path)
+    with open(path) as f:
+        assert json.load(f) == stats
+
+
+def test_stack_sampler(tmpdir):
+    def spin():
+        end = time.monotonic() + 0.1
+        while time.monotonic() < end:
+            pass
+
+    sampler = instrument.StackSampler(interval=0.001)
+    sampler.start()
+    spin()
+    sampler.stop()
+    path = str(tmpdir.join('out.collapsed'))
+    sampler.write_collapsed(path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines
+    assert any('spin (test_instrument.py' in line for line in lines)
+    for line in lines:
+        stack, samples = line.rsplit(' ', 1)
+        assert int(samples) > 0
+
+
+def test_call_sites():
+    # Instrumentation must be enabled before the modules are imported
+    code = '''if 1:
+        import json
+        from lib.hash import Base58, double_sha256
+        from tests.lib.test_bip32 import mpubkey, mprivkey
+        import lib.instrument as instrument
+        double_sha256(b'x')
+        mpubkey.child(3)
+        mprivkey.child(3)
+        Base58.encode_check(b'payload')
+        print(json.dumps(instrument.stats()))
+    '''
+    env = dict(os.environ, ELECTRON_INSTRUMENT='1')
+    root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                     cwd=root)
+    timers = json.loads(output)['timers']
+    for name in ('hash.double_sha256', 'hash.hash160', 'base58.encode',
+                 'bip32.child_verkey_R', 'bip32.MasterPrivKey.child'):
+        assert timers[name]['calls'] >= 1
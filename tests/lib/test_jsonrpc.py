@@ -0,0 +1,157 @@
+#
+# Tests of lib/jsonrpc.py
+#
+
+import asyncio
+import json
+
+import pytest
+
+from lib.jsonrpc import (JSONRPCSession, RPCError, INTERNAL_ERROR,
+                         METHOD_NOT_FOUND, PARSE_ERROR, connect)
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+async def session_pair(server_handler, client_handler=None):
+    '''Return a (server session, client session, server) triple over a
+    loopback connection.'''
+    accepted = asyncio.get_event_loop().create_future()
+
+    async def on_client(reader, writer):
+        session = JSONRPCSession(reader, writer, server_handler)
+        accepted.set_result(session)
+        await session.run()
+
+    server = await asyncio.start_server(on_client, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    client = await connect('127.0.0.1', port, client_handler)
+    return await accepted, client, server
+
+
+async def close_all(server_session, client, server):
+    client.close()
+    server_session.close()
+    server.close()
+    await server.wait_closed()
+
+
+def test_requests_and_errors():
+    async def handler(method, params):
+        if method == 'add':
+            return sum(params)
+        if method == 'kwargs':
+            return params['x']
+        if method == 'fail':
+            raise RPCError(42, 'failed')
+        if method == 'crash':
+            raise ZeroDivisionError
+        raise RPCError(METHOD_NOT_FOUND, 'no such method')
+
+    async def test():
+        pair = await session_pair(handler)
+        client = pair[1]
+        assert await client.send_request('add', [1, 2, 3]) == 6
+        with pytest.raises(RPCError) as e:
+            await client.send_request('fail')
+        assert (e.value.code, e.value.message) == (42, 'failed')
+        with pytest.raises(RPCError) as e:
+            await client.send_request('crash')
+        assert e.value.code == INTERNAL_ERROR
+        with pytest.raises(RPCError) as e:
+            await client.send_request('nonexistent')
+        assert e.value.code == METHOD_NOT_FOUND
+        await close_all(*pair)
+
+    run(test())
+
+
+def test_concurrent_handling():
+    order = []
+
+    async def handler(method, params):
+        if method == 'slow':
+            await asyncio.sleep(0.2)
+        order.append(method)
+        return method
+
+    async def test():
+        pair = await session_pair(handler)
+        client = pair[1]
+        results = await asyncio.gather(client.send_request('slow'),
+                                       client.send_request('fast'))
+        assert results == ['slow', 'fast']
+        # The fast request did not wait for the slow one
+        assert order == ['fast', 'slow']
+        await close_all(*pair)
+
+    run(test())
+
+
+def test_notifications_both_ways():
+    received = []
+
+    async def client_handler(method, params):
+        received.append((method, params))
+
+    async def server_handler(method, params):
+        if method == 'subscribe':
+            await server_session_box[0].send_notification('event', ['x'])
+            return True
+        received.append((method, params))
+
+    server_session_box = []
+
+    async def test():
+        pair = await session_pair(server_handler, client_handler)
+        server_session_box.append(pair[0])
+        client = pair[1]
+        await client.send_notification('hello', [1])
+        assert await client.send_request('subscribe') is True
+        await asyncio.sleep(0.05)
+        assert ('hello', [1]) in received
+        assert ('event', ['x']) in received
+        await close_all(*pair)
+
+    run(test())
+
+
+def test_bad_messages():
+    async def test():
+        pair = await session_pair(None)
+        client = pair[1]
+        # Talk raw JSON to the server's session
+        reader, writer = client.reader, client.writer
+        client.run_task.cancel()
+        writer.write(b'not json\n[1, 2]\n{"id": 5, "method": "foo"}\n')
+        responses = [json.loads(await reader.readline()) for _ in range(3)]
+        assert responses[0]['error']['code'] == PARSE_ERROR
+        assert responses[1]['id'] is None
+        assert responses[2]['id'] == 5
+        assert responses[2]['error']['code'] == METHOD_NOT_FOUND
+        await close_all(*pair)
+
+    run(test())
+
+
+def test_connection_lost():
+    async def handler(method, params):
+        await asyncio.sleep(10)
+
+    async def test():
+        server_session, client, server = await session_pair(handler)
+        request = asyncio.ensure_future(client.send_request('hang'))
+        await asyncio.sleep(0.05)
+        server_session.close()
+        with pytest.raises(ConnectionError):
+            await request
+        await client.run_task
+        assert client.closed
+        with pytest.raises(ConnectionError):
+            await client.send_request('again')
+        server.close()
+        await server.wait_closed()
+
+    run(test())
@@ -0,0 +1,299 @@
+#
+# Tests of lib/manager.py
+#
+
+import asyncio
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+import lib.bip32 as bip32
+from lib.account import Account, BIP32Account, MultisigAccount, PubKeyList
+from lib.hash import double_sha256, hash_to_hex_str, sha256
+from lib.keys import HDPublicKey
+from lib.manager import AccountManager, RoutingTable
+from lib.synchronizer import (PRIORITY_ACTIVE, PRIORITY_CHANGE,
+                              PRIORITY_DORMANT, PRIORITY_RECEIVE)
+
+from tests.lib.test_account import COSIGNERS
+
+
+MXPUB = 'xpub661MyMwAqRbcFARxxUUxAsjGGifn6Djc4YUsFbAisUU3GaEMn2BABYKVQTHrDtwvSfgY2bK8aFGyCNmB52SKjkFGP18sSRTNn1sCeez7Utd'
+
+
+class FakeSession(object):
+    '''Stands in for a server session.'''
+
+    def __init__(self):
+        self.histories = {}
+        self.subscribed = set()
+        self.requests = []
+        self.height = 1000
+
+    def status(self, scripthash_hex):
+        hist = self.histories.get(scripthash_hex)
+        return sha256(repr(hist).encode()).hex() if hist else None
+
+    async def send_request(self, method, args):
+        self.requests.append(method)
+        if method == 'blockchain.headers.subscribe':
+            return {'height': self.height}
+        scripthash_hex, = args
+        if method == 'blockchain.scripthash.subscribe':
+            self.subscribed.add(scripthash_hex)
+            return self.status(scripthash_hex)
+        if method == 'blockchain.scripthash.unsubscribe':
+            self.subscribed.discard(scripthash_hex)
+            return True
+        return self.histories.get(scripthash_hex, [])
+
+
+def scripthash_hex(account, chain, n):
+    return hash_to_hex_str(account.pubkey(chain, n).address.to_scripthash())
+
+
+def test_routing_table():
+    table = RoutingTable()
+    table.add(b'a' * 32, 7, 1, 5)
+    assert table.lookup(b'a' * 32) == (7, 1, 5)
+    assert table.lookup(b'b' * 32) is None
+    table.remove(b'a' * 32)
+    assert len(table) == 0
+    with pytest.raises(ValueError):
+        table.add(b'a' * 32, 0, 2, 0)
+    with pytest.raises(ValueError):
+        table.add(b'a' * 32, 0, 0, 1 << 31)
+
+    compact = RoutingTable(prefix_len=8)
+    compact.add(b'a' * 32, 1, 0, (1 << 31) - 1)
+    assert list(compact.index) == [b'a' * 8]
+    assert compact.lookup(b'a' * 32) == (1, 0, (1 << 31) - 1)
+    with pytest.raises(ValueError):
+        RoutingTable(prefix_len=4)
+
+
+def test_manager():
+    mpubkey, _ = bip32.from_extended_key_string(MXPUB)
+
+    async def run():
+        session = FakeSession()
+        manager = AccountManager(session)
+        account1 = BIP32Account(mpubkey, 3, 2)
+        account2 = BIP32Account(mpubkey.child(5), 2, 2)
+        id1 = manager.add_account(account1)
+        id2 = manager.add_account(account2)
+        await manager.wait_idle()
+        assert len(session.subscribed) == len(manager.routes) == 9
+
+        # A payment to receiving address 2 extends the gap
+        sh_hex = scripthash_hex(account1, 0, 2)
+        session.histories[sh_hex] = [{'tx_hash': '11' * 32, 'height': 10}]
+        await manager.synchronizer.on_notification(sh_hex, session.status(sh_hex))
+        await manager.wait_idle()
+        assert len(account1.rec_keys.pubkeys) == 6
+        assert len(session.subscribed) == 12
+        hist = account1.history[account1.pubkey(0, 2).address]
+        assert [height for _, height, _ in hist] == [10]
+
+        # Removing an account leaves the others alone
+        session.requests.clear()
+        await manager.remove_account(id2)
+        assert session.requests == ['blockchain.scripthash.unsubscribe'] * 4
+        assert len(session.subscribed) == len(manager.routes) == 8
+        assert manager.routes.lookup(account1.pubkey(1, 1).address
+                                     .to_scripthash()) == (id1, 1, 1)
+
+        # Late notifications for it are ignored
+        sh_hex = scripthash_hex(account2, 0, 0)
+        await manager.synchronizer.on_notification(sh_hex, 'ab' * 32)
+        assert not account2.history.histories
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+@pytest.mark.parametrize('pool', [ThreadPoolExecutor, ProcessPoolExecutor])
+def test_gap_on_executor(pool):
+    # Workers derive values; the key lists are extended on the loop, so
+    # a process pool works as well as a thread pool
+    async def run():
+        session = FakeSession()
+        with pool(max_workers=1) as executor:
+            manager = AccountManager(session, executor=executor)
+            account = MultisigAccount(COSIGNERS, 2, 3, 2)
+            manager.add_account(account)
+            await manager.wait_idle()
+            sh_hex = scripthash_hex(account, 0, 2)
+            session.histories[sh_hex] = [{'tx_hash': '11' * 32,
+                                          'height': 10}]
+            await manager.synchronizer.on_notification(
+                sh_hex, session.status(sh_hex))
+            await manager.wait_idle()
+        keys = account.rec_keys
+        assert [key.n for key in keys.pubkeys] == list(range(6))
+        assert keys.pubkeys[5] == keys.child(5)
+        assert len(session.subscribed) == 8
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def test_priority():
+    keys = [PubKeyList(), PubKeyList()]
+    for chain, key_list in enumerate(keys):
+        key_list.pubkeys = [HDPublicKey.from_bytes(
+            bytes([2]) + (chain * 10000 + n).to_bytes(32, 'big'), n)
+                            for n in range(3)]
+    account = Account(*keys)
+    account.set_address_history(account.pubkey(0, 0).address,
+                                [(bytes(32), 1500, 0)])
+    account.set_address_history(account.pubkey(0, 1).address,
+                                [(bytes(32), 0, 0)])
+
+    async def run():
+        session = FakeSession()
+        session.height = 2000
+        manager = AccountManager(session)
+
+        def priorities():
+            return [manager.priority(account, chain, account.pubkey(chain, 0))
+                    for chain in (0, 1)] + [
+                        manager.priority(account, 0, account.pubkey(0, 1))]
+
+        # Without a tip all history counts as recent
+        assert priorities() == [PRIORITY_ACTIVE, PRIORITY_CHANGE,
+                                PRIORITY_ACTIVE]
+        await manager.subscribe_headers()
+        assert manager.height == 2000
+        assert priorities() == [PRIORITY_ACTIVE, PRIORITY_CHANGE,
+                                PRIORITY_ACTIVE]
+        # As the tip moves on, old history becomes dormant
+        await manager.on_notification('blockchain.headers.subscribe',
+                                      [{'height': 1500 + 1008}])
+        assert priorities() == [PRIORITY_DORMANT, PRIORITY_CHANGE,
+                                PRIORITY_ACTIVE]
+        account.set_address_history(account.pubkey(0, 0).address, [])
+        assert manager.priority(account, 0,
+                                account.pubkey(0, 0)) == PRIORITY_RECEIVE
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+class ChainServer(FakeSession):
+    '''A stand-in server with a chain that can reorganize.'''
+
+    def __init__(self, scripthashes, tip, rng):
+        super().__init__()
+        self.tip = tip
+        self.rng = rng
+        self.txs = {}   # tx_hash hex -> (scripthash hex, height)
+        for n in range(len(scripthashes) * 3):
+            self.add_tx(rng.choice(scripthashes), rng.randrange(1, tip + 1))
+        self.rebuild()
+        self.headers = []
+        self.make_headers(0)
+
+    def make_headers(self, start):
+        '''Make the headers from start to the tip, each a new block.'''
+        del self.headers[start:]
+        for height in range(start, self.tip + 1):
+            prev_hash = (double_sha256(bytes.fromhex(self.headers[-1]))
+                         if self.headers else bytes(32))
+            raw = bytes(4) + prev_hash + bytes(self.rng.getrandbits(8)
+                                                   for _ in range(44))
+            self.headers.append(raw.hex())
+
+    def tip_header(self):
+        return {'height': self.tip, 'hex': self.headers[self.tip]}
+
+    async def send_request(self, method, args):
+        if method == 'blockchain.headers.subscribe':
+            return self.tip_header()
+        if method == 'blockchain.block.header':
+            self.requests.append(method)
+            return self.headers[args[0]]
+        if method == 'blockchain.block.headers':
+            start, count = args
+            return {'hex': ''.join(self.headers[start:start + count]),
+                    'count': count, 'max': 2016}
+        return await super().send_request(method, args)
+
+    def add_tx(self, scripthash_hex, height):
+        tx_hash = sha256(len(self.txs).to_bytes(4, 'little')).hex()
+        self.txs[tx_hash] = (scripthash_hex, height)
+
+    def rebuild(self):
+        self.histories = {}
+        for tx_hash, (scripthash_hex, height) in self.txs.items():
+            self.histories.setdefault(scripthash_hex, []).append(
+                {'tx_hash': tx_hash, 'height': height})
+        for hist in self.histories.values():
+            # Unconfirmed transactions come last
+            hist.sort(key=lambda item: item['height'] or self.tip + 1)
+
+    def reorg(self, depth):
+        '''Replace the top depth blocks.  Transactions in them are
+        reconfirmed at new heights or return to the mempool.'''
+        fork = self.tip - depth + 1
+        affected = set()
+        for tx_hash, (scripthash_hex, height) in self.txs.items():
+            if height >= fork:
+                new_height = self.rng.choice([0, self.rng.randrange(fork, self.tip + 1)])
+                self.txs[tx_hash] = (scripthash_hex, new_height)
+                affected.add(scripthash_hex)
+        self.rebuild()
+        self.make_headers(fork)
+        return fork, affected
+
+
+@pytest.mark.parametrize('depth', [1, 3, 10])
+def test_reorg(depth):
+    # A large wallet with cheap fake keys
+    keys = [PubKeyList(), PubKeyList()]
+    for chain, key_list in enumerate(keys):
+        key_list.pubkeys = [HDPublicKey.from_bytes(
+            bytes([2]) + (chain * 10000 + n).to_bytes(32, 'big'), n)
+                            for n in range(1000)]
+    account = Account(*keys)
+    scripthashes = [hash_to_hex_str(pubkey.address.to_scripthash())
+                    for key_list in keys for pubkey in key_list.pubkeys]
+
+    async def run():
+        server = ChainServer(scripthashes, 1000, random.Random(depth))
+        manager = AccountManager(server)
+        await manager.subscribe_headers()
+        manager.add_account(account)
+        await manager.wait_idle()
+
+        def wallet_state():
+            return {hash_to_hex_str(addr.to_scripthash()):
+                    [(tx_hash, height) for tx_hash, height, _ in hist]
+                    for addr, hist in account.history.histories.items() if len(hist)}
+
+        def server_state():
+            return {scripthash_hex: [(bytes.fromhex(item['tx_hash'])[::-1],
+                                      item['height']) for item in hist]
+                    for scripthash_hex, hist in server.histories.items()}
+
+        assert wallet_state() == server_state()
+
+        # A new block on the tip rolls nothing back
+        server.tip += 1
+        server.make_headers(server.tip)
+        server.requests.clear()
+        await manager.on_notification('blockchain.headers.subscribe',
+                                      [server.tip_header()])
+        await manager.wait_idle()
+        assert manager.height == server.tip
+        assert not server.requests
+
+        fork, affected = server.reorg(depth)
+        await manager.on_notification('blockchain.headers.subscribe',
+                                      [server.tip_header()])
+        await manager.wait_idle()
+        # The fork was found from the headers below the tip, and only the
+        # affected scripthashes were queried
+        assert server.requests.count('blockchain.block.header') == depth - 1
+        assert len(server.requests) == depth - 1 + 2 * len(affected)
+        assert wallet_state() == server_state()
+
+    asyncio.get_event_loop().run_until_complete(run())
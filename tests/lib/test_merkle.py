@@ -0,0 +1,166 @@
+#
+# Tests of lib/merkle.py
+#
+
+import asyncio
+import os
+
+import pytest
+
+import lib.merkle as merkle
+from lib.hash import double_sha256, hash_to_hex_str
+from lib.headers import HeaderStore
+
+from tests.lib.test_headers import EASY_BITS, mine, params
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def tx_hashes(block, count):
+    return [double_sha256(bytes([block]) + n.to_bytes(4, 'little'))
+            for n in range(count)]
+
+
+# Transaction counts of the test blocks; odd counts exercise duplication
+BLOCK_SIZES = [1, 2, 7, 100, 333]
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = HeaderStore(str(tmpdir.join('headers')), params())
+    prev_hash = bytes(32)
+    for height, size in enumerate(BLOCK_SIZES):
+        root = merkle.merkle_root(tx_hashes(height, size))
+        raw = mine(prev_hash, 1500000000 + height * 600, EASY_BITS, root)
+        store.connect(height, raw)
+        prev_hash = double_sha256(raw)
+    yield store
+    store.close()
+
+
+def all_proofs():
+    proofs = []
+    for height, size in enumerate(BLOCK_SIZES):
+        hashes = tx_hashes(height, size)
+        for pos, tx_hash in enumerate(hashes):
+            proofs.append((tx_hash, height,
+                           merkle.merkle_branch(hashes, pos), pos))
+    return proofs
+
+
+def test_merkle_root():
+    hashes = tx_hashes(0, 3)
+    left = double_sha256(hashes[0] + hashes[1])
+    right = double_sha256(hashes[2] + hashes[2])
+    assert merkle.merkle_root(hashes) == double_sha256(left + right)
+    assert merkle.merkle_root(hashes[:1]) == hashes[0]
+
+
+def test_parse_response():
+    tx_hash = bytes(range(32))
+    result = {'block_height': 7, 'pos': 3,
+              'merkle': [hash_to_hex_str(bytes(32)), hash_to_hex_str(tx_hash)]}
+    assert merkle.parse_merkle_response(hash_to_hex_str(tx_hash), result) \
+        == (tx_hash, 7, [bytes(32), tx_hash], 3)
+
+
+def test_verify(store):
+    verifier = merkle.MerkleVerifier(store)
+    for proof in all_proofs():
+        assert verifier.verify(*proof)
+        assert verifier.is_verified(proof[0])
+
+
+def test_cache_hits(store):
+    hashes = tx_hashes(4, 333)
+    cache = {}
+    root = merkle.merkle_root(hashes)
+    assert merkle.verify_branch(root, hashes[0], merkle.merkle_branch(
+        hashes, 0), 0, cache)
+    # hashes[1] was proven as a sibling, so it verifies without hashing.
+    # The branch must still be the right length.
+    assert not merkle.verify_branch(root, hashes[1], [], 1, cache)
+    size = len(cache)
+    assert merkle.verify_branch(root, hashes[1], merkle.merkle_branch(
+        hashes, 1), 1, cache)
+    assert len(cache) == size
+    # A wrong hash at a cached position fails at once
+    assert not merkle.verify_branch(root, hashes[2], [hashes[0]] * 9, 1, cache)
+
+
+def test_depth():
+    hashes = tx_hashes(3, 100)
+    cache = {}
+    root = merkle.merkle_root(hashes)
+    assert merkle.verify_branch(root, hashes[0], merkle.merkle_branch(
+        hashes, 0), 0, cache)
+    assert cache['depth'] == 7
+    # Branches of the wrong depth fail before the cache is consulted
+    branch = merkle.merkle_branch(hashes, 1)
+    assert not merkle.verify_branch(root, hashes[1], branch[:-1], 1, cache)
+    assert not merkle.verify_branch(root, hashes[1], branch + [root], 1, cache)
+    assert merkle.verify_branch(root, hashes[1], branch, 1, cache)
+    assert merkle.verify_branch(root, hashes[99], merkle.merkle_branch(
+        hashes, 99), 99, cache)
+
+
+def test_rejects(store):
+    verifier = merkle.MerkleVerifier(store)
+    tx_hash, height, branch, pos = all_proofs()[-5]
+    assert not verifier.verify(tx_hash, height, branch, pos ^ 1)
+    assert not verifier.verify(bytes(32), height, branch, pos)
+    bad = list(branch)
+    bad[-1] = bytes(32)
+    assert not verifier.verify(tx_hash, height, bad, pos)
+    assert not verifier.verify(tx_hash, height, branch[:-1], pos)
+    assert not verifier.verify(tx_hash, height, branch, pos + 4096)
+    assert not verifier.verify(tx_hash, height - 1, branch, pos)
+    with pytest.raises(merkle.MerkleError):
+        verifier.verify(tx_hash, 99, branch, pos)
+    assert not verifier.verified
+    # Valid after failures, with a cache already populated
+    for proof in all_proofs():
+        assert verifier.verify(*proof)
+
+
+def test_persistence(store, tmpdir):
+    path = str(tmpdir.join('verified'))
+    verifier = merkle.MerkleVerifier(store, path)
+    proofs = all_proofs()
+    for proof in proofs[:200]:
+        assert verifier.verify(*proof)
+    verifier.close()
+    assert os.path.getsize(path) == 200 * 36
+
+    verifier = merkle.MerkleVerifier(store, path)
+    assert len(verifier.verified) == 200
+    # Recorded proofs are not re-checked, so a bogus branch passes
+    tx_hash, height, _, pos = proofs[10]
+    assert verifier.verify(tx_hash, height, [], pos)
+
+    removed = verifier.unverify(4)
+    assert removed == {proof[0] for proof in proofs[:200] if proof[1] >= 4}
+    verifier.close()
+    verifier = merkle.MerkleVerifier(store, path)
+    assert set(verifier.verified) == {proof[0] for proof in proofs[:200]
+                                      if proof[1] < 4}
+    verifier.close()
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_verify_many(store, pooled):
+    verifier = merkle.MerkleVerifier(store)
+    proofs = all_proofs()
+    tx_hash, height, branch, pos = proofs[50]
+    proofs[50] = (tx_hash, height, branch, pos + 1)
+    if pooled:
+        with merkle.verifier_pool(max_workers=2) as executor:
+            results = run(verifier.verify_many(proofs, executor))
+    else:
+        results = run(verifier.verify_many(proofs))
+    assert results == [n != 50 for n in range(len(proofs))]
+    assert len(verifier.verified) == len(proofs) - 1
+    # Already verified proofs are skipped
+    assert run(verifier.verify_many(proofs[:10])) == [True] * 10
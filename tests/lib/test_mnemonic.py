@@ -0,0 +1,71 @@
+#
+# Tests of lib/mnemonic.py
+#
+
+import pytest
+
+import lib.mnemonic as mnemonic
+from lib.mnemonic import MnemonicError
+
+
+# From the BIP39 reference test vectors; the passphrase is TREZOR
+VECTORS = [
+    ('00000000000000000000000000000000',
+     'abandon abandon abandon abandon abandon abandon abandon abandon '
+     'abandon abandon abandon about',
+     'c55257c360c07c72029aebc1b53c05ed0362ada38ead3e3e9efa3708e5349553'
+     '1f09a6987599d18264c1e1c92f2cf141630c7a3c4ab7c81b2f001698e7463b04'),
+    ('7f7f7f7f7f7f7f7f7f7f7f7f7f7f7f7f',
+     'legal winner thank year wave sausage worth useful legal winner '
+     'thank yellow',
+     '2e8905819b8723fe2c1d161860e5ee1830318dbf49a83bd451cfb8440c28bd6f'
+     'a457fe1296106559a3c80937a1c1069be3a3a5bd381ee6260e8d9739fce1f607'),
+    ('ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff',
+     'zoo zoo zoo zoo zoo zoo zoo zoo zoo zoo zoo zoo zoo zoo zoo zoo zoo '
+     'zoo zoo zoo zoo zoo zoo vote',
+     'dd48c104698c30cfe2b6142103248622fb7bb0ff692eebb00089b32d22484e16'
+     '13912f0a5b694407be899ffd31ed3992c456cdf60f5d4564b8ba3f05a69890ad'),
+]
+
+
+def test_wordlist():
+    words = mnemonic.wordlist()
+    assert len(words) == len(set(words)) == 2048
+    assert words[0] == 'abandon' and words[-1] == 'zoo'
+    assert words == sorted(words)
+    assert mnemonic.word_index()['zoo'] == 2047
+
+
+@pytest.mark.parametrize('entropy, sentence, seed', VECTORS)
+def test_vectors(entropy, sentence, seed):
+    entropy = bytes.fromhex(entropy)
+    assert mnemonic.entropy_to_mnemonic(entropy) == sentence
+    assert mnemonic.mnemonic_to_entropy(sentence) == entropy
+    assert mnemonic.is_valid(sentence)
+    assert mnemonic.mnemonic_to_seed(sentence, 'TREZOR').hex() == seed
+    # Whitespace does not matter
+    spaced = '  ' + sentence.replace(' ', ' \t ') + '\n'
+    assert mnemonic.mnemonic_to_seed(spaced, 'TREZOR').hex() == seed
+
+
+def test_entropy_lengths():
+    for count in mnemonic.WORD_COUNTS:
+        sentence = mnemonic.make_mnemonic(count * 32 // 3)
+        assert len(sentence.split()) == count
+        assert mnemonic.is_valid(sentence)
+    with pytest.raises(MnemonicError):
+        mnemonic.entropy_to_mnemonic(bytes(15))
+
+
+def test_invalid():
+    with pytest.raises(MnemonicError) as e:
+        mnemonic.mnemonic_to_entropy('abandon ' * 11 + 'abandon')
+    assert 'checksum' in str(e.value)
+    with pytest.raises(MnemonicError) as e:
+        mnemonic.mnemonic_to_entropy('abandon ' * 11 + 'abandonn')
+    assert 'abandonn' in str(e.value)
+    with pytest.raises(MnemonicError):
+        mnemonic.mnemonic_to_entropy('abandon ' * 10 + 'about')
+    assert not mnemonic.is_valid('')
+    assert mnemonic.indices_entropy([0] * 12) is None
+    assert mnemonic.indices_entropy([0] * 11 + [3]) == bytes(16)
@@ -0,0 +1,92 @@
+#
+# Tests of lib/recovery.py
+#
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import lib.mnemonic as mnemonic
+from lib.bip32 import parse_path, pubkey_from_seed
+from lib.hash import hash160
+from lib.recovery import (DEFAULT_PATH, RecoveryError, candidate_rate,
+                          combinations, edit_distance, recover,
+                          similar_words, word_options)
+
+
+SENTENCE = mnemonic.entropy_to_mnemonic(bytes(range(3, 19)))
+PATH = parse_path(DEFAULT_PATH)
+
+
+def target(sentence, passphrase=''):
+    seed = mnemonic.mnemonic_to_seed(sentence, passphrase)
+    return hash160(pubkey_from_seed(seed, PATH))
+
+
+def damaged(**changes):
+    words = SENTENCE.split()
+    for pos, word in changes.items():
+        words[int(pos[1:])] = word
+    return words
+
+
+def test_edit_distance():
+    assert edit_distance('abandon', 'abandon', 2) == 0
+    assert edit_distance('abandon', 'abnadon', 2) == 1
+    assert edit_distance('abandon', 'abando', 2) == 1
+    assert edit_distance('kitten', 'sitting', 5) == 3
+    assert edit_distance('kitten', 'sitting', 2) == 3
+    assert edit_distance('zoo', 'abandon', 2) == 3
+
+
+def test_word_options():
+    index = mnemonic.word_index()
+    assert similar_words('abandon')[0] == index['abandon']
+    assert index['ability'] in similar_words('abiltiy')
+
+    words = damaged(w3='?', w5=SENTENCE.split()[5] + '?', w7='zzzzzz')
+    with pytest.raises(RecoveryError):
+        word_options(words)
+    words[7] = 'lik'
+    options = word_options(words)
+    assert len(options[3]) == 2048
+    assert index[SENTENCE.split()[5]] in options[5]
+    assert index['like'] in options[7]
+    assert combinations(options) == 2048 * len(options[5]) * len(options[7])
+    with pytest.raises(mnemonic.MnemonicError):
+        word_options(words[:11])
+
+
+def test_recover_serial():
+    words = damaged(w3='?', w8='asthna')
+    progress = []
+    result = recover(word_options(words), target(SENTENCE), PATH,
+                     chunk_size=64, on_progress=progress.append)
+    assert result.mnemonic == SENTENCE
+    assert 0 < result.candidates <= result.combinations
+    assert candidate_rate(result) > 0
+    assert [r.combinations for r in progress] == \
+        [64 * n for n in range(1, len(progress) + 1)]
+
+    # A passphrase changes the seed
+    result = recover(word_options(damaged(w3='?')),
+                     target(SENTENCE, 'secret'), PATH, passphrase='secret')
+    assert result.mnemonic == SENTENCE
+    result = recover(word_options(damaged(w3='?')), target(SENTENCE), PATH,
+                     passphrase='secret')
+    assert result.mnemonic is None
+    assert result.combinations == 2048
+
+
+def test_recover_parallel():
+    '''The search stops early once a match is found.'''
+    words = damaged(w3='?', w9='joy?')
+    options = word_options(words)
+    total = combinations(options)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        result = recover(options, target(SENTENCE), PATH,
+                         executor=executor, workers=2, chunk_size=256)
+    assert result.mnemonic == SENTENCE
+    # The unknown word, varying slowest, is 'asthma', early in the
+    # wordlist
+    assert result.combinations < total // 4
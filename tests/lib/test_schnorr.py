@@ -0,0 +1,101 @@
+#
+# Tests of lib/schnorr.py
+#
+
+import random
+from hashlib import sha256
+
+import pytest
+
+import lib.schnorr as schnorr
+
+from tests.lib.test_bip32 import mprivkey
+
+
+def keypair(n):
+    privkey = mprivkey.child(n)
+    return privkey, privkey.public_key.pubkey_bytes
+
+
+def test_vector():
+    # From the BCH Schnorr specification: private key 1, zero message
+    pubkey = bytes.fromhex('0279BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798')
+    sig = bytes.fromhex('787A848E71043D280C50470E8E1532B2DD5D20EE912A45DBDD2BD1DFBF187EF6'
+                        '7031A98831859DC34DFFEEDDA86831842CCD0079E1F92AF177F7F22CC1DCED05')
+    assert schnorr.verify(pubkey, bytes(32), sig)
+    assert schnorr.batch_verify([(pubkey, bytes(32), sig)])
+
+
+def test_sign_verify():
+    for n in range(5):
+        privkey, pubkey = keypair(n)
+        msg = sha256(bytes([n])).digest()
+        sig = schnorr.sign(privkey, msg)
+        assert len(sig) == 64
+        assert sig == schnorr.sign(privkey.privkey_bytes, msg)
+        assert schnorr.verify(pubkey, msg, sig)
+        assert not schnorr.verify(pubkey, bytes(32), sig)
+        assert not schnorr.verify(keypair(n + 1)[1], msg, sig)
+        bad = sig[:63] + bytes([sig[63] ^ 1])
+        assert not schnorr.verify(pubkey, msg, bad)
+
+
+def test_errors():
+    privkey, pubkey = keypair(0)
+    with pytest.raises(schnorr.SchnorrError):
+        schnorr.sign(privkey, bytes(31))
+    with pytest.raises(schnorr.SchnorrError):
+        schnorr.verify(pubkey, bytes(32), bytes(63))
+    with pytest.raises(schnorr.SchnorrError):
+        schnorr.verify(pubkey[1:], bytes(32), bytes(64))
+    # s out of range
+    assert not schnorr.verify(pubkey, bytes(32), bytes(32) + b'\xff' * 32)
+
+
+def test_multi_scalar_mul():
+    rng = random.Random(1)
+    G = schnorr.GENERATOR
+    pairs = []
+    expected = None
+    for n in range(1, 40):
+        point = G * n
+        scalar = rng.randrange(schnorr.ORDER)
+        pairs.append((scalar, (point.x(), point.y())))
+        expected = point * scalar if expected is None else expected + point * scalar
+    X, Y, Z = schnorr.multi_scalar_mul(pairs)
+    zinv = pow(Z, schnorr.P - 2, schnorr.P)
+    assert X * zinv * zinv % schnorr.P == expected.x()
+    assert Y * zinv ** 3 % schnorr.P == expected.y()
+    assert schnorr.multi_scalar_mul([]) is None
+    assert schnorr.multi_scalar_mul([(schnorr.ORDER, (G.x(), G.y()))]) is None
+
+
+def test_batch_verify(monkeypatch):
+    items = []
+    for n in range(64):
+        privkey, pubkey = keypair(n % 8)
+        msg = sha256(n.to_bytes(2, 'big')).digest()
+        items.append((pubkey, msg, schnorr.sign(privkey, msg)))
+    assert schnorr.batch_verify(items)
+    assert schnorr.batch_verify([])
+
+    pubkey, msg, sig = items[17]
+    assert not schnorr.batch_verify(items[:17] + [(pubkey, bytes(32), sig)]
+                                    + items[18:])
+    assert not schnorr.batch_verify(items + [(pubkey, msg, bytes(64))])
+
+    # Count point operations, not time: verifying separately takes at
+    # least 256 doublings a signature
+    ops = 0
+
+    def counting(func):
+        def counted(*args):
+            nonlocal ops
+            ops += 1
+            return func(*args)
+        return counted
+
+    monkeypatch.setattr(schnorr, '_add', counting(schnorr._add))
+    monkeypatch.setattr(schnorr, '_double', counting(schnorr._double))
+    assert schnorr.batch_verify(items)
+    assert 0 < ops < len(items) * 256
@@ -0,0 +1,77 @@
+#
+# Tests of lib/serialize.py
+#
+
+import pytest
+
+from lib.hash import double_sha256, hash_to_hex_str
+from lib.serialize import (Writer, read_varint, read_merkle_branch,
+                           serialize_tx, unpack_header_from, varint_len)
+from lib.tx import Deserializer
+from lib.util import int_to_varint
+
+from tests.lib.test_tx import GENESIS_HEADER, GENESIS_TX, make_tx
+
+
+@pytest.mark.parametrize('value', [0, 1, 252, 253, 65535, 65536,
+                                   (1 << 32) - 1, 1 << 32, (1 << 64) - 1])
+def test_varint(value):
+    writer = Writer()
+    writer.write_varint(value)
+    raw = writer.getvalue()
+    assert raw == int_to_varint(value)
+    assert len(raw) == varint_len(value)
+    assert read_varint(b'x' + raw + b'y', 1) == (value, 1 + len(raw))
+
+
+def test_varint_negative():
+    with pytest.raises(ValueError):
+        Writer().write_varint(-1)
+
+
+@pytest.mark.parametrize('raw', [GENESIS_TX, make_tx(3, 5),
+                                 make_tx(1, 300, script_len=300)],
+                         ids=['genesis', 'small', 'long_scripts'])
+def test_tx_round_trip(raw):
+    tx = Deserializer(raw).read_tx()
+    assert serialize_tx(tx.version, list(tx.inputs()), list(tx.outputs()),
+                        tx.locktime) == raw
+
+
+def test_payout_tx():
+    outputs = [(n * 546, bytes([0x76, 0xa9, 20]) + n.to_bytes(20, 'big')
+                + bytes([0x88, 0xac])) for n in range(1000)]
+    inputs = [(bytes(32), 0, bytes(107), 0xffffffff)]
+    raw = serialize_tx(1, inputs, outputs, 0)
+    tx = Deserializer(raw).read_tx()
+    assert tx.size() == len(raw) == 4 + 1 + 41 + 107 + 3 + 1000 * 34 + 4
+    assert [(value, bytes(script)) for value, script in tx.outputs()] == outputs
+
+
+def test_writer_reuse():
+    writer = Writer()
+    writer.write_le_uint32(7)
+    writer.write_le_int32(-1)
+    writer.write_le_int64(-2)
+    assert len(writer) == 16
+    writer.clear()
+    writer.write_varbytes(b'abc')
+    assert writer.getvalue() == b'\3abc'
+
+
+def test_header():
+    fields = unpack_header_from(GENESIS_HEADER)
+    assert fields[0] == 1 and fields[-1] == 2083236893
+    writer = Writer()
+    writer.write_header(*fields)
+    assert writer.getvalue() == GENESIS_HEADER
+    assert hash_to_hex_str(double_sha256(writer.getvalue())).startswith('00000000')
+
+
+def test_merkle_branch():
+    branch = [bytes([n]) * 32 for n in range(5)]
+    writer = Writer()
+    writer.write(b'pad')
+    writer.write_merkle_branch(branch, 19)
+    raw = writer.getvalue()
+    assert read_merkle_branch(raw, 3) == (branch, 19, len(raw))
@@ -0,0 +1,127 @@
+#
+# Tests of lib/sighash.py
+#
+
+import pytest
+from ecdsa.util import sigdecode_der
+
+import lib.bip32 as bip32
+import lib.sighash as sighash
+from lib.hash import double_sha256
+from lib.script import Script
+
+from tests.lib.test_bip32 import mprivkey
+
+
+def make_tx(n_inputs, n_outputs=3):
+    inputs = [(bytes([n % 256]) * 32, n, b'', 0xfffffffe - n)
+              for n in range(n_inputs)]
+    outputs = [(10000 * (n + 1), Script.P2PKH_script(n.to_bytes(20, 'big')))
+               for n in range(n_outputs)]
+    return sighash.TxSigHasher(2, inputs, outputs, 500000)
+
+
+def naive_digest(hasher, n, script_code, value, sighash_type):
+    '''Straight from the specification, recomputing everything.'''
+    def le(value, size):
+        return value.to_bytes(size, 'little', signed=True)
+
+    base = sighash_type & 0x1f
+    acp = sighash_type & sighash.SIGHASH_ANYONECANPAY
+    zero = bytes(32)
+    prevouts = b''.join(h + le(i, 4) for h, i, _, _ in hasher.inputs)
+    sequences = b''.join(le(s, 8)[:4] for _, _, _, s in hasher.inputs)
+    outputs = [le(v, 8) + bytes([len(s)]) + s for v, s in hasher.outputs]
+    if base == sighash.SIGHASH_ALL:
+        hash_outputs = double_sha256(b''.join(outputs))
+    elif base == sighash.SIGHASH_SINGLE and n < len(outputs):
+        hash_outputs = double_sha256(outputs[n])
+    else:
+        hash_outputs = zero
+    prev_hash, prev_idx, _, sequence = hasher.inputs[n]
+    preimage = (le(hasher.version, 4)
+                + (zero if acp else double_sha256(prevouts))
+                + (zero if acp or base != sighash.SIGHASH_ALL
+                   else double_sha256(sequences))
+                + prev_hash + le(prev_idx, 4)
+                + bytes([len(script_code)]) + script_code
+                + le(value, 8) + le(sequence, 8)[:4] + hash_outputs
+                + le(hasher.locktime, 4)
+                + le(sighash_type | sighash.SIGHASH_FORKID, 4))
+    return double_sha256(preimage)
+
+
+@pytest.mark.parametrize('sighash_type', [
+    sighash.SIGHASH_ALL, sighash.SIGHASH_NONE, sighash.SIGHASH_SINGLE,
+    sighash.SIGHASH_ALL | sighash.SIGHASH_ANYONECANPAY,
+    sighash.SIGHASH_SINGLE | sighash.SIGHASH_ANYONECANPAY])
+def test_digest(sighash_type):
+    hasher = make_tx(5)
+    script_code = Script.P2PKH_script(bytes(20))
+    for n in range(5):
+        assert (hasher.digest(n, script_code, 12345, sighash_type)
+                == naive_digest(hasher, n, script_code, 12345, sighash_type))
+
+
+def test_fork_id():
+    hasher = make_tx(1)
+    assert hasher.sighash_type(sighash.SIGHASH_ALL) == 0x41
+    hasher.fork_id = 0xff0001
+    assert hasher.sighash_type(sighash.SIGHASH_ALL) == 0xff000141
+
+
+def test_errors():
+    hasher = make_tx(2)
+    with pytest.raises(sighash.SigHashError):
+        hasher.digest(2, b'', 0)
+    with pytest.raises(sighash.SigHashError):
+        hasher.digest(0, b'', 0, 0x04)
+
+
+def test_sign_inputs():
+    hasher = make_tx(4)
+    specs = [(n, (0, n), Script.P2PKH_script(bytes(20)), 5000 + n)
+             for n in range(4)]
+    signatures = sighash.sign_inputs(hasher, mprivkey, specs)
+    order = bip32.MasterPrivKey.CURVE.order
+    for (n, path, script_code, value), signature in zip(specs, signatures):
+        assert signature[-1] == 0x41
+        verifying_key = bip32.derive_path(mprivkey, path).public_key.verifying_key
+        digest = hasher.digest(n, script_code, value)
+        assert verifying_key.verify_digest(signature[:-1], digest,
+                                           sigdecode=sigdecode_der)
+        # Low-S
+        assert sigdecode_der(signature[:-1], order)[1] <= order // 2
+
+
+def test_derive_path_cache():
+    cache = {}
+    key = bip32.derive_path(mprivkey, (1, 5), cache)
+    assert key.extended_key(bytes(4)) == mprivkey.child(1).child(5).extended_key(bytes(4))
+    assert set(cache) == {(1, ), (1, 5)}
+    assert bip32.derive_path(mprivkey, (1, 5), cache) is key
+    assert bip32.derive_path(mprivkey, (), cache) is mprivkey
+
+
+def test_linear_scaling(monkeypatch):
+    script_code = Script.P2PKH_script(bytes(20))
+    hashed = 0
+
+    def counting_double_sha256(x):
+        nonlocal hashed
+        hashed += len(x)
+        return double_sha256(x)
+
+    monkeypatch.setattr(sighash, 'double_sha256', counting_double_sha256)
+
+    def digest_all(count):
+        nonlocal hashed
+        hashed = 0
+        hasher = make_tx(count, 1000)
+        for n in range(count):
+            hasher.digest(n, script_code, 1000)
+        return hashed
+
+    # Bytes hashed, not time; quadratic behaviour would make this ratio
+    # about 25
+    assert digest_all(5000) < 6 * digest_all(1000)
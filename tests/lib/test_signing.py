@@ -0,0 +1,42 @@
+#
+# Tests of lib/signing.py
+#
+
+from hashlib import sha256
+
+import pytest
+from ecdsa.util import sigencode_der_canonize
+
+import lib.signing as signing
+from lib.bip32 import MasterPrivKey
+
+from tests.lib.test_bip32 import mprivkey
+
+
+def test_matches_python_ecdsa():
+    for n in range(20):
+        key = mprivkey.child(n)
+        digest = sha256(bytes([n])).digest()
+        expected = key.signing_key.sign_digest_deterministic(
+            digest, hashfunc=sha256, sigencode=sigencode_der_canonize)
+        assert signing.sign_digest(key.secret_exponent(), digest) == expected
+        assert signing.sign_batch([(key, digest)]) == [expected]
+
+
+def test_key_types():
+    digest = bytes(32)
+    expected = signing.sign_batch([(mprivkey, digest)])
+    assert signing.sign_batch([(mprivkey.privkey_bytes, digest)]) == expected
+    assert signing.sign_batch([(mprivkey.secret_exponent(), digest)]) == expected
+    for bad in (0, MasterPrivKey.CURVE.order, bytes(32)):
+        with pytest.raises(ValueError):
+            signing.sign_batch([(bad, digest)])
+
+
+def test_parallel_identical():
+    pairs = [(mprivkey.secret_exponent() + n, sha256(n.to_bytes(4, 'big')).digest())
+             for n in range(200)]
+    serial = signing.sign_batch(pairs)
+    with signing.signing_pool(max_workers=2) as executor:
+        parallel = signing.sign_batch(pairs, executor, chunk_size=16)
+    assert parallel == serial
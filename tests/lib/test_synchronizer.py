@@ -0,0 +1,87 @@
+#
+# Tests of lib/synchronizer.py
+#
+
+import asyncio
+import time
+
+import pytest
+
+from lib.synchronizer import (Scheduler, PRIORITY_ACTIVE, PRIORITY_RECEIVE,
+                              PRIORITY_CHANGE, PRIORITY_DORMANT)
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_priority_order():
+    order = []
+
+    async def func(item):
+        order.append(item)
+
+    async def main():
+        scheduler = Scheduler(func, max_in_flight=1)
+        scheduler.add('dormant', PRIORITY_DORMANT)
+        scheduler.add('change', PRIORITY_CHANGE)
+        scheduler.add('receive1', PRIORITY_RECEIVE)
+        scheduler.add('receive2', PRIORITY_RECEIVE)
+        scheduler.add('active', PRIORITY_ACTIVE)
+        assert scheduler.queue_depth() == 5
+        await scheduler.join()
+        assert scheduler.metrics()['completed'] == 5
+
+    run(main())
+    assert order == ['active', 'receive1', 'receive2', 'change', 'dormant']
+
+
+def test_backpressure():
+    peak = 0
+    scheduler = None
+
+    async def func(item):
+        nonlocal peak
+        peak = max(peak, scheduler.in_flight)
+        await asyncio.sleep(0.001)
+        if item == 13:
+            raise ValueError('server error')
+
+    async def main():
+        nonlocal scheduler
+        scheduler = Scheduler(func, max_in_flight=4)
+        for n in range(40):
+            scheduler.add(n, PRIORITY_RECEIVE)
+        await asyncio.sleep(0)
+        assert scheduler.in_flight == 4
+        assert scheduler.queue_depth() == 36
+        await scheduler.join()
+        metrics = scheduler.metrics()
+        assert metrics['completed'] == 40
+        assert metrics['errors'] == 1
+        assert metrics['in_flight'] == metrics['queue_depth'] == 0
+        assert metrics['throughput'] == 4.0
+
+    run(main())
+    assert peak == 4
+
+
+def test_rate_limit():
+    async def func(item):
+        pass
+
+    async def main():
+        scheduler = Scheduler(func, rate=200, burst=5)
+        start = time.monotonic()
+        for n in range(25):
+            scheduler.add(n, PRIORITY_RECEIVE)
+        await scheduler.join()
+        # 5 in the initial burst, then 20 at 200 per second
+        assert time.monotonic() - start >= 0.09
+
+    run(main())
+
+
+def test_bad_args():
+    with pytest.raises(ValueError):
+        Scheduler(None, max_in_flight=0)
@@ -0,0 +1,95 @@
+#
+# Tests of lib/tx.py
+#
+
+import pytest
+
+from lib.hash import double_sha256, hash_to_hex_str
+from lib.tx import Deserializer
+from lib.util import int_to_varint
+
+
+GENESIS_HEADER = bytes.fromhex(
+    '0100000000000000000000000000000000000000000000000000000000000000'
+    '000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa'
+    '4b1e5e4a29ab5f49ffff001d1dac2b7c')
+GENESIS_TX = bytes.fromhex(
+    '01000000010000000000000000000000000000000000000000000000000000000000'
+    '000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32'
+    '303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e6420'
+    '6261696c6f757420666f722062616e6b73ffffffff0100f2052a0100000043410467'
+    '8afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc'
+    '3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000')
+GENESIS_TXID = '4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b'
+
+
+def make_tx(n_inputs, n_outputs, script_len=25):
+    parts = [(2).to_bytes(4, 'little'), int_to_varint(n_inputs)]
+    for n in range(n_inputs):
+        parts += [bytes([n % 256]) * 32, n.to_bytes(4, 'little'),
+                  int_to_varint(107), bytes(107), b'\xff' * 4]
+    parts.append(int_to_varint(n_outputs))
+    for n in range(n_outputs):
+        parts += [(n * 1000).to_bytes(8, 'little'), int_to_varint(script_len),
+                  n.to_bytes(script_len, 'big')]
+    parts.append((12345).to_bytes(4, 'little'))
+    return b''.join(parts)
+
+
+def test_genesis_tx():
+    tx = Deserializer(GENESIS_TX).read_tx()
+    assert tx.txid() == GENESIS_TXID
+    assert tx.version == 1 and tx.locktime == 0
+    assert tx.size() == len(GENESIS_TX)
+    inputs = list(tx.inputs())
+    assert len(inputs) == 1 and inputs[0].is_coinbase()
+    assert bytes(inputs[0].script)[8:].startswith(b'The Times 03/Jan/2009')
+    outputs = list(tx.outputs())
+    assert len(outputs) == 1
+    assert outputs[0].value == 50 * 100000000
+    assert len(outputs[0].script) == 67
+
+
+def test_zero_copy():
+    raw = make_tx(3, 300)
+    tx = Deserializer(raw).read_tx()
+    assert tx.raw().obj is raw
+    outputs = list(tx.outputs())
+    assert len(outputs) == 300
+    assert all(output.script.obj is raw for output in outputs)
+    assert outputs[299].value == 299000
+    # Script slices can be looked up in a set of bytes
+    wanted = {(7).to_bytes(25, 'big'), (250).to_bytes(25, 'big')}
+    assert [n for n, script in tx.output_scripts() if script in wanted] == [7, 250]
+    inputs = list(tx.inputs())
+    assert inputs[2].prev_idx == 2 and bytes(inputs[2].prev_hash) == b'\2' * 32
+    assert not inputs[0].is_coinbase()
+    assert tx.tx_hash() == double_sha256(raw)
+
+
+def test_varints():
+    # Counts and scripts needing 3-byte varints
+    raw = make_tx(1, 300, script_len=300)
+    tx = Deserializer(raw).read_tx()
+    assert tx.size() == len(raw)
+    assert len(list(tx.outputs())[-1].script) == 300
+
+
+def test_block():
+    txs = [make_tx(1, n + 1) for n in range(5)]
+    block = GENESIS_HEADER + int_to_varint(6) + GENESIS_TX + b''.join(txs)
+    header, block_txs = Deserializer(block).read_block()
+    assert hash_to_hex_str(double_sha256(header)) == (
+        '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f')
+    block_txs = list(block_txs)
+    assert block_txs[0].txid() == GENESIS_TXID
+    assert [tx.tx_hash() for tx in block_txs[1:]] == [double_sha256(tx)
+                                                      for tx in txs]
+    assert block_txs[-1].end == len(block)
+
+
+def test_truncated():
+    raw = make_tx(2, 2)
+    for length in (0, 5, 60, len(raw) - 1):
+        with pytest.raises(ValueError):
+            Deserializer(raw[:length]).read_tx()
@@ -0,0 +1,147 @@
+#
+# Tests of lib/txcache.py
+#
+
+import asyncio
+import os
+
+import pytest
+
+from lib.hash import double_sha256, hash_to_hex_str, hex_str_to_hash
+from lib.synchronizer import Synchronizer
+from lib.txcache import TxCache, TxCacheError
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def make_txs(count, size=200):
+    txs = {}
+    for n in range(count):
+        raw = n.to_bytes(4, 'little') * (size // 4)
+        txs[double_sha256(raw)] = raw
+    return txs
+
+
+class TxSession(object):
+    '''Serves raw transactions and histories.'''
+
+    def __init__(self, txs, histories=None):
+        self.txs = txs
+        self.histories = histories or {}
+        self.requests = []
+
+    async def send_request(self, method, args):
+        self.requests.append(method)
+        if method == 'blockchain.transaction.get':
+            return self.txs[hex_str_to_hash(args[0])].hex()
+        return self.histories[args[0]]
+
+
+def test_memory_lru():
+    txs = make_txs(10)
+    cache = TxCache(None, max_bytes=1000)
+    for tx_hash, raw in txs.items():
+        cache.put(tx_hash, raw)
+    # Bounded by bytes: five 200-byte transactions fit
+    assert cache.memory_bytes == 1000
+    assert len(cache) == 5
+    hashes = list(txs)
+    assert cache.get(hashes[0]) is None
+    assert cache.get(hashes[5]) == txs[hashes[5]]
+    cache.put(hashes[0], txs[hashes[0]])
+    # hashes[5] was used recently so hashes[6] was evicted
+    assert hashes[5] in cache and hashes[6] not in cache
+    # Too big to keep in memory
+    cache.put(b'x' * 32, bytes(2000))
+    assert b'x' * 32 not in cache
+    assert cache.metrics()['hits'] == 1
+    assert cache.hit_rate() == 0.5
+
+
+def test_disk_tier(tmpdir):
+    path = str(tmpdir.join('txs'))
+    txs = make_txs(50)
+    cache = TxCache(None, path, max_bytes=1000)
+    for tx_hash, raw in txs.items():
+        cache.put(tx_hash, raw)
+    assert len(cache) == 50
+    assert len(cache.memory) == 5
+    for tx_hash, raw in txs.items():
+        assert cache.get(tx_hash) == raw
+    assert cache.bytes_saved == 50 * 200
+    cache.close()
+    assert os.path.getsize(path) == 50 * 200
+
+    # Reopening reads the index only
+    cache = TxCache(None, path)
+    assert len(cache) == 50 and not cache.memory
+    assert all(cache.get(tx_hash) == raw for tx_hash, raw in txs.items())
+    # Adding again does not grow the file
+    cache.put(*next(iter(txs.items())))
+    assert cache.disk_bytes == 50 * 200
+    cache.close()
+
+
+def test_torn_index(tmpdir):
+    path = str(tmpdir.join('txs'))
+    txs = make_txs(3)
+    cache = TxCache(None, path)
+    for tx_hash, raw in txs.items():
+        cache.put(tx_hash, raw)
+    cache.close()
+    # Lose the last transaction's data and tear its index record
+    with open(path, 'r+b') as f:
+        f.truncate(450)
+    with open(path + '.idx', 'r+b') as f:
+        f.truncate(os.path.getsize(path + '.idx') - 3)
+    cache = TxCache(None, path)
+    assert len(cache) == 2
+    tx_hash, raw = list(txs.items())[2]
+    cache.put(tx_hash, raw)
+    assert cache.get(tx_hash) == raw
+    cache.close()
+
+
+def test_fetch():
+    txs = make_txs(3)
+    session = TxSession(txs)
+    cache = TxCache(session)
+    tx_hash = next(iter(txs))
+    assert run(cache.fetch(tx_hash)) == txs[tx_hash]
+    assert run(cache.fetch(tx_hash)) == txs[tx_hash]
+    assert session.requests == ['blockchain.transaction.get']
+
+    bad_hash = b'\xff' * 32
+    txs[bad_hash] = b'bad'
+    with pytest.raises(TxCacheError):
+        run(cache.fetch(bad_hash))
+    assert bad_hash not in cache
+
+
+def test_prefetch_from_synchronizer():
+    txs = make_txs(20)
+    scripthash = bytes(32)
+    history = [{'tx_hash': hash_to_hex_str(tx_hash), 'height': n + 1}
+               for n, tx_hash in enumerate(txs)]
+    session = TxSession(txs, {hash_to_hex_str(scripthash): history})
+    cache = TxCache(session, max_in_flight=4)
+
+    async def handler(scripthash, status):
+        pass
+
+    async def main():
+        synchronizer = Synchronizer(session, handler, prefetch=cache.prefetch)
+        await synchronizer.get_history(scripthash)
+        # Already queued or cached; not fetched twice
+        await synchronizer.get_history(scripthash)
+        await cache.wait_prefetched()
+
+    run(main())
+    assert session.requests.count('blockchain.transaction.get') == 20
+    assert all(cache.get(tx_hash) == raw for tx_hash, raw in txs.items())
+    metrics = cache.metrics()
+    assert metrics['hit_rate'] == 1.0
+    assert metrics['bytes_saved'] == 20 * 200
+    assert metrics['prefetch_queue'] == 0
@@ -0,0 +1,275 @@
+#
+# Tests of lib/util.py
+#
+
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+
+import pytest
+
+import lib.bip32
+import lib.hash
+import lib.keys
+from lib import util
+
+
+class WithDict(object):
+
+    def __init__(self, x):
+        self.x = x
+
+    @util.lazyproperty
+    def double(self):
+        '''Twice x.'''
+        return self.x * 2
+
+
+class WithSlots(object):
+
+    __slots__ = ('x', '_double')
+
+    def __init__(self, x):
+        self.x = x
+
+    @util.lazyproperty
+    def double(self):
+        return self.x * 2
+
+
+class Tuple(namedtuple('Tuple', 'x')):
+
+    __slots__ = ()
+
+    @util.lazyproperty
+    def double(self):
+        return self.x * 2
+
+
+@pytest.mark.parametrize('cls', [WithDict, WithSlots, Tuple])
+def test_lazyproperty(cls):
+    descriptor = cls.__dict__['double']
+    computed = descriptor.computed
+    objs = [cls(n) for n in range(5)]
+    for _ in range(3):
+        assert [obj.double for obj in objs] == [0, 2, 4, 6, 8]
+    assert descriptor.computed == computed + 5
+    stats = descriptor.stats()
+    assert stats['computed'] == computed + 5
+    if cls is Tuple:
+        assert stats['hits'] >= 10 and stats['entries'] >= 5
+    else:
+        # Only computes are counted
+        assert set(stats) == {'computed'}
+    # The class is not polluted
+    assert cls.double is descriptor
+    assert cls(7).double == 14
+
+
+def test_lazyproperty_doc():
+    assert WithDict.double.__doc__ == 'Twice x.'
+
+
+def test_lru_cache_count():
+    cache = util.LRUCache('test', maxsize=3, register=False)
+    for n in range(3):
+        cache.put(n, n)
+    assert cache.get(0) == 0
+    cache.put(3, 3)
+    # 1 was least recently used
+    assert 1 not in cache and 0 in cache
+    assert cache.get(1, 'missing') == 'missing'
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    assert stats['evictions'] == 1 and stats['entries'] == 3
+    assert stats['hit_rate'] == 0.5
+
+
+def test_lru_cache_fifo():
+    cache = util.LRUCache('test', maxsize=3, policy='fifo', register=False)
+    for n in range(3):
+        cache.put(n, n)
+    assert cache.get(0) == 0
+    cache.put(3, 3)
+    assert 0 not in cache and 1 in cache
+    with pytest.raises(ValueError):
+        util.LRUCache('test', policy='random', register=False)
+    with pytest.raises(ValueError):
+        util.LRUCache('test', maxsize=None, register=False)
+
+
+def test_lru_cache_bytes():
+    cache = util.LRUCache('test', maxsize=None, max_bytes=1000,
+                          sizeof=lambda key, value: len(value),
+                          register=False)
+    for n in range(10):
+        cache.put(n, bytes(300))
+    assert len(cache) == 3 and cache.nbytes == 900
+    cache.put(9, bytes(100))
+    assert cache.nbytes == 700
+    assert cache.pop(8) == bytes(300)
+    assert cache.pop(8, 'gone') == 'gone'
+    assert cache.nbytes == 400
+    cache.clear()
+    assert not len(cache) and cache.nbytes == 0
+    assert cache.stats()['evictions'] == 7
+
+
+def test_memoize():
+    calls = []
+
+    @util.memoize(maxsize=2, name='test.square')
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert [square(2), square(2), square(3), square(2)] == [4, 4, 9, 4]
+    assert calls == [2, 3]
+    assert square.__name__ == 'square'
+    assert square.cache.stats()['hits'] == 2
+    assert util.cache_registry.stats()['test.square']['misses'] == 2
+
+    # Unhashable arguments are computed each time
+    @util.memoize()
+    def first(seq):
+        return seq[0]
+
+    assert first(bytearray(b'ab')) == first(bytearray(b'ab')) == 97
+    assert len(first.cache) == 0
+
+
+def test_threads():
+    @util.memoize(maxsize=50)
+    def ident(x):
+        return x
+
+    def work(offset):
+        for n in range(2000):
+            assert ident((n + offset) % 100) == (n + offset) % 100
+
+    threads = [threading.Thread(target=work, args=(n, )) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = ident.cache.stats()
+    assert stats['hits'] + stats['misses'] == 8000
+    assert stats['entries'] <= 50
+
+
+def test_registry():
+    names = util.cache_registry.stats()
+    for name in ('lib.hash.Base58.encode_check',
+                 'lib.hash.Base58.decode_check',
+                 'lib.bip32.MasterPubKey.pubkey_bytes',
+                 'lib.bip32.MasterPrivKey.public_key',
+                 'lib.keys.PublicKeyBase.address',
+                 'lib.keys.Address.scripthash'):
+        assert name in names
+    util.cache_registry.clear()
+
+
+class Logged(util.LoggedClass):
+    pass
+
+
+class Counted(object):
+    '''Counts how often it is formatted.'''
+
+    count = 0
+
+    def __str__(self):
+        Counted.count += 1
+        return 'counted'
+
+
+def test_lazy_formatting(caplog):
+    obj = Logged()
+    arg = Counted()
+    with caplog.at_level(logging.INFO, logger='Logged'):
+        obj.log_debug('value %s', arg)
+        assert Counted.count == 0
+        obj.log_info('value %s', arg)
+    assert Counted.count
+    assert caplog.messages == ['value counted']
+
+
+def test_throttle(caplog, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(util.time, 'monotonic', lambda: now[0])
+    obj = Logged()
+    with caplog.at_level(logging.INFO, logger='Logged'):
+        for n in range(10):
+            obj.log_info('failed %d', n, throttle=True)
+        obj.log_info('other', throttle=True)
+        now[0] += obj.LOG_WINDOW
+        obj.log_info('failed %d', 10, throttle=True)
+        obj.log_info('failed %d', 11, throttle=True)
+    assert caplog.messages == [
+        'failed 0', 'failed 1', 'failed 2 (throttling similar messages)',
+        'other', 'failed 9 (7 similar messages suppressed)', 'failed 10',
+        'failed 11']
+
+
+def test_throttle_then_silence(caplog, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(util.time, 'monotonic', lambda: now[0])
+    obj = Logged()
+    with caplog.at_level(logging.INFO, logger='Logged'):
+        for n in range(5):
+            obj.log_info('failed %d', n, throttle=True)
+        now[0] += obj.LOG_WINDOW / 2
+        obj.log_info('unrelated')
+        now[0] += obj.LOG_WINDOW / 2
+        # Any later log call reports the suppressions
+        obj.log_debug('unrelated')
+    assert caplog.messages[3:] == [
+        'unrelated', 'failed 4 (2 similar messages suppressed)']
+    assert not obj.rate_limits
+
+
+def test_throttle_flush_on_loop(caplog):
+    obj = Logged()
+    obj.LOG_WINDOW = 0.05
+
+    async def burst():
+        for n in range(5):
+            obj.log_info('failed %d', n, throttle=True)
+        await asyncio.sleep(0.2)
+
+    with caplog.at_level(logging.INFO, logger='Logged'):
+        asyncio.get_event_loop().run_until_complete(burst())
+    assert caplog.messages[-1] == 'failed 4 (2 similar messages suppressed)'
+
+
+def test_progress(caplog, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(util.time, 'monotonic', lambda: now[0])
+    obj = Logged()
+    with caplog.at_level(logging.DEBUG, logger='Logged'):
+        progress = obj.progress('keys', 2500, every=1000, interval=5.0)
+        for n in range(5):
+            progress.update(200)
+        now[0] += 6
+        progress.update(100)
+        progress.update(1400)
+        progress.done()
+    assert caplog.messages == ['keys: 1,000/2,500 (40%)',
+                               'keys: 1,100/2,500 (44%)',
+                               'keys: 2,500/2,500 (100%)',
+                               'keys: done 2,500 in 6.00s']
+    assert [record.levelno for record in caplog.records][-1] == logging.INFO
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger='Logged'):
+        progress = obj.progress('short')
+        progress.update(10)
+        progress.done()
+    assert not caplog.messages
+
+
+def test_lazy_import():
+    assert util.lazy_import('lib.util') is util
+    with pytest.raises(ImportError):
+        util.lazy_import('lib.no_such_module')
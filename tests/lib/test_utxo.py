@@ -0,0 +1,63 @@
+#
+# Tests of lib/utxo.py
+#
+
+from lib.utxo import UTXO, UTXOSet
+
+
+def utxo(n, value, addr='a'):
+    return UTXO(n.to_bytes(32, 'little'), 0, value, 100, addr)
+
+
+def test_add_spend():
+    utxos = UTXOSet()
+    coins = [utxo(n, value) for n, value in enumerate((500, 100, 300, 100))]
+    for coin in coins:
+        utxos.add(coin)
+    utxos.add(coins[0])
+    assert len(utxos) == 4
+    assert utxos.total() == 1000
+    assert coins[2].outpoint in utxos
+    assert utxos.get(*coins[2].outpoint) == coins[2]
+    assert utxos.spend(*coins[2].outpoint) == coins[2]
+    assert utxos.spend(*coins[2].outpoint) is None
+    assert [coin.value for coin in utxos.largest()] == [500, 100, 100]
+    assert len(utxos.by_value) == 3
+
+
+def test_value_range():
+    utxos = UTXOSet()
+    for n in range(10):
+        utxos.add(utxo(n, (n + 1) * 10))
+    assert [coin.value for coin in utxos.value_range(20, 50)] == [50, 40, 30, 20]
+    assert [coin.value for coin in utxos.value_range(20, 50, 2)] == [50, 40]
+    assert utxos.value_range(101, 200) == []
+
+
+def test_update():
+    utxos = UTXOSet()
+    utxos.update(utxo(n, value) for n, value in enumerate((30, 10, 20)))
+    utxos.update([utxo(0, 30)])
+    assert len(utxos) == 3
+    assert [value for value, *_ in utxos.by_value] == [10, 20, 30]
+
+
+def test_remove_address():
+    utxos = UTXOSet()
+    utxos.update([utxo(0, 3000, 'a'), utxo(1, 1500, 'b')])
+    utxos.remove_address('b')
+    assert [coin.value for coin in utxos] == [3000]
+
+
+def test_rollback():
+    utxos = UTXOSet()
+    a, b, c, d = (n.to_bytes(32, 'little') for n in range(1, 5))
+    utxos.update([UTXO(a, 0, 5000, 100, 'x'), UTXO(b, 1, 1900, 101, 'x'),
+                  UTXO(c, 0, 2800, 102, 'z'), UTXO(d, 0, 700, 0, 'y')])
+    assert utxos.rollback(102) == {'z'}
+    assert sorted(utxo.value for utxo in utxos) == [700, 1900, 5000]
+    assert utxos.rollback(200) == set()
+    assert utxos.rollback(101) == {'x'}
+    # Unconfirmed UTXOs are kept
+    assert sorted(utxo.value for utxo in utxos) == [700, 5000]
+    assert len(utxos.by_value) == 2